@@ -0,0 +1,218 @@
+# Acquisition throughput benchmark. Runs every measurement protocol on the emulated rig (UtilsSimulation.py)
+# and reports the seconds per data point, split into phases (switching, source, settle, acquire, file write,
+# plotting, ...). The result is compared against a baseline file so that slower code is caught before an
+# overnight scan.
+#
+# Usage (from the repository folder):
+#   python BenchmarkAcquisition.py                      run and compare with BenchmarkAcquisition_baseline.json
+#   python BenchmarkAcquisition.py --save-baseline      run and store the result as the new baseline
+#   python BenchmarkAcquisition.py --protocols RvsT RvsAngle --modes DC
+#   python BenchmarkAcquisition.py --latency lab.json   replay per-command latencies measured on the real rig
+#                                                       (JSON of SimRig latencies, e.g. {"2182": 0.018, "2182:fetch?": 0.021})
+#
+# Times are in clock time of the VirtualClock: every wait and instrument latency counts at its real length,
+# plus the real time spent computing (file writes and plotting). Plotting and file writes depend on the
+# computer and its load, so they are reported but left out of the regression check (also out of the total).
+# The committed baseline is saved with --save-baseline --no-plot.
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import warnings
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from UtilsMeasurementSetup import *
+from UtilsBasic import *
+from UtilsSimulation import *
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'BenchmarkAcquisition_baseline.json')
+PROTOCOLS = ['RvsT', 'RvsH', 'RvsAngle', 'RvsAnglePulse', 'RvsAnglePulseField', 'PulseAmplitudeSeries']
+MODES = ['DC', 'Buffered', 'Triggered', 'Delta', 'PulseDelta']
+# Time not spent in any phase of MeasurementSettings (PPMS setpoints, file header, ...)
+OUTER_PHASE = 'Setpoints/Other'
+# Phases that are real computing time rather than waits and instrument latency
+WALL_PHASES = ['Plotting', 'FileWrite']
+
+
+def makeMeasurement(Mode, Latency={}, PlotData=True, Seed=0):
+    # Hall bar on the rotator puck with the switch, a 2400 + 2182 for DC and a 6221 for (pulse) delta and pulses.
+    # Buffered reads the 2182 trace buffer, Triggered starts the 2182 from the 2400 over the trigger link.
+    Rig=SimRig(Latency=Latency, Seed=Seed)
+    Rig.setSample(SimSample(R0=500, MR=2e-3), SwitchPairs=['e,k', 'c,l', 'a,p', 'b,n'])
+    Rig.setSample(SimSample(R0=500, MR=2e-3), SwitchPairs=['e,k', 'c,l', 'a,o', 'b,m'])
+    Rig.setSample(SimSample(R0=1, MR=0, Hall=1e-5), SwitchPairs=['e,k', 'f,l', 'a,p', 'b,n'])
+    Rig.setSample(SimSample(R0=1, MR=0, Hall=1e-5), SwitchPairs=['e,k', 'f,l', 'a,o', 'b,m'])
+    C=BreakoutBoxConnections(Simulation=Rig)
+    C.addMatrixSwitch()
+    C.addPPMS()
+    for Pin, Name, Label in [(7,'HB+','a'), (8,'HB-','b'), (9,'HBL3','c'), (10,'HBL6','d'),
+                             (11,'HBL1','e'), (12,'HBR1','f'), (13,'HBR3','g'), (14,'HBR6','h')]:
+        C.addRotPuckConnection(Pin, Name, SwitchLabel=Label)
+    C.addInstrument(2400, 15, SwitchLabels={'I+':'p', 'I-':'n'})
+    C.addInstrument(2182, 17, SwitchLabels={'V1+':'k', 'V1-':'l'})
+    C.addInstrument(6221, 14, SwitchLabels={'PD+':'o', 'PD-':'m'})
+    MS=MeasurementSettings(C)
+    MS.setVoltageMeasurementOptions(PulseDelta=(Mode == 'PulseDelta'), Buffered=(Mode == 'Buffered'), HardwareDelta=(Mode == 'Delta'))
+    MS.setTriggerOptions(Triggered=(Mode == 'Triggered'))
+    if Mode in ('PulseDelta', 'Delta'):
+        Source=['HB+,PD+', 'HB-,PD-']
+    else:
+        Source=['HB+,I+', 'HB-,I-']
+    MS.addMeasurementConnection('Rxx', CurrentAmplitude=1e-3, VoltRange=1, SwitchConnections=['HBL1,V1+', 'HBL3,V1-']+Source)
+    MS.addMeasurementConnection('Rxy', CurrentAmplitude=1e-3, VoltRange=0.1, SwitchConnections=['HBL1,V1+', 'HBR1,V1-']+Source)
+    MS.addPulseConnection('ParPulse', PulseAmplitude=10e-3, PulseWidth=1e-3, SwitchConnections=['HBL3,PD+', 'HBR3,PD-'])
+    MS.BenchmarkPlotData=PlotData
+    return Rig, MS
+
+
+def runProtocol(Protocol, MS):
+    # Runs one protocol with a short scan. Returns nothing; the data file is written by the protocol.
+    PlotData=MS.BenchmarkPlotData
+    Angles=[0, 30, 60, 90]
+    if Protocol == 'RvsT':
+        MS.setMeasurementParams(Angle=-999, MagneticField=0, Temperature=[300, 290, 280, 270], PlotData=PlotData)
+        MS.RunRvsTMeasurement()
+    elif Protocol == 'RvsH':
+        MS.setMeasurementParams(Angle=-999, MagneticField=[0, 1000, 2000, 3000, 4000], Temperature=300, PlotData=PlotData)
+        MS.RunRvsHMeasurement()
+    elif Protocol == 'RvsAngle':
+        MS.setMeasurementParams(Angle=Angles, MagneticField=[6000, 0], Temperature=300, PlotData=PlotData)
+        MS.RunRvsAngleMeasurement()
+    elif Protocol == 'RvsAnglePulse':
+        MS.setMeasurementParams(Angle=Angles, MagneticField=[6000, 0], Temperature=300, PlotData=PlotData)
+        MS.RunRvsAngleMeasurementPulse()
+    elif Protocol == 'RvsAnglePulseField':
+        MS.setMeasurementParams(Angle=Angles, MagneticField=6000, Temperature=300, PlotData=PlotData)
+        MS.RunRvsAngleMeasurementPulseField()
+    elif Protocol == 'PulseAmplitudeSeries':
+        MS.setMeasurementParams(Angle=-999, MagneticField=0, Temperature=300, PlotData=PlotData)
+        MS.PulseAmplitudeSeriesTest([2e-3, 4e-3, 6e-3, 8e-3, 10e-3], ['ParPulse'], 6000, 45)
+    else:
+        raise ValueError('Unknown protocol {}. Choose from {}'.format(Protocol, PROTOCOLS))
+
+
+def benchmarkCase(Protocol, Mode, Latency={}, PlotData=True):
+    # Runs one protocol in one measurement mode and returns the timing per data point
+    with contextlib.redirect_stdout(io.StringIO()):
+        Rig, MS=makeMeasurement(Mode, Latency=Latency, PlotData=PlotData)
+        MS.FileSettings(SampleID='Bench', MeasurementID='{}_{}'.format(Protocol, Mode), SaveFolder='./data/bench/')
+        Rig.resetCommandCount()
+        MS.Clock.resetBudget()
+        WallStart=time.time()
+        with MS.Clock.phase(OUTER_PHASE):
+            runProtocol(Protocol, MS)
+        Wall=time.time()-WallStart
+        Elapsed=MS.Clock.time()-MS.Clock.StartTime
+        plt.close('all')
+    Points=max(MS.DataLineCount, 1)
+    return {'Points':MS.DataLineCount,
+            'SecondsPerPoint':Elapsed/Points,
+            'Phases':{Phase:Seconds/Points for Phase, Seconds in MS.Clock.PhaseTime.items()},
+            'CommandsPerPoint':{Device:Count/Points for Device, Count in Rig.CommandCount.items()},
+            'WallSeconds':Wall}
+
+
+def runBenchmark(Protocols=PROTOCOLS, Modes=MODES, Latency={}, PlotData=True):
+    # Runs all cases in a temporary folder (protocols write their data files relative to the working directory)
+    Results={}
+    Here=os.getcwd()
+    Folder=tempfile.mkdtemp(prefix='BenchmarkAcquisition_')
+    try:
+        os.chdir(Folder)
+        for Sub in ['bench', 'PPMS_switch', 'PPMS_RvsT', 'PPMS_RvsH', 'PPMS_SMR']:
+            os.makedirs(os.path.join('data', Sub))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for Protocol in Protocols:
+                for Mode in Modes:
+                    Case='{}/{}'.format(Protocol, Mode)
+                    Results[Case]=benchmarkCase(Protocol, Mode, Latency=Latency, PlotData=PlotData)
+                    print('{:32s} {:4d} points {:9.2f} s/point  ({:.1f} s wall)'.format(Case, Results[Case]['Points'],
+                          Results[Case]['SecondsPerPoint'], Results[Case]['WallSeconds']))
+    finally:
+        os.chdir(Here)
+    return Results
+
+
+def resultString(Results):
+    # Table of seconds per point for every phase
+    Phases=[OUTER_PHASE]+sorted(set(Phase for Result in Results.values() for Phase in Result['Phases']) - {OUTER_PHASE})
+    out='{:32s}{:>10s}'.format('Seconds per point', 'Total')+''.join('{:>16s}'.format(Phase) for Phase in Phases)
+    for Case, Result in Results.items():
+        out+='\n{:32s}{:>10.2f}'.format(Case, Result['SecondsPerPoint'])
+        out+=''.join('{:>16.3f}'.format(Result['Phases'].get(Phase, 0)) for Phase in Phases)
+    out+='\n\n{:32s}'.format('Round trips per point')
+    Devices=sorted(set(Device for Result in Results.values() for Device in Result['CommandsPerPoint']))
+    out+=''.join('{:>10s}'.format(Device) for Device in Devices)
+    for Case, Result in Results.items():
+        out+='\n{:32s}'.format(Case)+''.join('{:>10.1f}'.format(Result['CommandsPerPoint'].get(Device, 0)) for Device in Devices)
+    return out
+
+
+def compareToBaseline(Results, Baseline, Tolerance=0.05, AbsoluteTolerance=0.01):
+    # Returns a list of regressions: any total or phase time per point that grew by more than Tolerance
+    # (relative) and AbsoluteTolerance (s/point). The WALL_PHASES are not compared, and not counted in the total.
+    Regressions=[]
+    def check(Case, Name, New, Old):
+        if New > Old*(1+Tolerance) and New-Old > AbsoluteTolerance:
+            Regressions.append('{} {}: {:.3f} -> {:.3f} s/point ({:+.1f}%)'.format(Case, Name, Old, New, 100*(New-Old)/max(Old, 1e-12)))
+    for Case, Result in Results.items():
+        if Case not in Baseline['Results']:
+            continue
+        Old=Baseline['Results'][Case]
+        Total=lambda R: R['SecondsPerPoint']-sum(R['Phases'].get(Phase, 0) for Phase in WALL_PHASES)
+        check(Case, 'total', Total(Result), Total(Old))
+        for Phase, New in Result['Phases'].items():
+            if Phase not in WALL_PHASES:
+                check(Case, Phase, New, Old['Phases'].get(Phase, 0))
+    return Regressions
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Seconds per data point of every measurement protocol on the emulated rig.')
+    parser.add_argument('--protocols', nargs='+', default=PROTOCOLS, choices=PROTOCOLS)
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--no-plot', action='store_true', help='skip plotting after every point')
+    parser.add_argument('--latency', help='JSON file of SimRig latencies to replay')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='allowed relative slowdown (default 5%%)')
+    args=parser.parse_args(argv)
+
+    Latency={}
+    if args.latency:
+        with open(args.latency) as f:
+            Latency=json.load(f)
+    PlotData=not args.no_plot
+    Results=runBenchmark(Protocols=args.protocols, Modes=args.modes, Latency=Latency, PlotData=PlotData)
+    print('\n'+resultString(Results))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'PlotData':PlotData, 'Latency':Latency, 'Results':Results}, f, indent=1, sort_keys=True)
+        print('\nSaved baseline to {}'.format(args.baseline))
+        return 0
+    if not os.path.exists(args.baseline):
+        print('\nNo baseline at {}. Run with --save-baseline to create one.'.format(args.baseline))
+        return 0
+    with open(args.baseline) as f:
+        Baseline=json.load(f)
+    if Baseline.get('Latency', {}) != Latency:
+        print('\nWarning: the baseline was made with different latency settings.')
+    Regressions=compareToBaseline(Results, Baseline, Tolerance=args.tolerance)
+    if len(Regressions) > 0:
+        print('\nREGRESSIONS compared to the baseline:')
+        for Regression in Regressions:
+            print('  '+Regression)
+        return 1
+    print('\nNo regressions compared to the baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
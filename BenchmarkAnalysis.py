@@ -0,0 +1,215 @@
+# Analysis benchmark. Writes synthetic data files in the format of StartDataRecording/RecordDataLine (settings
+# header, 'Angle(deg),Temp(K),Field(Oe),PulseChannel,...' columns, pulse rows) and times each step of PlotSMR
+# on them: header parsing, pd.read_csv, grouping and figure rendering. Peak memory of each step is measured
+# with tracemalloc in a second pass.
+#
+# Usage (from the repository folder):
+#   python BenchmarkAnalysis.py                                  1k, 100k and 1M rows of RvsT and RvsAngle files
+#   python BenchmarkAnalysis.py --rows 1000 100000 --types RvsT --no-memory
+#   python BenchmarkAnalysis.py --json analysis.json             also store the results
+#   python BenchmarkAnalysis.py --write test.csv --rows 200000 --types RvsAngle    only write a synthetic file
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from UtilsMeasurementSetup import *
+from UtilsSimulation import *
+from BenchmarkAcquisition import makeMeasurement
+
+TYPES = ['RvsT', 'RvsH', 'RvsAngle', 'RvsPulseAmp']
+ROWS = [1000, 100000, 1000000]
+STEPS = ['Header', 'ReadCSV', 'Grouping', 'Render']
+CHUNK = 100000
+
+
+def writeSyntheticHeader(FileName, MeasurementType):
+    # Writes the header with StartDataRecording of a measurement on the emulated rig, so it is exactly what the
+    # measurement code writes. Returns the measurement names.
+    Folder=tempfile.mkdtemp(prefix='SyntheticHeader_')
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            Rig, MS=makeMeasurement('DC', PlotData=False)
+            if MeasurementType == 'RvsT':
+                MS.setMeasurementParams(Angle=-999, MagneticField=0, Temperature=[300, 2])
+            elif MeasurementType == 'RvsH':
+                MS.setMeasurementParams(Angle=-999, MagneticField=[-90000, 90000], Temperature=300)
+            elif MeasurementType == 'RvsAngle':
+                MS.setMeasurementParams(Angle=[0, 360], MagneticField=[6000, 0], Temperature=300)
+                MS.PulseNames=['ParPulse']
+                MS.MeasurementType='RvsAngle_Remnant_Pulse'
+            elif MeasurementType == 'RvsPulseAmp':
+                MS.setMeasurementParams(Angle=-999, MagneticField=0, Temperature=300)
+                MS.MeasurementType='RvsPulseAmp'
+            else:
+                raise ValueError('Unknown measurement type {}. Choose from {}'.format(MeasurementType, TYPES))
+            MS.FileSettings(SampleID='Synthetic', MeasurementID=MeasurementType, SaveFolder=Folder+'/')
+            shutil.move(MS.StartDataRecording(), FileName)
+    finally:
+        shutil.rmtree(Folder)
+    return MS.MeasurementNames
+
+
+def syntheticRows(MeasurementType, Start, Count, Rows, Generator):
+    # PPMS readings and pulse channel of rows Start to Start+Count of a file with Rows rows, following the order
+    # the protocols write them in
+    i=np.arange(Start, Start+Count)
+    PulseChannel=np.full(Count, '', dtype=object)
+    if MeasurementType == 'RvsT':
+        Temperature=300-298*i/max(Rows-1, 1)
+        Field=np.zeros(Count)
+        Angle=np.zeros(Count)
+    elif MeasurementType == 'RvsH':
+        Temperature=np.full(Count, 300.)
+        Field=90000*np.sin(2*np.pi*i/max(Rows, 1))
+        Angle=np.zeros(Count)
+    elif MeasurementType == 'RvsAngle':
+        # per angle: remnant reading after 6000 Oe and after 0 Oe, then after a pulse of each polarity
+        Temperature=np.full(Count, 300.)
+        Step=i//4
+        Angle=(Step*5.)%360
+        Field=np.where(i%4 == 0, 6000., 0.)
+        PulseChannel[i%4 == 2]='ParPulse'
+        PulseChannel[i%4 == 3]='switched_polarityParPulse'
+    else:
+        Temperature=np.full(Count, 300.)
+        Field=np.zeros(Count)
+        Angle=np.full(Count, 45.)
+        Amplitude=1e-3*(1+i%10)
+        PulseChannel=np.array(['ParPulse>{:.5f}'.format(x) for x in Amplitude], dtype=object)
+    Temperature=Temperature+Generator.normal(0, 5e-3, Count)
+    Field=Field+Generator.normal(0, 0.2, Count)
+    Angle=Angle+Generator.normal(0, 1e-2, Count)
+    return Angle, Temperature, Field, PulseChannel
+
+
+def writeSyntheticDataFile(FileName, Rows, MeasurementType='RvsT', Seed=0):
+    # Writes a data file with the settings header and the given number of data rows. Returns the measurement names.
+    MeasurementNames=writeSyntheticHeader(FileName, MeasurementType)
+    Generator=np.random.default_rng(Seed)
+    Samples=[SimSample(R0=500, MR=2e-3), SimSample(R0=1, MR=0, Hall=1e-5)]
+    Current=1e-3
+    with open(FileName, 'a') as f:
+        for Start in range(0, Rows, CHUNK):
+            n=min(CHUNK, Rows-Start)
+            Angle, Temperature, Field, PulseChannel=syntheticRows(MeasurementType, Start, n, Rows, Generator)
+            Columns=[Angle.tolist(), Temperature.tolist(), Field.tolist(), PulseChannel.tolist()]
+            for k in range(len(MeasurementNames)):
+                Sample=Samples[k%len(Samples)]
+                Resistance=Sample.resistance(Temperature, Field, Angle)
+                Columns.append([Current]*n)
+                Columns.append((Current*Resistance+Generator.normal(0, 2e-8, n)).tolist())
+                Columns.append(np.abs(Generator.normal(2e-8, 5e-9, n)).tolist())
+            f.write(''.join(','.join(map(str, Row))+'\n' for Row in zip(*Columns)))
+    return MeasurementNames
+
+
+def timeSteps(FileName):
+    # Runs the steps of PlotSMR once and returns the seconds spent in each
+    Times={}
+    Start=time.perf_counter()
+    hlength, measnames, MeasType=ReadSMRHeader(FileName)
+    Times['Header']=time.perf_counter()-Start
+    Start=time.perf_counter()
+    df=ReadSMRData(FileName, hlength)
+    Times['ReadCSV']=time.perf_counter()-Start
+    Start=time.perf_counter()
+    df=GroupSMRData(df)
+    Times['Grouping']=time.perf_counter()-Start
+    Start=time.perf_counter()
+    for measname in measnames:
+        RenderSMR(FileName, df, measname, MeasType)
+    plt.close('all')
+    Times['Render']=time.perf_counter()-Start
+    return Times
+
+
+def memorySteps(FileName):
+    # Runs the steps of PlotSMR once and returns the peak memory (bytes) allocated in each
+    Peaks={}
+    def traced(Step, Function, *args):
+        tracemalloc.start()
+        Result=Function(*args)
+        Peaks[Step]=tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return Result
+    hlength, measnames, MeasType=traced('Header', ReadSMRHeader, FileName)
+    df=traced('ReadCSV', ReadSMRData, FileName, hlength)
+    df=traced('Grouping', GroupSMRData, df)
+    def render():
+        for measname in measnames:
+            RenderSMR(FileName, df, measname, MeasType)
+        plt.close('all')
+    traced('Render', render)
+    Peaks['DataFrame']=int(df.memory_usage(deep=True).sum())
+    return Peaks
+
+
+def runBenchmark(Rows=ROWS, Types=['RvsT', 'RvsAngle'], Memory=True):
+    Results={}
+    Folder=tempfile.mkdtemp(prefix='BenchmarkAnalysis_')
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for MeasurementType in Types:
+                for n in Rows:
+                    Case='{}/{}'.format(MeasurementType, n)
+                    FileName=os.path.join(Folder, '{}_{}.csv'.format(MeasurementType, n))
+                    Start=time.perf_counter()
+                    writeSyntheticDataFile(FileName, n, MeasurementType)
+                    Results[Case]={'Rows':n, 'FileBytes':os.path.getsize(FileName), 'WriteSeconds':time.perf_counter()-Start,
+                                   'Seconds':timeSteps(FileName)}
+                    if Memory:
+                        Results[Case]['PeakBytes']=memorySteps(FileName)
+                    print('{:20s} {:8.2f} s total'.format(Case, sum(Results[Case]['Seconds'].values())))
+                    os.remove(FileName)
+    finally:
+        shutil.rmtree(Folder)
+    return Results
+
+
+def resultString(Results):
+    out='{:20s}{:>10s}'.format('Seconds', 'File(MB)')+''.join('{:>12s}'.format(Step) for Step in STEPS)+'{:>12s}'.format('Total')
+    for Case, Result in Results.items():
+        out+='\n{:20s}{:>10.1f}'.format(Case, Result['FileBytes']/1e6)
+        out+=''.join('{:>12.3f}'.format(Result['Seconds'][Step]) for Step in STEPS)
+        out+='{:>12.3f}'.format(sum(Result['Seconds'].values()))
+    if all('PeakBytes' in Result for Result in Results.values()) and len(Results) > 0:
+        out+='\n\n{:20s}'.format('Peak memory (MB)')+''.join('{:>12s}'.format(Step) for Step in STEPS+['DataFrame'])
+        for Case, Result in Results.items():
+            out+='\n{:20s}'.format(Case)+''.join('{:>12.1f}'.format(Result['PeakBytes'][Step]/1e6) for Step in STEPS+['DataFrame'])
+    return out
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Time and memory of each PlotSMR step on synthetic data files.')
+    parser.add_argument('--rows', nargs='+', type=int, default=ROWS)
+    parser.add_argument('--types', nargs='+', default=['RvsT', 'RvsAngle'], choices=TYPES)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--json', help='store the results in this file')
+    parser.add_argument('--write', help='only write a synthetic data file (first of --rows and --types)')
+    args=parser.parse_args(argv)
+
+    if args.write:
+        writeSyntheticDataFile(args.write, args.rows[0], args.types[0])
+        print('Wrote {} rows of {} data to {}'.format(args.rows[0], args.types[0], args.write))
+        return 0
+    Results=runBenchmark(Rows=args.rows, Types=args.types, Memory=not args.no_memory)
+    print('\n'+resultString(Results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(Results, f, indent=1, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+# Clocks used for every wait in the measurement code, so that full protocols can be run time-compressed
+import time
+import heapq
+import threading
+
+'''
+-------
+CLOCKS |
+-------
+
+Every wait in the drivers and in MeasurementSettings goes through a clock with a label, e.g.
+    self.Clock.sleep(self.WaitAfterOn, 'WaitAfterOn')
+The drivers take the clock as their clock argument (SystemClock by default, the VirtualClock of the SimRig in the
+simulated drivers) and never call time.sleep themselves.
+The real Clock waits, the VirtualClock only advances its time. Both add each wait to a budget per label,
+so a dry run reports how long the real measurement would have spent in each kind of wait.
+Periodic jobs (keepalives, samplers) are scheduled with Clock.every so that they also follow virtual time.
+Sections of a measurement can be timed with
+    with self.Clock.phase('Acquire'):
+        ...
+which adds up the clock time spent in each phase (see phaseString and BenchmarkAcquisition.py).
+'''
+
+class ClockTimer:
+    # Handle of a periodic callback started with Clock.every. Call cancel() to stop it.
+    def __init__(self, interval, callback):
+        self.interval=interval
+        self.callback=callback
+        self.Stopped=threading.Event()
+
+    def cancel(self):
+        self.Stopped.set()
+
+    def cancelled(self):
+        return self.Stopped.is_set()
+
+
+class ClockPhase:
+    # Context manager returned by Clock.phase. Time spent in a nested phase only counts for the innermost one.
+    def __init__(self, clock, label):
+        self.clock=clock
+        self.label=label
+
+    def __enter__(self):
+        self.clock.enterPhase(self.label)
+        return self
+
+    def __exit__(self, *args):
+        self.clock.exitPhase()
+        return False
+
+
+class Clock:
+    # Real time clock. sleep() really waits.
+    def __init__(self):
+        self.Lock=threading.Lock()
+        self.resetBudget()
+
+    def time(self):
+        # Seconds since the epoch (virtual for VirtualClock)
+        return time.time()
+
+    def record(self, seconds, label):
+        # Add a wait to the budget without waiting
+        if label is None or seconds <= 0:
+            return
+        with self.Lock:
+            self.WaitBudget[label]=self.WaitBudget.get(label, 0)+seconds
+            self.WaitCount[label]=self.WaitCount.get(label, 0)+1
+
+    def sleep(self, seconds, label='Other'):
+        # Wait for the given time. A label of None waits without adding to the budget.
+        self.record(seconds, label)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def every(self, interval, callback):
+        # Call callback every interval seconds from a background thread, until the returned timer is cancelled
+        timer=ClockTimer(interval, callback)
+        def loop():
+            while not timer.Stopped.wait(interval):
+                # A failed call is reported and the job goes on, instead of the thread ending silently
+                try:
+                    callback()
+                except Exception as error:
+                    print('Periodic job {} failed: {!r}'.format(getattr(callback, '__qualname__', callback), error))
+        thread=threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return timer
+
+    def phase(self, label):
+        return ClockPhase(self, label)
+
+    def enterPhase(self, label):
+        now=self.time()
+        if len(self.PhaseStack) > 0:
+            self.addPhaseTime(self.PhaseStack[-1], now)
+        self.PhaseStack.append([label, now])
+
+    def exitPhase(self):
+        now=self.time()
+        self.addPhaseTime(self.PhaseStack.pop(), now)
+        if len(self.PhaseStack) > 0:
+            self.PhaseStack[-1][1]=now
+
+    def addPhaseTime(self, entry, now):
+        label, since=entry
+        self.PhaseTime[label]=self.PhaseTime.get(label, 0)+now-since
+        entry[1]=now
+
+    def resetBudget(self):
+        # Clears the wait budget and the phase times
+        self.StartTime=self.time()
+        self.WaitBudget={}
+        self.WaitCount={}
+        self.PhaseTime={}
+        self.PhaseStack=[]
+
+    def totalWait(self):
+        return sum(self.WaitBudget.values())
+
+    def budgetString(self):
+        # Table of the time spent in each kind of wait since the last resetBudget
+        out='{:30s}{:>10s}{:>14s}{:>14s}'.format('Wait','Count','Total(s)','Total(h:m:s)')
+        for label in sorted(self.WaitBudget, key=self.WaitBudget.get, reverse=True):
+            total=self.WaitBudget[label]
+            out+='\n{:30s}{:>10d}{:>14.2f}{:>14s}'.format(label, self.WaitCount[label], total, formatDuration(total))
+        out+='\n{:30s}{:>10s}{:>14.2f}{:>14s}'.format('All waits', '', self.totalWait(), formatDuration(self.totalWait()))
+        elapsed=self.time()-self.StartTime
+        out+='\n{:30s}{:>10s}{:>14.2f}{:>14s}'.format('Elapsed (clock time)', '', elapsed, formatDuration(elapsed))
+        return out
+
+    def phaseString(self):
+        # Table of the clock time spent in each phase since the last resetBudget
+        elapsed=self.time()-self.StartTime
+        out='{:30s}{:>14s}{:>10s}'.format('Phase','Total(s)','Share')
+        for label in sorted(self.PhaseTime, key=self.PhaseTime.get, reverse=True):
+            out+='\n{:30s}{:>14.2f}{:>9.1f}%'.format(label, self.PhaseTime[label], 100*self.PhaseTime[label]/max(elapsed, 1e-12))
+        out+='\n{:30s}{:>14.2f}'.format('Elapsed (clock time)', elapsed)
+        return out
+
+
+class VirtualClock(Clock):
+    # Clock for simulations. sleep() returns immediately and moves the clock forward instead, so virtual time
+    # is the real time spent computing plus every skipped wait. Callbacks scheduled with every() are run
+    # in order, in the sleeping thread, when virtual time passes them.
+    def __init__(self):
+        self.Offset=0.0
+        self.Events=[]
+        self.EventCount=0
+        Clock.__init__(self)
+
+    def time(self):
+        return time.time()+self.Offset
+
+    def advanceTo(self, target):
+        # Never goes back in time, even if computing took longer than the skipped wait
+        self.Offset=max(self.Offset, target-time.time())
+
+    def sleep(self, seconds, label='Other'):
+        self.record(seconds, label)
+        target=self.time()+max(seconds, 0)
+        while len(self.Events) > 0 and self.Events[0][0] <= target:
+            eventtime, count, timer=heapq.heappop(self.Events)
+            if timer.cancelled():
+                continue
+            self.advanceTo(eventtime)
+            timer.callback()
+            self.schedule(eventtime+timer.interval, timer)
+        self.advanceTo(target)
+
+    def schedule(self, eventtime, timer):
+        self.EventCount+=1
+        heapq.heappush(self.Events, (eventtime, self.EventCount, timer))
+
+    def every(self, interval, callback):
+        timer=ClockTimer(interval, callback)
+        self.schedule(self.time()+interval, timer)
+        return timer
+
+
+def formatDuration(seconds):
+    # 3725.2 -> '1:02:05'
+    seconds=int(round(seconds))
+    return '{}:{:02d}:{:02d}'.format(seconds//3600, (seconds%3600)//60, seconds%60)
+
+
+# Default clock for drivers and measurements that are not given one
+SystemClock=Clock()
+
+
+"""Example Commands"""
+
+"""
+#Dry-run a measurement on the emulated rig and see what the waits would have cost
+Rig=SimRig()    # uses a VirtualClock by default
+C=BreakoutBoxConnections(Simulation=Rig)
+...
+MS.autoRunMeasurement()
+print(MS.Clock.budgetString())
+"""
@@ -0,0 +1,240 @@
+# Shadow copy of the settings written to an instrument, so that drivers only send the settings that changed,
+# and batching of SCPI commands into as few GPIB messages as possible
+'''
+--------------
+SHADOW STATE |
+--------------
+
+Each driver keeps one ShadowState with the last value written for each setting, e.g.
+    self.state=ShadowState(write=self.ac.write)
+    self.state.set('SOUR:PDEL:COUN', 50)      # writes 'SOUR:PDEL:COUN 50'
+    self.state.set('SOUR:PDEL:COUN', 50)      # already set, nothing is written
+Settings that are not a single SCPI command (e.g. pymeasure properties) are given a send function:
+    state.set('source_current', 1e-5, lambda: CSIO.__setattr__('source_current', 1e-5))
+The state must be invalidated whenever the instrument may have changed on its own: after *RST or a front panel
+change (invalidate()), and automatically when a write fails, since it is then unknown what the instrument got.
+
+-----------------
+COMMAND BATCHES |
+-----------------
+
+Inside a CommandBatch every write (and every setting sent by the ShadowState) is collected and sent on exit as
+semicolon-joined messages of at most MaxLength characters, followed by a single error queue check:
+    with CommandBatch(self.ac, state=self.state, MaxLength=256) as batch:
+        self.state.set('SOUR:WAVE:AMPL', 1e-3)
+        batch.write('SOUR:WAVE:ARM')
+Queries can not be batched; end the batch before querying. If the block raises, nothing is sent.
+Drivers open their batches with a transaction() method, which passes the driver's ShadowState and its class
+attribute max_message_length (the longest message sent in one GPIB transaction) as MaxLength.
+If the instrument reports an error, the ShadowState is invalidated and a RuntimeError is raised.
+
+--------------
+SWITCH STATE |
+--------------
+
+The SwitchState keeps the crosspoints that are connected on the LinkBone matrix switch, so that going from one
+route to the next only switches the relays that differ, e.g. from ['e,k','c,l','a,p','b,n'] (Rxx) to
+['e,k','f,l','a,p','b,n'] (Rxy):
+    switchstate.route(['e,k','f,l','a,p','b,n'])     # sends 'off c,l' and 'on f,l' in one burst
+Relays are opened before new ones are closed. Until the first reset (or after a failed burst) the state is
+unknown, and the next route starts with a reset.
+'''
+
+class ShadowState:
+    def __init__(self, write=None):
+        # write is the function used for plain 'HEADER value' settings
+        self.write=write
+        self.Values={}
+        self.Sent=0
+        self.Skipped=0
+
+    def known(self, name):
+        return name in self.Values
+
+    def get(self, name, default=None):
+        return self.Values.get(name, default)
+
+    def set(self, name, value, send=None):
+        # Send the setting if it differs from the last value written. Returns True if it was sent.
+        if name in self.Values and self.Values[name] == value:
+            self.Skipped+=1
+            return False
+        try:
+            if send is None:
+                self.write('{} {}'.format(name, value))
+            else:
+                send()
+        except Exception:
+            self.invalidate()
+            raise
+        self.Values[name]=value
+        self.Sent+=1
+        return True
+
+    def invalidate(self, *names):
+        # Forget the given settings, or all of them
+        if len(names) == 0:
+            self.Values={}
+        for name in names:
+            self.Values.pop(name, None)
+
+    def __repr__(self):
+        return 'ShadowState({} settings known, {} sent, {} skipped)'.format(len(self.Values), self.Sent, self.Skipped)
+
+
+class CommandBatch:
+    def __init__(self, resource, state=None, MaxLength=256, CheckErrors=True, ErrorQuery='SYST:ERR?'):
+        # resource is the pyvisa resource, state the ShadowState of the driver (its writes are batched too)
+        self.resource=resource
+        self.state=state
+        self.MaxLength=MaxLength
+        self.CheckErrors=CheckErrors
+        self.ErrorQuery=ErrorQuery
+        self.Commands=[]
+        self.Messages=0
+
+    def write(self, command):
+        self.Commands.append(command.strip())
+
+    def messages(self):
+        # Joins the commands with ';'. Each command after the first starts from the root (';:'), so the
+        # full headers can be used. Common commands (*RST, *CLS, ...) never need the colon.
+        out=[]
+        message=''
+        for command in self.Commands:
+            if message == '':
+                part=command
+            elif command.startswith('*') or command.startswith(':'):
+                part=';'+command
+            else:
+                part=';:'+command
+            if message != '' and len(message)+len(part) > self.MaxLength:
+                out.append(message)
+                part=command
+                message=''
+            message+=part
+        if message != '':
+            out.append(message)
+        return out
+
+    def flush(self):
+        # Sends the collected commands and checks the error queue once
+        messages=self.messages()
+        self.Commands=[]
+        if len(messages) == 0:
+            return
+        try:
+            for message in messages:
+                self.resource.write(message)
+                self.Messages+=1
+            if self.CheckErrors:
+                error=self.resource.query(self.ErrorQuery).strip()
+                if not (error.startswith('0') or error.startswith('+0')):
+                    raise RuntimeError('Instrument error after "{}": {}'.format(' / '.join(messages), error))
+        except Exception:
+            if self.state is not None:
+                self.state.invalidate()
+            raise
+
+    def __enter__(self):
+        if self.state is not None:
+            self.savedwrite=self.state.write
+            self.state.write=self.write
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.state is not None:
+            self.state.write=self.savedwrite
+        if exc_type is None:
+            self.flush()
+        elif self.state is not None:
+            # Settings recorded in the state were never sent
+            self.state.invalidate()
+        return False
+
+
+class SwitchState:
+    def __init__(self, Switch):
+        # Switch is the telnet (or simulated) LinkBone connection, or None for a dummy switch
+        self.Switch=Switch
+        self.Connected=None
+        self.Bursts=0
+        self.Toggles=0
+
+    def known(self):
+        return self.Connected is not None
+
+    def changes(self, Pairs):
+        # The commands that take the switch from its connected crosspoints to exactly Pairs
+        if self.Connected is None:
+            return ['reset']+['on {}'.format(Pair) for Pair in Pairs]
+        Off=['off {}'.format(Pair) for Pair in sorted(self.Connected-set(Pairs))]
+        return Off+['on {}'.format(Pair) for Pair in Pairs if Pair not in self.Connected]
+
+    def toggles(self, Pairs):
+        # Number of relays that change to go to Pairs (all of them and a reset if the state is unknown)
+        if self.Connected is None:
+            return len(Pairs)+1
+        return len(self.Connected.symmetric_difference(Pairs))
+
+    def send(self, Commands):
+        # One burst of commands; the state is unknown if it fails
+        if len(Commands) == 0 or self.Switch is None:
+            return
+        try:
+            if hasattr(self.Switch, 'sendCommands'):
+                self.Switch.sendCommands(Commands)
+            else:
+                for Command in Commands:
+                    self.Switch.sendCommand(Command)
+        except Exception:
+            self.invalidate()
+            raise
+        self.Bursts+=1
+
+    def route(self, Pairs):
+        # Connects exactly Pairs, switching only the relays that differ. Returns the commands sent.
+        Commands=self.changes(Pairs)
+        self.Toggles+=self.toggles(Pairs)
+        self.send(Commands)
+        self.Connected=set(Pairs)
+        return Commands
+
+    def reset(self):
+        self.send(['reset'])
+        self.Connected=set()
+
+    def invalidate(self):
+        # Forget the connected crosspoints, e.g. after the switch was changed by hand
+        self.Connected=None
+
+    def __repr__(self):
+        if self.Connected is None:
+            return 'SwitchState(unknown, {} bursts)'.format(self.Bursts)
+        return 'SwitchState({} connected, {} bursts, {} relay changes)'.format(sorted(self.Connected), self.Bursts, self.Toggles)
+
+
+"""Example Commands"""
+
+"""
+#Only the amplitude is sent the second time
+state=ShadowState(write=resource.write)
+for amp in [1e-5, 2e-5]:
+    state.set('SOUR:WAVE:FREQ', 17e3)
+    state.set('SOUR:WAVE:AMPL', amp)
+#After a reset nothing is known anymore
+resource.write('*RST')
+state.invalidate()
+
+#Send a pulse setup in one message and check for errors once
+with CommandBatch(resource, state=state) as batch:
+    batch.write('SOUR:WAVE:ABOR')
+    state.set('SOUR:WAVE:AMPL', 1e-3)
+    batch.write('SOUR:WAVE:ARM')
+
+#Go from the Rxx to the Rxy route of a Hall bar with one off and one on
+switchstate=SwitchState(switch)
+switchstate.reset()
+switchstate.route(['e,k','c,l','a,p','b,n'])
+switchstate.route(['e,k','f,l','a,p','b,n'])
+"""
@@ -0,0 +1,162 @@
+# Basic utilities for using the Keithley 2182A nanovoltmeter
+import pyvisa
+import numpy as np
+from UtilsClock import SystemClock
+from UtilsInstrumentState import ShadowState, CommandBatch
+
+class K2182:
+    """Class for Keithley 2182A"""
+    max_message_length = 256
+
+    def __init__(self, GPIBnum=17, clock=SystemClock, resource=None):
+        #Initialize the 2182 connection through specified GPIB port, or use the given pyvisa resource
+        if resource is None:
+            rm = pyvisa.ResourceManager()
+            resource = rm.open_resource('GPIB0::{}::INSTR'.format(GPIBnum))
+        self.vm = resource
+        self.clock = clock
+        # Reading count, interval and trigger delay the buffer is set up for (count None while the meter is free running)
+        self.buffer_count = None
+        self.buffer_interval = None
+        self.buffer_delay = 0
+        #Last value written for each setting (see UtilsInstrumentState.py)
+        self.state = ShadowState(write=self.vm.write)
+
+    def write(self, command):
+        # Raw SCPI access, so the 2182 can still be used like a pyvisa resource.
+        # A setting written with the same header the driver uses is no longer known. Any other header (a short form
+        # like SENS:VOLT:RANG for SENS:VOLT:CHAN1:RANG, or *RST) may change any setting, so then nothing is known.
+        headers = [part.strip().lstrip(':').split(' ')[0].upper() for part in command.split(';') if part.strip() != '']
+        if all(self.state.known(header) for header in headers):
+            self.state.invalidate(*headers)
+        else:
+            self.state.invalidate()
+        if '*RST' in headers:
+            self.buffer_count = None
+            self.buffer_interval = None
+        self.vm.write(command)
+
+    def query(self, command):
+        return self.vm.query(command)
+
+    def close(self):
+        self.vm.close()
+
+    def transaction(self):
+        #Batch of 2182 writes and settings (see UtilsInstrumentState.py)
+        return CommandBatch(self.vm, state=self.state, MaxLength=self.max_message_length)
+
+    def fetch(self):
+        #Latest reading of the free running meter
+        if self.buffer_count is not None:
+            self.freeRun()
+        return float(self.vm.query("fetch?"))
+
+    def setRange(self, range=1):
+        #Channel 1 range in V (this also turns autorange off). Only written when it changed.
+        self.state.set("SENS:VOLT:CHAN1:RANG", range)
+
+    def freeRun(self):
+        #Go back to continuous, immediately triggered readings (the power-on behaviour used by fetch)
+        with self.transaction():
+            self.state.set("TRAC:FEED:CONT", "NEV")
+            self.state.set("TRIG:SOUR", "IMM")
+            self.state.set("TRIG:COUN", 1)
+            self.state.set("SAMP:COUN", 1)
+            self.state.set("TRIG:DEL", 0)
+            self.state.set("INIT:CONT", "ON")
+        self.buffer_count = None
+        self.buffer_interval = None
+
+    def configureBuffer(self, count=30, interval=0.1):
+        #Set up the trigger model to take count readings, one every interval seconds on the timer of the meter,
+        #and store them in the trace buffer as single precision binary. Only settings that changed are written.
+        self.state.set("INIT:CONT", "OFF")
+        self.state.set("TRIG:SOUR", "TIM")
+        self.state.set("TRIG:TIM", interval)
+        self.state.set("TRIG:DEL", 0)
+        self.state.set("TRIG:COUN", count)
+        self.state.set("SAMP:COUN", 1)
+        self.state.set("TRAC:POIN", count)
+        self.state.set("TRAC:FEED", "SENS")
+        self.state.set("FORM:DATA", "SRE")
+        self.state.set("FORM:BORD", "SWAP")
+        self.buffer_count = count
+        self.buffer_interval = interval
+        self.buffer_delay = 0
+
+    def configureTriggered(self, count=30, delay=0, nplc=5):
+        #Set up the trigger model to wait for one trigger on the trigger link, wait delay seconds and then take count
+        #readings back to back (one per integration time of nplc power line cycles) into the trace buffer.
+        #Only settings that changed are written.
+        self.state.set("INIT:CONT", "OFF")
+        self.state.set("SENS:VOLT:NPLC", nplc)
+        self.state.set("TRIG:SOUR", "EXT")
+        self.state.set("TRIG:DEL", delay)
+        self.state.set("TRIG:COUN", 1)
+        self.state.set("SAMP:COUN", count)
+        self.state.set("TRAC:POIN", count)
+        self.state.set("TRAC:FEED", "SENS")
+        self.state.set("FORM:DATA", "SRE")
+        self.state.set("FORM:BORD", "SWAP")
+        self.buffer_count = count
+        self.buffer_interval = nplc/60
+        self.buffer_delay = delay
+
+    def armTriggered(self, count=30, delay=0, nplc=5):
+        #Set up and start a triggered acquisition (see configureTriggered) in one message. The readings start after the
+        #next trigger link pulse; collect them with readBuffer().
+        with self.transaction() as t:
+            self.configureTriggered(count, delay, nplc)
+            self.startBuffer(batch=t)
+
+    def startBuffer(self, batch=None):
+        #Clear the trace buffer and start filling it. With batch given the commands are added to that batch.
+        write = self.vm.write if batch is None else batch.write
+        write("TRAC:CLE")
+        write("TRAC:FEED:CONT NEXT")
+        #The buffer control goes back to NEVer by itself once the buffer is full
+        self.state.invalidate("TRAC:FEED:CONT")
+        write("INIT")
+
+    def readBuffer(self, timeout=None):
+        #Wait until the trace buffer is full and read all readings in one binary transfer.
+        #The readings are taken by the meter on its own, so the first wait is the whole acquisition.
+        #timeout (s) counts from the call, query times included.
+        runtime = self.buffer_delay + self.buffer_count*self.buffer_interval
+        if timeout is None:
+            timeout = 10 + 2*runtime
+        start = self.clock.time()
+        self.clock.sleep(runtime, 'TimePerPoint')
+        poll = max(self.buffer_interval, 0.05)
+        while int(float(self.vm.query("TRAC:POIN:ACT?"))) < self.buffer_count:
+            if self.clock.time()-start > timeout:
+                raise RuntimeError('2182 trace buffer not full after {:.1f} s.'.format(self.clock.time()-start))
+            self.clock.sleep(poll, 'BufferPoll')
+        return self.vm.query_binary_values("TRAC:DATA?", datatype='f', is_big_endian=False, container=np.array)
+
+    def bufferedReadings(self, count=30, interval=0.1, timeout=None):
+        #Take count readings, one every interval seconds, and return them as a numpy array
+        #The setup and start go out as one message
+        with self.transaction() as t:
+            self.configureBuffer(count, interval)
+            self.startBuffer(batch=t)
+        return self.readBuffer(timeout=timeout)
+
+
+"""Example Commands"""
+
+"""
+#Connect to the 2182 through GPIB port 17
+vm=K2182(GPIBnum=17)
+#Single reading of the free running meter on the 100 mV range
+vm.setRange(0.1)
+vm.fetch()
+#50 readings, one every 0.1 s, in one transfer
+v=vm.bufferedReadings(count=50, interval=0.1)
+v.mean(), v.std()
+#20 readings starting 0.5 s after the current source fires the trigger link
+vm.armTriggered(count=20, delay=0.5, nplc=5)
+#... turn on the source with an output trigger on the trigger link ...
+v=vm.readBuffer()
+"""
@@ -1,83 +1,221 @@
 # Basic utilities for using the Keithley 6221 AC /DC current source
 import pyvisa
-import time
 import numpy as np
+from UtilsClock import SystemClock
+from UtilsInstrumentState import ShadowState, CommandBatch
 
 class K6221:
     """Class for Keithley 6221"""
-    def __init__(self, GPIBnum=16):
-        #Initialize the 6221 connection through specified GPIB port
-        rm = pyvisa.ResourceManager()
-        self.ac = rm.open_resource('GPIB0::{}::INSTR'.format(GPIBnum))
+    max_message_length = 256
+
+    def __init__(self, GPIBnum=16, clock=SystemClock, resource=None):
+        #Initialize the 6221 connection through specified GPIB port, or use the given pyvisa resource
+        if resource is None:
+            rm = pyvisa.ResourceManager()
+            resource = rm.open_resource('GPIB0::{}::INSTR'.format(GPIBnum))
+        self.ac = resource
+        self.clock = clock
+        #Last value written for each setting (see UtilsInstrumentState.py). Empty until the first reset.
+        self.state = ShadowState(write=self.ac.write)
+
+    def transaction(self):
+        #Batch of 6221 writes and settings (see UtilsInstrumentState.py)
+        return CommandBatch(self.ac, state=self.state, MaxLength=self.max_message_length)
+
+    def reset(self):
+        #Reset the 6221 to a known state. Everything written before is forgotten.
+        self.state.invalidate()
+        self.state.set('*RST', True, send=lambda: self.ac.write('*RST'))
+
+    def ensureReset(self):
+        #Reset only on first use or after the state was invalidated (e.g. by a failed write)
+        if not self.state.known('*RST'):
+            self.reset()
+            return True
+        return False
+
+    def waitForComplete(self, timeout=10):
+        #Block on *OPC? until all pending operations (e.g. arming a waveform) are done, at most timeout seconds
+        saved = self.ac.timeout
+        self.ac.timeout = timeout*1000
+        try:
+            self.ac.query('*OPC?')
+        finally:
+            self.ac.timeout = saved
+
+    def waitAfterArm(self, wait_after_arm=None, timeout=10):
+        #With wait_after_arm=None wait for the arm to complete (*OPC?), otherwise sleep the given time
+        if wait_after_arm is None:
+            self.waitForComplete(timeout)
+        else:
+            self.clock.sleep(wait_after_arm, 'WaitAfterArm')
         
-    def sinOut(self, amp=1e-5, duration='INF' ,freq=17e3, offs=0, wait_after_arm=2):
+    def sinOut(self, amp=1e-5, duration='INF' ,freq=17e3, offs=0, wait_after_arm=None):
         #Trigger a sine wave output from the 6221(Useful for Lock-in measurements)
-        self.ac.write("SOUR:WAVE:ABOR")
-        self.ac.write("SOUR:WAVE:FUNC SIN")
-        self.ac.write("SOUR:WAVE:FREQ {}".format(freq))
-        self.ac.write("SOUR:WAVE:OFFS {}".format(offs))
-        self.ac.write("SOUR:WAVE:AMPL {}".format(amp))
-        self.ac.write("SOUR:WAVE:DUR:TIME {}".format(duration))
-        """For lock-in measurements, we want the Phase marker on and 
-        on pin 1 of the trigger link cable (connect VMC to REF IN on the Lock-in)"""
-        self.ac.write("SOUR:WAVE:PMAR 180")
-        self.ac.write("SOUR:WAVE:PMAR:STAT ON")
-        self.ac.write("SOUR:WAVE:PMAR:OLIN 1")
-        self.ac.write("SOUR:WAVE:ARM")
-        time.sleep(wait_after_arm)
+        #Settings that are already set are not written again
+        self.ensureReset()
+        with self.transaction() as t:
+            t.write("SOUR:WAVE:ABOR")
+            self.state.set("SOUR:WAVE:FUNC", "SIN")
+            self.state.set("SOUR:WAVE:FREQ", freq)
+            self.state.set("SOUR:WAVE:OFFS", offs)
+            self.state.set("SOUR:WAVE:AMPL", amp)
+            self.state.set("SOUR:WAVE:DUR:TIME", duration)
+            """For lock-in measurements, we want the Phase marker on and 
+            on pin 1 of the trigger link cable (connect VMC to REF IN on the Lock-in)"""
+            self.state.set("SOUR:WAVE:PMAR", 180)
+            self.state.set("SOUR:WAVE:PMAR:STAT", "ON")
+            self.state.set("SOUR:WAVE:PMAR:OLIN", 1)
+            t.write("SOUR:WAVE:ARM")
+        self.waitAfterArm(wait_after_arm)
         self.ac.write("SOUR:WAVE:INIT")
         
-    def pulseOut(self, amp=1e-5, duration=1e-3, offs=0, wait_after_arm=2):
+    def pulseOut(self, amp=1e-5, duration=1e-3, offs=0, wait_after_arm=None):
         #Trigger a square pulse output from the 6221 (Useful for switching measurements)
-        self.ac.write("SOUR:WAVE:ABOR")
-        self.ac.write("SOUR:CURR:COMP 105")
+        #Settings that are already set are not written again
+        self.ensureReset()
         if amp > 0:
             firstpoint=1.0
         else:
             firstpoint=-1.0
-        self.ac.write("SOUR:WAVE:ARB:DATA {}, 0, 0".format(firstpoint))
-        self.ac.write("SOUR:WAVE:FUNC ARB0")
-        self.ac.write("SOUR:WAVE:FREQ 1")
-        self.ac.write("SOUR:WAVE:OFFS {}".format(offs))
-        self.ac.write("SOUR:WAVE:AMPL {}".format(np.abs(amp)))
-        self.ac.write("SOUR:WAVE:DUR:TIME {}".format(duration))
-        self.ac.write("SOUR:WAVE:ARM")
-        time.sleep(wait_after_arm)
+        with self.transaction() as t:
+            t.write("SOUR:WAVE:ABOR")
+            self.state.set("SOUR:CURR:COMP", 105)
+            self.state.set("SOUR:WAVE:ARB:DATA", "{}, 0, 0".format(firstpoint))
+            self.state.set("SOUR:WAVE:FUNC", "ARB0")
+            self.state.set("SOUR:WAVE:FREQ", 1)
+            self.state.set("SOUR:WAVE:OFFS", offs)
+            self.state.set("SOUR:WAVE:AMPL", np.abs(amp))
+            self.state.set("SOUR:WAVE:DUR:TIME", duration)
+            t.write("SOUR:WAVE:ARM")
+        self.waitAfterArm(wait_after_arm)
         self.ac.write("SOUR:WAVE:INIT")
         
-    def PulseDeltaMeasurement(self, amp=1e-5, count=50, width=500e-6, sourcedelay=100e-6, interval=5, range=1):
+    def PulseDeltaMeasurement(self, amp=1e-5, count=50, width=500e-6, sourcedelay=100e-6, interval=5, range=1,
+                              reject=None, full_output=False, timeout=None, compliance=10):
         # Pulse Delta Measurement
         # To set this up, you need to connect the 6221 to a 2182 with both an RS-232 and trigger link cable.
         # Then set RS-232 communications as defined in the manuals. Lastly, connect only the 6221 to the computer via GPIB.
+        # The whole buffer (reading and timestamp of every pulse) is read in one binary transfer and the statistics
+        # are computed here (see pulseStatistics). With reject set, pulses further than reject robust standard
+        # deviations from the median are left out of the mean and standard deviation.
+        # Returns Vmean, Vstd, and with full_output=True also a dict with the per-pulse arrays and statistics.
+        # After the nominal run time (count*interval power line cycles) the buffer is polled until all count readings
+        # are in, at most timeout seconds (default: twice the run time plus 10 s).
+        # The 6221 is only reset on first use; after that only the settings that changed are written. A running
+        # waveform (sinOut/pulseOut) is aborted and the compliance (V) is set explicitly, since pulseOut raises it.
+
+        self.ensure2182()
+        with self.transaction() as t:
+            t.write('SOUR:WAVE:ABOR')
+            self.state.set('SOUR:CURR:COMP', compliance)
+            self.state.set('2182:VOLT:RANG', range, send=lambda: t.write("SYST:COMM:SER:SEND 'VOLT:RANG {}'".format(range)))
+            self.state.set('SOUR:PDEL:HIGH', amp)
+            self.state.set('SOUR:PDEL:LOW', 0)
+            self.state.set('SOUR:PDEL:WIDT', width)
+            self.state.set('SOUR:PDEL:SDEL', sourcedelay)
+            self.state.set('SOUR:PDEL:COUN', count)
+            self.state.set('SOUR:PDEL:INT', interval)
+            self.state.set('SOUR:PDEL:SWE', 'OFF')
+            self.state.set('TRAC:POIN', count)
+            self.state.set('FORM:ELEM', 'READ,TST')
+            self.state.set('FORM:DATA', 'SRE')
+            self.state.set('FORM:BORD', 'SWAP')
+            t.write('SOUR:PDEL:ARM')
+            t.write('INIT:IMM')
+        stats = self.readDeltaBuffer(count, count*interval/60, interval/60, reject, timeout, 'PulseDeltaRun')
+        self.last_pulse_delta=stats
+
+        if full_output:
+            return stats['mean'], stats['std'], stats
+        return stats['mean'], stats['std']
+
+    def DeltaMeasurement(self, amp=1e-5, count=100, delay=2e-3, range=1, nplc=1, reject=None, full_output=False, timeout=None,
+                         compliance=10):
+        # DC Delta Measurement: the 6221 alternates between +amp and -amp and the 2182 takes one reading after each
+        # alternation, triggered over the trigger link (wiring as for PulseDeltaMeasurement). Each delta reading is
+        # the 3-point average of the voltage difference, so thermal EMFs and their linear drift cancel.
+        # delay is the source delay before each reading and nplc the 2182 integration time in power line cycles.
+        # Returns Vmean, Vstd of the count delta readings, and with full_output=True also the dict of pulseStatistics
+        # with the raw deltas ('readings') and their timestamps ('times'). Waveforms and compliance as in PulseDeltaMeasurement.
+        self.ensure2182()
+        with self.transaction() as t:
+            t.write('SOUR:WAVE:ABOR')
+            self.state.set('SOUR:CURR:COMP', compliance)
+            self.state.set('2182:VOLT:RANG', range, send=lambda: t.write("SYST:COMM:SER:SEND 'VOLT:RANG {}'".format(range)))
+            self.state.set('2182:VOLT:NPLC', nplc, send=lambda: t.write("SYST:COMM:SER:SEND 'VOLT:NPLC {}'".format(nplc)))
+            self.state.set('SOUR:DELT:HIGH', amp)
+            self.state.set('SOUR:DELT:LOW', -amp)
+            self.state.set('SOUR:DELT:DEL', delay)
+            self.state.set('SOUR:DELT:COUN', count)
+            self.state.set('SOUR:DELT:CAB', 'ON')
+            self.state.set('TRAC:POIN', count)
+            self.state.set('FORM:ELEM', 'READ,TST')
+            self.state.set('FORM:DATA', 'SRE')
+            self.state.set('FORM:BORD', 'SWAP')
+            t.write('SOUR:DELT:ARM')
+            t.write('INIT:IMM')
+        # One delta reading per alternation, i.e. per source delay plus integration time
+        reading_time = delay+nplc/60
+        stats = self.readDeltaBuffer(count, count*reading_time, max(reading_time, 0.05), reject, timeout, 'DeltaRun')
+        self.last_delta=stats
+
+        if full_output:
+            return stats['mean'], stats['std'], stats
+        return stats['mean'], stats['std']
+
+    def ensure2182(self):
+        #Reset on first use and check that the 6221 finds the 2182
+        if self.ensureReset():
+            #returns 1 if the 6221 finds the 2182 connection via RS-232 (you must also set the connection via front panel with 19.2K baudrate)
+            if not self.ac.query('SOUR:DELT:NVPR?').strip() == '1':
+                #Check again on the next use
+                self.state.invalidate()
+                raise RuntimeError('No 2182A connecttion to 6221. Connect with a RS-232 cable and trigger link.')
+
+    def readDeltaBuffer(self, count, runtime, poll, reject=None, timeout=None, label='PulseDeltaRun'):
+        #Wait runtime, poll the buffer every poll seconds until it holds count readings (at most timeout seconds
+        #from the call, default twice the run time plus 10 s), stop the run and read the readings and timestamps in one transfer
+        if timeout is None:
+            timeout = 10 + 2*runtime
+        start = self.clock.time()
+        try:
+            self.clock.sleep(runtime, label)
+            while int(float(self.ac.query('TRAC:POIN:ACT?'))) < count:
+                if self.clock.time()-start > timeout:
+                    raise RuntimeError('6221 delta buffer not full after {:.1f} s.'.format(self.clock.time()-start))
+                self.clock.sleep(poll, 'BufferPoll')
+        finally:
+            #Stop the run also on a timeout (or an interrupt), so the 6221 does not keep sourcing into the sample
+            self.ac.write('SOUR:SWE:ABOR')
+        # Readings and timestamps come interleaved: reading 1, time 1, reading 2, time 2, ...
+        data=self.ac.query_binary_values('TRAC:DATA?', datatype='f', is_big_endian=False, container=np.array)
+        stats=pulseStatistics(data[0::2], reject=reject)
+        stats['times']=np.asarray(data[1::2], dtype=float)
+        return stats
+
 
-        self.ac.write('*RST')
-        self.ac.write("SYST:COMM:SER:SEND 'VOLT:RANG {}'".format(range))
-        #returns 1 if the 6221 finds the 2182 connection via RS-232 (you must also set the connection via front panel with 19.2K baudrate)
-        if not self.ac.query('SOUR:DELT:NVPR?').split('/n')[0] == '1':
-            RuntimeError('No 2182A connecttion to 6221. Connect with a RS-232 cable and trigger link.')
-        self.ac.write('SOUR:PDEL:HIGH {}'.format(amp))
-        self.ac.write('SOUR:PDEL:LOW {}'.format(0))
-        self.ac.write('SOUR:PDEL:WIDT {}'.format(width))
-        self.ac.write('SOUR:PDEL:SDEL {}'.format(sourcedelay))
-        self.ac.write('SOUR:PDEL:COUN {}'.format(count))
-        self.ac.write('SOUR:PDEL:INT {}'.format(interval))
-        self.ac.write('SOUR:PDEL:SWE OFF')
-        self.ac.write('TRAC:POIN {}'.format(count))
-        self.ac.write('SOUR:PDEL:ARM')
-        self.ac.write('INIT:IMM')
-        time.sleep(int(count)*int(interval)/60)
-        time.sleep(1)
-        self.ac.write('SOUR:SWE:ABOR') 
-        self.ac.write('CALC2:FORM SDEV')
-        self.ac.write('CALC2:STAT ON')
-        self.ac.write('CALC2:IMM')
-        Vstd=float(self.ac.query('CALC2:DATA?').split('\n')[0])
-        self.ac.write('CALC2:FORM MEAN')
-        self.ac.write('CALC2:STAT ON')
-        self.ac.write('CALC2:IMM')
-        Vmean=float(self.ac.query('CALC2:DATA?').split('\n')[0])
-
-        return Vmean, Vstd
+def pulseStatistics(readings, reject=None):
+    # Statistics of the per-pulse readings. mad is the median absolute deviation scaled to a standard deviation
+    # (1.4826*MAD). With reject set, readings further than reject*mad from the median are not used for the mean
+    # and std. std is the sample standard deviation, as returned by CALC2 SDEV.
+    readings=np.asarray(readings, dtype=float)
+    median=np.median(readings) if len(readings) > 0 else float('nan')
+    mad=1.4826*np.median(np.abs(readings-median)) if len(readings) > 0 else float('nan')
+    if reject is not None and mad > 0:
+        keep=np.abs(readings-median) <= reject*mad
+    else:
+        keep=np.ones(len(readings), dtype=bool)
+    kept=readings[keep]
+    return {'readings':readings,
+            'kept':keep,
+            'rejected':int(len(readings)-keep.sum()),
+            'mean':kept.mean() if len(kept) > 0 else float('nan'),
+            'std':kept.std(ddof=1) if len(kept) > 1 else 0.0,
+            'median':median,
+            'mad':mad,
+            'raw_mean':readings.mean() if len(readings) > 0 else float('nan'),
+            'raw_std':readings.std(ddof=1) if len(readings) > 1 else 0.0}
 
 
 """Example Commands"""
@@ -88,4 +226,9 @@ rm = pyvisa.ResourceManager()
 rm.list_resources()
 #Connect to the 6221 through GPIB port 16
 ac=K6221(GPIBnum=16)
+#Pulse delta with every pulse reading, leaving out pulses more than 5 robust standard deviations from the median
+Vmean, Vstd, trace = ac.PulseDeltaMeasurement(amp=1e-4, count=50, reject=5, full_output=True)
+trace['readings'], trace['times'], trace['median'], trace['rejected']
+#DC delta mode: 200 delta readings of +-10 uA
+Vmean, Vstd, deltas = ac.DeltaMeasurement(amp=1e-5, count=200, full_output=True)
 """
\ No newline at end of file
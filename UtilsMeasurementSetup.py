@@ -7,13 +7,21 @@ import os
 import numpy as np
 import math
 import pandas as pd
-import matplotlib.pyplot as plt
-from IPython import display
 from UtilsPPMS import *
 from UtilsKeithley6221 import *
-rm = visa.ResourceManager()
-print('Visa Rescource List:')
-rm.list_resources()
+from UtilsKeithley2182 import *
+from UtilsClock import *
+from UtilsInstrumentState import *
+from UtilsNoise import *
+from UtilsPlotting import *
+try:
+    rm = visa.ResourceManager()
+    print('Visa Rescource List:')
+    rm.list_resources()
+except (ValueError, OSError) as e:
+    # No VISA library installed (e.g. offline Linux box). Only dummy or simulated instruments can be added.
+    rm = None
+    print('Could not open the VISA resource manager:', e)
 
 '''
 ----------------
@@ -39,6 +47,19 @@ if float(sys.version.split(' ')[0].split('.')[0]) >= 3.8:
 # Empty class for dummy measurement testing
 class Empty: pass
 
+def precisionReached(readings, TargetError=None, TargetRelativeError=None):
+    # True once the standard error of the mean of readings is at most TargetError (V), or at most TargetRelativeError
+    # times the magnitude of the mean (whichever is looser)
+    readings=np.asarray(readings, dtype=float)
+    if len(readings) < 2:
+        return False
+    Target=0
+    if TargetError is not None:
+        Target=max(Target,TargetError)
+    if TargetRelativeError is not None:
+        Target=max(Target,TargetRelativeError*abs(readings.mean()))
+    return readings.std(ddof=1)/np.sqrt(len(readings)) <= Target
+
 def print_to_string(*args, **kwargs):
     # Prints the output of print() to a string
     output = io.StringIO()
@@ -47,9 +68,6 @@ def print_to_string(*args, **kwargs):
     output.close()
     return contents
 
-
-def custom_round(x, base=5):
-    return int(base * round(float(x)/base))
     
 '''
 **************************************************************************************************
@@ -74,10 +92,17 @@ class RotPuckConnection:
     
 class Instrument:
     # Class for defining instrument properties of connected Keithleys.
-    def __init__(self,DeviceType,GPIBNumber,DeviceName='Default',SwitchLabels={},Dummy=False):
+    def __init__(self,DeviceType,GPIBNumber,DeviceName='Default',SwitchLabels={},Dummy=False,Simulation=None,Clock=SystemClock):
+        # Simulation is an optional SimRig (see UtilsSimulation.py) which provides an emulated instrument.
+        # Clock is used by the driver for its waits (see UtilsClock.py).
         self.DeviceType=DeviceType
         self.GPIBNumber=GPIBNumber
         self.Dummy=Dummy
+        self.Simulation=Simulation
+        self.Clock=Clock
+        # Last value written for each source setting, so unchanged settings are not sent again (see UtilsInstrumentState.py).
+        # Call State.invalidate() after changing the instrument by hand.
+        self.State=ShadowState()
         if self.DeviceType==2182:
             self.addKeithley2182(GPIBNumber,DeviceName=DeviceName,SwitchLabels=SwitchLabels)
         elif self.DeviceType==2400:
@@ -93,11 +118,14 @@ class Instrument:
             self.DeviceName = 'Voltmeter'
         else:
             self.DeviceName = DeviceName
-        if not self.Dummy:
-            self.InstrumentObject=rm.open_resource('GPIB0::{}::INSTR'.format(GPIBNumber))
-        else:
+        if self.Dummy:
             self.InstrumentObject=Empty()
             print('Dummy 2182')
+        elif self.Simulation is not None:
+            self.InstrumentObject=self.Simulation.open2182(GPIBNumber)
+            print('Simulated 2182')
+        else:
+            self.InstrumentObject=K2182(GPIBNumber, clock=self.Clock)
         print('Added Keithley 2182 with name {} and GPIB number {}'.format(self.DeviceName,GPIBNumber))
         if len(SwitchLabels) > 0:
             if len(SwitchLabels) <= 4:
@@ -120,11 +148,14 @@ class Instrument:
             self.DeviceName = 'CurrentSource'
         else:
             self.DeviceName = DeviceName
-        if not self.Dummy:
-            self.InstrumentObject=Keithley2400("GPIB::{}".format(GPIBNumber))
-        else:
+        if self.Dummy:
             self.InstrumentObject=Empty()
             print('Dummy 2400')
+        elif self.Simulation is not None:
+            self.InstrumentObject=self.Simulation.open2400(GPIBNumber)
+            print('Simulated 2400')
+        else:
+            self.InstrumentObject=Keithley2400("GPIB::{}".format(GPIBNumber))
         print('Added Keithley 2400 with name {} and GPIB number {}'.format(self.DeviceName,GPIBNumber))
         if len(SwitchLabels) > 0:
             if len(SwitchLabels) <= 2:
@@ -146,11 +177,14 @@ class Instrument:
             self.DeviceName = 'Pulser'
         else:
             self.DeviceName = DeviceName
-        if not self.Dummy:
-            self.InstrumentObject=K6221(GPIBNumber)
-        else:
+        if self.Dummy:
             self.InstrumentObject=Empty()
             print('Dummy 6221')
+        elif self.Simulation is not None:
+            self.InstrumentObject=self.Simulation.open6221(GPIBNumber)
+            print('Simulated 6221')
+        else:
+            self.InstrumentObject=K6221(GPIBNumber, clock=self.Clock)
         print('Added Keithley 6221 with name {} and GPIB number {}'.format(self.DeviceName,GPIBNumber))
         if len(SwitchLabels) > 0:
             if len(SwitchLabels) <= 2:
@@ -169,9 +203,19 @@ class Instrument:
         
 class BreakoutBoxConnections:
     # Main Class for keeping track of connections to the breakoutbox/ switchbox and PPMS
-    def __init__(self):
+    def __init__(self,Simulation=None,Clock=None):
+        # Give a SimRig (see UtilsSimulation.py) as Simulation to emulate the PPMS, switch and all instruments added later.
+        # Clock is used for every wait of the measurement (see UtilsClock.py). It defaults to the clock of the
+        # simulation (virtual time) or to the real system clock.
         self.RotPuckConnectionList=[]
         self.InstrumentList=[]
+        self.Simulation=Simulation
+        if Clock is not None:
+            self.Clock=Clock
+        elif Simulation is not None:
+            self.Clock=Simulation.Clock
+        else:
+            self.Clock=SystemClock
             
     def addPPMS(self,PPMS_IP='192.168.0.7',Dummy=False):
         # Adds PPMS object and connects to the PPMS, reading current properties. 
@@ -180,7 +224,11 @@ class BreakoutBoxConnections:
         # For code testing, you can use the Dummy flag to make a fake PPMS connection.
         self.PPMS_IP=PPMS_IP
         if not Dummy:
-            self.PPMS = Dynacool(PPMS_IP)
+            if self.Simulation is not None:
+                self.PPMS = self.Simulation.openPPMS(PPMS_IP)
+                print('SIMULATED PPMS')
+            else:
+                self.PPMS = Dynacool(PPMS_IP, clock=self.Clock)
             CurrentPosition=self.PPMS.getPosition()
             CurrentTemperature=self.PPMS.getTemperature()
             CurrentField=self.PPMS.getField()
@@ -201,11 +249,17 @@ class BreakoutBoxConnections:
         # For code testing, you can use the Dummy flag to make a fake Switch connection.
         self.Switch_IP=Switch_IP
         if not Dummy:
-            self.Switch=tn.telnet(Switch_IP)
+            if self.Simulation is not None:
+                self.Switch=self.Simulation.openSwitch(Switch_IP)
+                print('SIMULATED Switch')
+            else:
+                self.Switch=tn.telnet(Switch_IP)
             print('Matrix Switch State:')
             self.Switch.getStatus()
+            self.SwitchState=SwitchState(self.Switch)
         else:
             self.Switch=Empty()
+            self.SwitchState=SwitchState(None)
             print('DUMMY Switch')
             print('Matrix Switch State:')
             print('NC')
@@ -219,7 +273,7 @@ class BreakoutBoxConnections:
         if len(SwitchLabels) != 0:
             if not hasattr(self,'Switch'):
                 raise ValueError('First add a switch with addMatrixSwitch() before defining switch labels for instruments')
-        AddedInstrument=Instrument(DeviceType,GPIBNumber,DeviceName=DeviceName,SwitchLabels=SwitchLabels,Dummy=Dummy)
+        AddedInstrument=Instrument(DeviceType,GPIBNumber,DeviceName=DeviceName,SwitchLabels=SwitchLabels,Dummy=Dummy,Simulation=self.Simulation,Clock=self.Clock)
         self.InstrumentList.append(AddedInstrument)
         return AddedInstrument
         
@@ -265,6 +319,8 @@ class BreakoutBoxConnections:
     # For printing the contents of this class
         OutPString=''
         OutPString += 'list of connected instruments:'
+        if self.Simulation is not None:
+            OutPString += '\nSIMULATED RIG'
         OutPString += '\nPPMS IP: '
         if hasattr(self,'PPMS_IP'):
             OutPString += self.PPMS_IP
@@ -321,7 +377,12 @@ class MeasurementConnection:
     # current to be continuous. If this is the case the CurrentAmplitude will be overwritten by the continuous current settings.
     # SwitchConnections is a list of the form ['<ConnectionName1>,<PartenerName1>','<ConnectionName2>,<PartenerName2>']
     # Which defines what connections to make in the switch box. This is optional, and requires a Switch to be added first.
-    def __init__(self,MeasurementName,BreakoutBoxConnections,Voltmeter='Voltmeter',CurrentSource='Continuous',CurrentAmplitude=1e-4, VoltRange=1, SwitchConnections=[]):
+    # With TargetError (V) or TargetRelativeError (fraction of the voltage) set, readings are taken until the standard error
+    # of the mean reaches the target (see setAdaptiveAveragingOptions). LastPoints is the number of readings of the last measurement.
+    # DCVoltRange is the 2182 range used for DC measurements (None leaves the range of the 2182 as it is). AutoSettings holds the
+    # reading counts chosen for this connection by MeasurementSettings.AutoConfigureConnection, and AutoReport its noise analysis.
+    def __init__(self,MeasurementName,BreakoutBoxConnections,Voltmeter='Voltmeter',CurrentSource='Continuous',CurrentAmplitude=1e-4, VoltRange=1, SwitchConnections=[],
+                 TargetError=None, TargetRelativeError=None):
         self.MeasurementName=MeasurementName
         self.BreakoutBoxConnections=BreakoutBoxConnections
         # Check if the specified current source  and voltmeter exists
@@ -331,6 +392,12 @@ class MeasurementConnection:
         self.CurrentSource=CurrentSource
         self.CurrentAmplitude=CurrentAmplitude
         self.VoltRange=VoltRange
+        self.TargetError=TargetError
+        self.TargetRelativeError=TargetRelativeError
+        self.LastPoints=None
+        self.DCVoltRange=None
+        self.AutoSettings={}
+        self.AutoReport=None
         if len(SwitchConnections) > 0:
             if not hasattr(self.BreakoutBoxConnections,'Switch'):
                 raise NameError('You must define all connections in BreakoutBoxConnections BEFORE defining the measurement settings! (add a Switch object before you set switch connections)')
@@ -378,14 +445,29 @@ class MeasurementSettings:
     def __init__(self,BreakoutBoxConnections,SampleID='Sample'):
         self.SampleID=SampleID
         self.BreakoutBoxConnections=BreakoutBoxConnections
+        # All waits go through this clock, so a simulated run finishes in virtual time and still reports
+        # the real time budget with self.Clock.budgetString()
+        self.Clock=BreakoutBoxConnections.Clock
         self.MeasurementConnections=[]
         self.PulseConnections=[]
         self.CCFlag=False
+        self.RecordPoints=False
+        self.LivePlot=None
         self.FileSettings()
         self.setVoltageMeasurementOptions()
         self.setCurrentSourceOptions()
         self.setVoltageSourceOptions()
         self.setPulseOptions()
+        self.setTriggerOptions()
+        self.setAdaptiveAveragingOptions()
+        self.setAutoConfigureOptions()
+        self.setSwitchOptions()
+        self.setStabilizerOptions()
+        self.setThermalSettleOptions()
+        self.setSweepOptions()
+        self.Telemetry=None
+        self.setTelemetryOptions()
+        self.setPlotOptions()
     
     def FileSettings(self,SampleID='Sample',MeasurementID='Measurement',MeasurementNote='', SaveFolder='auto'):
         # Use this to update the file annotation settings. You can also update the sample ID here
@@ -409,18 +491,19 @@ class MeasurementSettings:
             self.SaveFolder=SaveFolder
         
     def addMeasurementConnection(self,MeasurementName,Voltmeter='Voltmeter',CurrentSource='auto',
-                                 CurrentAmplitude=1e-4, VoltRange=1, SwitchConnections=[]):
+                                 CurrentAmplitude=1e-4, VoltRange=1, SwitchConnections=[], TargetError=None, TargetRelativeError=None):
         # Adds a measurement connection setup to the list.if CurrentSource == 'Continuous':
         if CurrentSource=='Continuous':
             if not hasattr(self,'CCAmplitude'):
                 raise ValueError('When using "Continuous" as the current source, you must define a continuous current first with setContinuousCurrent(amplitdue)')
         if CurrentSource == 'auto':
-            if self.PulseDelta:
+            if self.PulseDelta or self.HardwareDelta:
                 CurrentSource='Pulser'
             else:
                 CurrentSource='CurrentSource'
         self.MeasurementConnections.append(MeasurementConnection(MeasurementName,self.BreakoutBoxConnections,Voltmeter=Voltmeter,CurrentSource=CurrentSource,
-                                                                 CurrentAmplitude=CurrentAmplitude, VoltRange=VoltRange, SwitchConnections=SwitchConnections))
+                                                                 CurrentAmplitude=CurrentAmplitude, VoltRange=VoltRange, SwitchConnections=SwitchConnections,
+                                                                 TargetError=TargetError, TargetRelativeError=TargetRelativeError))
         
     def ListMeasurementNames(self):
         # Gets a list of the measurement names and stores it in self.MeasurementNames.
@@ -454,12 +537,23 @@ class MeasurementSettings:
             raise ValueError('Can only set the current source to constant if the voltage measurement is unipolar. Change it with setVoltageMeasurementOptions(BiPolar=False)')
         
     def setVoltageMeasurementOptions(self,NumberofVPoints=30,TimePerPoint=0.1,SkipPoints=5,DropOutliers=3,BiPolar=True, 
-                                     PulseDelta=True, PDCount=50, PDInterval=5, PDWidth=500e-6, PDSourceDelay=100e-6, WaitAfterOn=3):
+                                     PulseDelta=True, PDCount=50, PDInterval=5, PDWidth=500e-6, PDSourceDelay=100e-6, WaitAfterOn=3,
+                                     Buffered=False, PDReject=None, HardwareDelta=False, DeltaCount=100, DeltaDelay=2e-3, DeltaNPLC=1):
         #Use this function to set custom voltage measurement options. Otherwise the above defaults will be set.
+        #With Buffered=True the 2182 takes the NumberofVPoints readings of each polarity on its own timer (one per
+        #TimePerPoint) into its trace buffer, and they are read in one binary transfer instead of one fetch per point.
+        #With PDReject set, pulse delta readings further than PDReject robust standard deviations from the median
+        #are left out (see pulseStatistics in UtilsKeithley6221.py).
+        #With HardwareDelta=True (and PulseDelta=False) DC measurements run in the delta mode of a 6221 + 2182: DeltaCount
+        #delta readings of +-CurrentAmplitude, with DeltaDelay source delay and DeltaNPLC integration time, instead of
+        #reversing the current of a 2400 in software. The raw deltas of the last measurement are kept in self.LastDeltas.
+        #The source is confirmed on with *OPC? before measuring. That only means the output command is done, so WaitAfterOn
+        #is still waited for the leads and the sample to settle.
         self.NumberofVPoints=NumberofVPoints
         self.TimePerPoint=TimePerPoint
         self.SkipPoints=SkipPoints
         self.DropOutliers=DropOutliers
+        self.Buffered=Buffered
         self.BiPolar=BiPolar
         self.WaitAfterOn=WaitAfterOn
         self.PulseDelta=PulseDelta
@@ -467,96 +561,306 @@ class MeasurementSettings:
         self.PDInterval=PDInterval
         self.PDWidth=PDWidth
         self.PDSourceDelay=PDSourceDelay
+        self.PDReject=PDReject
+        self.HardwareDelta=HardwareDelta
+        self.DeltaCount=DeltaCount
+        self.DeltaDelay=DeltaDelay
+        self.DeltaNPLC=DeltaNPLC
         
-    def setCurrentSourceOptions(self,SourceCurrentRange=0,SourceComplianceVoltage=0):
+    def setCurrentSourceOptions(self,SourceCurrentRange=0,SourceComplianceVoltage=0,KeepSourceOn=False):
         #Use this function to set custom current source options. Otherwise the above defaults will be set.
+        #With KeepSourceOn=True the 2400 stays set up with its output on for the whole run: current changes and polarity
+        #reversals are only level writes, and WaitAfterOn is waited once when the source is set up. The output is only
+        #turned off while the switch changes (see SourcesOffForSwitching) and at the end of the run (see SourcesOff).
         self.SourceCurrentRange=SourceCurrentRange
         self.SourceComplianceVoltage=SourceComplianceVoltage
+        self.KeepSourceOn=KeepSourceOn
 
     def setVoltageSourceOptions(self,SourceVoltageRange=0,SourceComplianceCurrent=0):
         #Use this function to set custom current source options. Otherwise the above defaults will be set.
         self.SourceVoltageRange=SourceVoltageRange
         self.SourceComplianceCurrent=SourceComplianceCurrent
 
-    def setPulseOptions(self,WaitTimeAfterPulseArm=2,WaitAfterPulse=0.3):
+    def setPulseOptions(self,WaitTimeAfterPulseArm=None,WaitAfterPulse=0.3):
         #Use this function to set custom current source options. Otherwise the above defaults will be set.
+        #With WaitTimeAfterPulseArm=None the 6221 is asked with *OPC? when the pulse is armed, instead of waiting a fixed time.
         self.WaitTimeAfterPulseArm=WaitTimeAfterPulseArm
         self.WaitAfterPulse=WaitAfterPulse
 
+    def setTriggerOptions(self,Triggered=False,TriggerLine=1,TriggerNPLC=5,TriggerDelay=0.05):
+        # With Triggered=True DC measurements are timed by the instruments: for each polarity the 2182 is armed for an
+        # external trigger, and an :INIT of the 2400 switches its output to the polarity's current and at the same moment
+        # puts out a trigger link pulse on TriggerLine. The 2182 waits TriggerDelay (s, the settling time of the source)
+        # and takes NumberofVPoints readings back to back, one per TriggerNPLC power line cycles, which are collected in one
+        # transfer at the end. The output is turned on at 0 A, so after the source is set up the first trigger turns the
+        # current on, and the 2182 waits WaitAfterOn on top of TriggerDelay, like the wait after ApplyCurrent in DC mode.
+        # It is faster than DC mode because the readings follow each other at the integration time instead of TimePerPoint,
+        # and there is no fetch per reading.
+        self.Triggered=Triggered
+        self.TriggerLine=TriggerLine
+        self.TriggerNPLC=TriggerNPLC
+        self.TriggerDelay=TriggerDelay
+        # Extra settling the 2182 waits after the next trigger (WaitAfterOn once the source has been set up)
+        self.TriggerSettle=0
+
+    def setAdaptiveAveragingOptions(self,MinPoints=10,MaxPoints=300,BlockPoints=10):
+        # Used for MeasurementConnections with a TargetError or TargetRelativeError. Instead of NumberofVPoints readings per
+        # polarity (or PDCount / DeltaCount delta readings), MinPoints readings are taken first, and then more, BlockPoints
+        # at a time (one at a time for fetched 2182 readings), until the standard error of the mean reaches the target or
+        # MaxPoints readings are taken. The number of readings used is recorded in a <MeasurementName>_Points column.
+        self.AdaptiveMinPoints=MinPoints
+        self.AdaptiveMaxPoints=MaxPoints
+        self.AdaptiveBlockPoints=BlockPoints
+
+    def setAutoConfigureOptions(self,AutoConfigure=False,BurstPoints=256,TargetError=10e-9,TargetRelativeError=None,MaxPoints=1000):
+        # With AutoConfigure=True each MeasurementConnection is calibrated once at the start of every run (in StartDataRecording).
+        # A burst of BurstPoints raw readings is taken with the selected method, at the set TimePerPoint, PDInterval or delta
+        # timing. From its Allan deviation the number of readings (NumberofVPoints, PDCount or DeltaCount) is chosen that gives a
+        # standard error of TargetError (V), or of TargetRelativeError times the voltage (whichever is looser), at most MaxPoints.
+        # The 2182 range is chosen from the largest reading. The settings and noise of each connection go into the file header.
+        self.AutoConfigure=AutoConfigure
+        self.AutoBurstPoints=BurstPoints
+        self.AutoTargetError=TargetError
+        self.AutoTargetRelativeError=TargetRelativeError
+        self.AutoMaxPoints=MaxPoints
+
+    def setSwitchOptions(self,MinimalSwitching=False,ReorderConnections=False):
+        # With MinimalSwitching=True the matrix switch goes from one connection to the next by only switching the relays that
+        # differ (see SwitchState in UtilsInstrumentState.py), sent as one burst followed by a single WaitAfterSwitch, instead of
+        # connecting every pair with its own wait and resetting the switch after every connection. The switch is reset at the end of the run.
+        # With ReorderConnections=True the connections of each data point are measured in the order that needs the fewest relay
+        # changes (the data columns keep their order).
+        self.MinimalSwitching=MinimalSwitching
+        self.ReorderConnections=ReorderConnections
+
+    def setThermalSettleOptions(self,SettleMeasurement=None,SettleDrift=1e-4,SettleInterval=10,SettleReadings=4,SettleTimeout=3600,
+                                SettlePDCount=5,SettleVPoints=6):
+        # Give the name of a MeasurementConnection as SettleMeasurement to replace InitialWaitTime (and the wait after every
+        # temperature step of an R vs T scan) by waiting until the resistance of that connection stops drifting.
+        # SettleDrift is the largest accepted |dR/dt|/R in 1/min, fitted over the last SettleReadings readings taken
+        # every SettleInterval seconds. Readings use a short pulse delta (SettlePDCount) or DC run (SettleVPoints).
+        if SettleMeasurement is not None and SettleMeasurement not in self.ListMeasurementNames():
+            raise ValueError('SettleMeasurement {} is not a defined MeasurementConnection. Add it first with addMeasurementConnection'.format(SettleMeasurement))
+        if SettleReadings < 2:
+            raise ValueError('SettleReadings must be at least 2 to fit the drift')
+        self.SettleMeasurement=SettleMeasurement
+        self.SettleDrift=SettleDrift
+        self.SettleInterval=SettleInterval
+        self.SettleReadings=SettleReadings
+        self.SettleTimeout=SettleTimeout
+        self.SettlePDCount=SettlePDCount
+        self.SettleVPoints=max(SettleVPoints,3)
+
+    def setSweepOptions(self,Sweep=False,TemperatureRate=1,FieldRate=10,BothDirections=False,BinToGrid=False,
+                        TemperatureTolerance=0.1,FieldTolerance=5):
+        # With Sweep=True, RunRvsTMeasurement and RunRvsHMeasurement do one continuous ramp from the first to the last
+        # temperature/field of the list (TemperatureRate in K/min, FieldRate in Oe/s) and measure back to back while it moves,
+        # instead of stabilizing at every point. With BothDirections the ramp then goes back to the first value.
+        # Every row gets its start/end time and the swept value interpolated at the middle of the measurement.
+        # BinToGrid also writes a _binned.csv file with the rows averaged onto the given temperature/field list.
+        # The ramp ends when the value is within the tolerance (K, Oe) of the end point.
+        self.Sweep=Sweep
+        self.SweepTemperatureRate=TemperatureRate
+        self.SweepFieldRate=FieldRate
+        self.SweepBothDirections=BothDirections
+        self.SweepBinToGrid=BinToGrid
+        self.SweepTemperatureTolerance=TemperatureTolerance
+        self.SweepFieldTolerance=FieldTolerance
+
+    def setTelemetryOptions(self,UseTelemetry=False,TelemetryInterval=1,TelemetryBufferSize=36000,AverageOverMeasurement=False):
+        # With UseTelemetry=True, a background sampler reads temperature, field, angle and their status every TelemetryInterval
+        # seconds into a ring buffer (see PPMSTelemetry) and writes them to <datafile>_telemetry.csv. The data rows then use
+        # the latest sample instead of reading the PPMS, or with AverageOverMeasurement the average over the time the row was measured.
+        self.UseTelemetry=UseTelemetry
+        self.TelemetryInterval=TelemetryInterval
+        self.TelemetryBufferSize=TelemetryBufferSize
+        self.TelemetryAverage=AverageOverMeasurement
+        self.stopTelemetry()
+        if UseTelemetry and hasattr(self.BreakoutBoxConnections,'PPMS') and not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
+            self.Telemetry=PPMSTelemetry(self.BreakoutBoxConnections.PPMS, interval=TelemetryInterval, size=TelemetryBufferSize)
+
+    def setPlotOptions(self,PlotWorker=False,MaxRefreshRate=2,PlotBackend=None):
+        # With PlotWorker=True the live plot (PlotData) is drawn by a separate process in windows of its own (see LivePlotProcess),
+        # redrawn at most MaxRefreshRate times per second, so the measurement never waits for the plot. PlotBackend is the
+        # matplotlib backend of that process (None for the default, e.g. 'TkAgg'). From a script, the script needs the usual
+        # "if __name__ == '__main__':" guard, since the worker process imports it again.
+        self.PlotWorker=PlotWorker
+        self.MaxRefreshRate=MaxRefreshRate
+        self.PlotBackend=PlotBackend
+
+    def stopTelemetry(self):
+        # Stops the background PPMS sampler, if there is one
+        if self.Telemetry is not None:
+            self.Telemetry.stop()
+            self.Telemetry.setFile(None)
+            self.Telemetry=None
+
+    def setStabilizerOptions(self,UseStabilizer=False,PollInterval=1,TemperatureTolerance=0.05,FieldTolerance=2,HoldTime=0,
+                             TemperatureTimeout=6000,FieldTimeout=3600):
+        # With UseStabilizer=True, the PPMS waits poll the temperature/field status every PollInterval seconds and return as
+        # soon as the status is stable and the value has been within the tolerance (K, Oe) of the setpoint for HoldTime seconds,
+        # instead of WaitFor with a fixed delay. The time of each wait is logged in PPMS.waitLog (see PPMS.waitLogString()).
+        self.UseStabilizer=UseStabilizer
+        self.PollInterval=PollInterval
+        self.TemperatureTolerance=TemperatureTolerance
+        self.FieldTolerance=FieldTolerance
+        self.HoldTime=HoldTime
+        self.TemperatureTimeout=TemperatureTimeout
+        self.FieldTimeout=FieldTimeout
+        if hasattr(self.BreakoutBoxConnections,'PPMS') and not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
+            self.BreakoutBoxConnections.PPMS.setStabilizer(UseStabilizer, pollInterval=PollInterval, temperatureTolerance=TemperatureTolerance,
+                                                           fieldTolerance=FieldTolerance, holdTime=HoldTime,
+                                                           temperatureTimeout=TemperatureTimeout, fieldTimeout=FieldTimeout)
+
     def ApplyCurrent(self,CurrentSourceInstrument,CurrentAmplitude=1e-5, Verbose=False):
         # Use this function to have the current source output current
         CSIO=CurrentSourceInstrument.InstrumentObject
         if Verbose:
             print('Sourcing Current of {:.1e} from {}'.format(CurrentAmplitude,CurrentSourceInstrument.DeviceName))
-        if not isinstance(CurrentSourceInstrument.InstrumentObject,Empty):
-            # Check if the instrument is a dummy or not
-            CSIO.apply_current()  # Sets up to source current
-            if self.SourceCurrentRange != 0:
-                CSIO.source_current_range = self.SourceCurrentRange
-            if self.SourceComplianceVoltage != 0:
-                CSIO.compliance_voltage = self.SourceComplianceVoltage
-            CSIO.source_current = CurrentAmplitude
-            CSIO.enable_source()
-        time.sleep(self.WaitAfterOn)
+        with self.Clock.phase('Source'):
+            if not isinstance(CurrentSourceInstrument.InstrumentObject,Empty):
+                # Check if the instrument is a dummy or not
+                # The source function, range and compliance are only sent when they changed since the last call
+                def setup():
+                    CSIO.apply_current()  # Sets up to source current
+                    if self.SourceCurrentRange != 0:
+                        CSIO.source_current_range = self.SourceCurrentRange
+                    if self.SourceComplianceVoltage != 0:
+                        CSIO.compliance_voltage = self.SourceComplianceVoltage
+                SetUp=CurrentSourceInstrument.State.set('apply',('current',self.SourceCurrentRange,self.SourceComplianceVoltage),setup)
+                if not self.Triggered:
+                    self.SetSourceCurrent(CurrentSourceInstrument,CurrentAmplitude)
+                elif not CurrentSourceInstrument.State.get('output',False):
+                    # In triggered mode the trigger switches the current on (see TriggerFromSource)
+                    self.SetSourceCurrent(CurrentSourceInstrument,0)
+                if self.SourceOutput(CurrentSourceInstrument,True):
+                    # Returns once the output is on
+                    CSIO.ask('*OPC?')
+            else:
+                SetUp=True
+        if self.KeepSourceOn and not SetUp:
+            # The source is still set up from an earlier point, so it does not need to settle again
+            self.TriggerSettle=0
+            return
+        if self.Triggered:
+            # The current comes on with the first trigger, so the 2182 waits WaitAfterOn after it (see ReadVoltages)
+            self.TriggerSettle=self.WaitAfterOn
+        else:
+            with self.Clock.phase('Settle'):
+                self.Clock.sleep(self.WaitAfterOn, 'WaitAfterOn')
 
     def CurrentOff(self,CurrentSourceInstrument, Verbose=False):
         #Use this function to have the current source turn off its output
+        #With KeepSourceOn the output stays on until the switch changes or the run ends
+        if self.KeepSourceOn:
+            return
         if Verbose:
             print('Stopping output from {}'.format(CurrentSourceInstrument.DeviceName))
         if not isinstance(CurrentSourceInstrument.InstrumentObject,Empty):
-            CurrentSourceInstrument.InstrumentObject.shutdown()
+            with self.Clock.phase('Source'):
+                # shutdown ramps the current to zero
+                CurrentSourceInstrument.State.invalidate('source_current','output')
+                CurrentSourceInstrument.InstrumentObject.shutdown()
+                CurrentSourceInstrument.State.set('output',False,lambda: None)
+
+    def SourceOutput(self,SourceInstrument,On):
+        # Turns the output of a 2400 on or off, unless it already is. Returns True if it was switched.
+        SIO=SourceInstrument.InstrumentObject
+        if On:
+            return SourceInstrument.State.set('output',True,SIO.enable_source)
+        return SourceInstrument.State.set('output',False,SIO.disable_source)
+
+    def SourcesOffForSwitching(self, Verbose=False):
+        # Turns off the output of every 2400 that is still on (with KeepSourceOn), before the switch changes or a pulse.
+        # The source stays set up, so ApplyCurrent only turns the output back on.
+        for SourceInstrument in self.BreakoutBoxConnections.InstrumentList:
+            if SourceInstrument.DeviceType == 2400 and SourceInstrument.State.get('output',False):
+                if Verbose:
+                    print('Turning off output of {} while switching'.format(SourceInstrument.DeviceName))
+                with self.Clock.phase('Source'):
+                    self.SourceOutput(SourceInstrument,False)
+
+    def SourcesOff(self, Verbose=False):
+        # End of a run: ramps down and turns off every 2400 output that is still on (or may be, e.g. after an error),
+        # and forgets their setup so the next run sets them up (and waits WaitAfterOn) again
+        for SourceInstrument in self.BreakoutBoxConnections.InstrumentList:
+            if SourceInstrument.DeviceType != 2400 or isinstance(SourceInstrument.InstrumentObject,Empty):
+                continue
+            if SourceInstrument.State.get('output',True):
+                if Verbose:
+                    print('Stopping output from {}'.format(SourceInstrument.DeviceName))
+                with self.Clock.phase('Source'):
+                    SourceInstrument.InstrumentObject.shutdown()
+            SourceInstrument.State.invalidate('apply','source_current','source_voltage','output')
+
+    def TriggerFromSource(self,CurrentSourceInstrument,CurrentAmplitude):
+        # Runs one source cycle of a 2400 that switches the output to CurrentAmplitude and puts out a trigger link pulse
+        # at that moment, which starts an armed 2182. The output stays at that current after the cycle.
+        CSIO=CurrentSourceInstrument.InstrumentObject
+        CurrentSourceInstrument.State.set('output_trigger',self.TriggerLine,
+                                          lambda: CSIO.write(':TRIG:OLIN {};:TRIG:OUTP SOUR;:SOUR:CLE:AUTO OFF'.format(self.TriggerLine)))
+        CSIO.write(':SOUR:CURR:TRIG {:g};:INIT'.format(CurrentAmplitude))
+        CurrentSourceInstrument.State.set('source_current',CurrentAmplitude,lambda: None)
+
+    def SetSourceCurrent(self,CurrentSourceInstrument,CurrentAmplitude):
+        # Sets the source current of a 2400, unless it is already set to this value
+        CSIO=CurrentSourceInstrument.InstrumentObject
+        CurrentSourceInstrument.State.set('source_current',CurrentAmplitude,lambda: setattr(CSIO,'source_current',CurrentAmplitude))
 
     def ApplyVoltage(self,VoltageSourceInstrument,VoltageAmplitude=1, Verbose=False):
         # Use this function to have the current source output current
         VSIO=VoltageSourceInstrument.InstrumentObject
         if Verbose:
             print('Sourcing Voltage of {:.1e} from {}'.format(VoltageAmplitude,VoltageSourceInstrument.DeviceName))
-        if not isinstance(VoltageSourceInstrument.InstrumentObject,Empty):
-            # Check if the instrument is a dummy or not
-            VSIO.apply_voltage()
-            if self.SourceVoltageRange != 0:
-                VSIO.source_voltage_range = self.SourceVoltageRange
-            if self.SourceComplianceVoltage != 0:
-                VSIO.compliance_current = self.SourceComplianceCurrent
-            VSIO.source_voltage = VoltageAmplitude
-            VSIO.enable_source()
-        time.sleep(self.WaitAfterOn)
+        with self.Clock.phase('Source'):
+            if not isinstance(VoltageSourceInstrument.InstrumentObject,Empty):
+                # Check if the instrument is a dummy or not
+                def setup():
+                    VSIO.apply_voltage()
+                    if self.SourceVoltageRange != 0:
+                        VSIO.source_voltage_range = self.SourceVoltageRange
+                    if self.SourceComplianceVoltage != 0:
+                        VSIO.compliance_current = self.SourceComplianceCurrent
+                VoltageSourceInstrument.State.set('apply',('voltage',self.SourceVoltageRange,self.SourceComplianceCurrent),setup)
+                VoltageSourceInstrument.State.set('source_voltage',VoltageAmplitude,lambda: setattr(VSIO,'source_voltage',VoltageAmplitude))
+                if self.SourceOutput(VoltageSourceInstrument,True):
+                    VSIO.ask('*OPC?')
+        with self.Clock.phase('Settle'):
+            self.Clock.sleep(self.WaitAfterOn, 'WaitAfterOn')
 
     def VoltageOff(self,VoltageSourceInstrument, Verbose=False):
         #Use this function to have the voltage source turn off its output
         if Verbose:
             print('Stopping output from {}'.format(VoltageSourceInstrument.DeviceName))
         if not isinstance(VoltageSourceInstrument.InstrumentObject,Empty):
-            VoltageSourceInstrument.InstrumentObject.shutdown()
+            with self.Clock.phase('Source'):
+                VoltageSourceInstrument.State.invalidate('source_voltage','output')
+                VoltageSourceInstrument.InstrumentObject.shutdown()
 
-    def MeasureVoltageDC(self,Voltmeter='Voltmeter', CurrentSource='CurrentSource', CurrentAmplitude=1e-5, Verbose=False):
+    def MeasureVoltageDC(self,Voltmeter='Voltmeter', CurrentSource='CurrentSource', CurrentAmplitude=1e-5, Verbose=False,
+                         TargetError=None, TargetRelativeError=None, VoltRange=None):
         #This function measures the voltage and standard deviation at a given Voltmeter. 
         #If the CCFlag is negative, it will first apply a current with the given Current Source
+        #With a precision target each polarity is averaged until it reaches the target (see AcquireVoltages).
+        #The number of readings used (of both polarities) is stored in self.LastPoints.
+        #With VoltRange given, the 2182 is set to that range first.
 
         #First get the Voltmeter and Current Source Instrument objects from the Device Names given.
         VM=self.BreakoutBoxConnections.getInstrumentfromDeviceName(Voltmeter)
         CS=self.BreakoutBoxConnections.getInstrumentfromDeviceName(CurrentSource)
 
+        if VoltRange is not None and not isinstance(VM.InstrumentObject,Empty):
+            VM.InstrumentObject.setRange(VoltRange)
+
         # Turn on the current if constant current is not set
         if not self.CCFlag:
             self.ApplyCurrent(CS,CurrentAmplitude=CurrentAmplitude, Verbose=Verbose)
-        v_up = []
         if Verbose:
             print('Measuring Positive Voltages with {}'.format(VM.DeviceName))
 
         # Measure the positive current voltages
-        for i in range(self.NumberofVPoints):  
-            time.sleep(self.TimePerPoint)
-            if i < self.SkipPoints:
-                continue
-            if not isinstance(VM.InstrumentObject,Empty):
-            # Only fetch if the instrument object is real, otherwise add -999 V for dummy objects
-                v_up.append(float(VM.InstrumentObject.query("fetch?")))
-            else:
-                v_up.append(-999.0+i)
-        # Sort and drop the outliers
-        v_up = sorted(v_up)
-        v_up = v_up[self.DropOutliers: -self.DropOutliers]
+        v_up = self.AcquireVoltages(VM, Dummy=-999.0, CS=CS, CurrentAmplitude=CurrentAmplitude, TargetError=TargetError, TargetRelativeError=TargetRelativeError)
+        Points = self.LastVPoints
         
         if self.BiPolar:
             if Verbose:
@@ -564,48 +868,408 @@ class MeasurementSettings:
 
             # If BiPolar flag is true, now measure negative current voltages
             if not isinstance(CS.InstrumentObject,Empty):
-                CS.InstrumentObject.source_current = -1 * CurrentAmplitude
-                CS.InstrumentObject.enable_source()
+                with self.Clock.phase('Source'):
+                    if not self.Triggered:
+                        # in triggered mode the trigger switches the polarity (see ReadVoltages)
+                        self.SetSourceCurrent(CS, -1 * CurrentAmplitude)
+                    self.SourceOutput(CS, True)
 
-            v_dn = []
             if Verbose:
                 print('Measuring Negative Voltages with {}'.format(VM.DeviceName))
-            for i in range(self.NumberofVPoints):  # Measure for negative current
-                time.sleep(self.TimePerPoint)
-                if i < self.SkipPoints:
-                    continue
-                if not isinstance(VM.InstrumentObject,Empty):
-                    v_dn.append(float(VM.InstrumentObject.query("fetch?")))
-                else:
-                    v_dn.append(999.0+i)
+            v_dn = self.AcquireVoltages(VM, Dummy=999.0, CS=CS, CurrentAmplitude=-1 * CurrentAmplitude, TargetError=TargetError, TargetRelativeError=TargetRelativeError)
+            self.LastPoints = Points + self.LastVPoints
 
             # Turn off the current        
             self.CurrentOff(CS, Verbose=Verbose)
-            # Drop outliers
-            v_dn = sorted(v_dn)
-            v_dn = v_dn[self.DropOutliers: -self.DropOutliers]
 
             # Take averages for Bipolar setting
-            average_v = (np.array(v_up).mean() - np.array(v_dn).mean())/2
-            std_v = (np.array(v_up).std() + np.array(v_dn).std())/2
+            average_v = (v_up.mean() - v_dn.mean())/2
+            std_v = (v_up.std() + v_dn.std())/2
             return average_v, std_v
         else:
             # Turn off the current and do the same for unipolar
-            self.CurrentOff(CurrentSource=CurrentSource, Verbose=Verbose)
-            average_v = np.array(v_up).mean()
-            std_v = np.array(v_up).std()
+            self.CurrentOff(CS, Verbose=Verbose)
+            self.LastPoints = Points
+            average_v = v_up.mean()
+            std_v = v_up.std()
             return average_v, std_v
 
-    def MeasureVoltagePulseDelta(self, CurrentSource='Pulser', CurrentAmplitude=1e-5, VoltRange=1):
+    def AcquireVoltages(self, VM, Dummy=-999.0, CS=None, CurrentAmplitude=None, TargetError=None, TargetRelativeError=None):
+        # Takes NumberofVPoints readings with the Voltmeter instrument VM, skips the first SkipPoints, drops the
+        # DropOutliers lowest and highest and returns the rest as a sorted array.
+        # Dummy instruments give Dummy+i for reading i. In triggered mode the current source CS switches to CurrentAmplitude
+        # and starts the readings.
+        # With a precision target, AdaptiveMinPoints readings are taken first and more are added until the standard error
+        # of the kept readings reaches the target (see setAdaptiveAveragingOptions). The number of readings taken
+        # (without the skipped ones) is stored in self.LastVPoints.
+        Adaptive = TargetError is not None or TargetRelativeError is not None
+        with self.Clock.phase('Acquire'):
+            if isinstance(VM.InstrumentObject,Empty):
+                readings = Dummy+np.arange(self.NumberofVPoints, dtype=float)
+            else:
+                Count = self.SkipPoints+self.AdaptiveMinPoints if Adaptive else self.NumberofVPoints
+                readings = self.ReadVoltages(VM, Count, CS=CS, CurrentAmplitude=CurrentAmplitude)
+                while Adaptive:
+                    Taken = len(readings)-self.SkipPoints
+                    if Taken >= self.AdaptiveMaxPoints or precisionReached(self.KeptVoltages(readings), TargetError, TargetRelativeError):
+                        break
+                    # Fetched readings are checked one by one, buffered ones a block at a time
+                    Block = self.AdaptiveBlockPoints if self.Buffered or self.Triggered else 1
+                    More = self.ReadVoltages(VM, min(Block, self.AdaptiveMaxPoints-Taken), CS=CS, CurrentAmplitude=CurrentAmplitude, First=False)
+                    readings = np.concatenate((readings, More))
+        self.LastVPoints = len(readings)-self.SkipPoints
+        return self.KeptVoltages(readings)
+
+    def KeptVoltages(self, readings):
+        # Leaves out the first SkipPoints readings and the DropOutliers lowest and highest of the rest, sorted
+        readings = np.sort(readings[self.SkipPoints:])
+        return readings[self.DropOutliers:len(readings)-self.DropOutliers]
+
+    def ReadVoltages(self, VM, Count, CS=None, CurrentAmplitude=None, First=True):
+        # Count raw readings of the Voltmeter instrument VM. The first SkipPoints readings of the First block are not read.
+        # In triggered mode the trigger of the First block switches the current, so the 2182 waits TriggerDelay (and
+        # TriggerSettle) after it. Later blocks continue at the same current, so they are triggered without a delay.
+        if self.Triggered and CS is not None and not isinstance(CS.InstrumentObject,Empty):
+            Delay = 0
+            if First:
+                Delay = self.TriggerDelay+self.TriggerSettle
+                self.TriggerSettle = 0
+            VM.InstrumentObject.armTriggered(count=Count, delay=Delay, nplc=self.TriggerNPLC)
+            self.TriggerFromSource(CS, CurrentAmplitude)
+            return np.asarray(VM.InstrumentObject.readBuffer(), dtype=float)
+        elif self.Buffered:
+            # The meter samples on its own timer; all readings come back in one binary transfer
+            readings = VM.InstrumentObject.bufferedReadings(count=Count, interval=self.TimePerPoint)
+            return np.asarray(readings, dtype=float)
+        readings = np.full(Count, np.nan)
+        for i in range(Count):
+            self.Clock.sleep(self.TimePerPoint, 'TimePerPoint')
+            if i >= self.SkipPoints or not First:
+                readings[i] = VM.InstrumentObject.fetch()
+        return readings
+
+    def MeasureVoltagePulseDelta(self, CurrentSource='Pulser', CurrentAmplitude=1e-5, VoltRange=1, TargetError=None, TargetRelativeError=None):
         #This function measures the voltage and standard deviation at a given Voltmeter using 6221 pulse delta. 
+        #With a precision target, pulse delta runs are repeated until it is reached (see AdaptiveDeltaRuns).
 
         #First get the Current Source Instrument object from the Device Names given.
         CS=self.BreakoutBoxConnections.getInstrumentfromDeviceName(CurrentSource)
-        average_v, std_v = CS.InstrumentObject.PulseDeltaMeasurement(amp=CurrentAmplitude, count=self.PDCount, 
-                                                                     interval=self.PDInterval, width=self.PDWidth, 
-                                                                     sourcedelay=self.PDSourceDelay, range=VoltRange)
-        return average_v, std_v
+        def run(Count):
+            return CS.InstrumentObject.PulseDeltaMeasurement(amp=CurrentAmplitude, count=Count, 
+                                                             interval=self.PDInterval, width=self.PDWidth, 
+                                                             sourcedelay=self.PDSourceDelay, range=VoltRange,
+                                                             reject=self.PDReject, full_output=True)[2]
+        with self.Clock.phase('Acquire'):
+            stats = self.AdaptiveDeltaRuns(run, self.PDCount, TargetError, TargetRelativeError)
+        return stats['mean'], stats['std']
             
+    def MeasureVoltageDelta(self, CurrentSource='Pulser', CurrentAmplitude=1e-5, VoltRange=1, TargetError=None, TargetRelativeError=None):
+        #This function measures the voltage and standard deviation at a given Voltmeter using 6221 DC delta mode.
+        #The raw delta readings and their timestamps are kept in self.LastDeltas.
+        CS=self.BreakoutBoxConnections.getInstrumentfromDeviceName(CurrentSource)
+        def run(Count):
+            return CS.InstrumentObject.DeltaMeasurement(amp=CurrentAmplitude, count=Count, delay=self.DeltaDelay, nplc=self.DeltaNPLC,
+                                                        range=VoltRange, reject=self.PDReject, full_output=True)[2]
+        with self.Clock.phase('Acquire'):
+            self.LastDeltas = self.AdaptiveDeltaRuns(run, self.DeltaCount, TargetError, TargetRelativeError)
+        return self.LastDeltas['mean'], self.LastDeltas['std']
+
+    def AdaptiveDeltaRuns(self, run, Count, TargetError=None, TargetRelativeError=None):
+        # run(n) does a (pulse) delta run of n readings and returns its pulseStatistics. Without a precision target this is
+        # one run of Count readings. Otherwise a run of AdaptiveMinPoints readings is followed by runs of AdaptiveBlockPoints
+        # until the standard error of the kept readings reaches the target, or AdaptiveMaxPoints readings are taken.
+        # Returns the statistics of all readings; their number is stored in self.LastPoints.
+        if TargetError is None and TargetRelativeError is None:
+            stats = run(Count)
+        else:
+            stats = run(self.AdaptiveMinPoints)
+            while len(stats['readings']) < self.AdaptiveMaxPoints:
+                if precisionReached(stats['readings'][stats['kept']], TargetError, TargetRelativeError):
+                    break
+                more = run(min(self.AdaptiveBlockPoints, self.AdaptiveMaxPoints-len(stats['readings'])))
+                readings = np.concatenate((stats['readings'], more['readings']))
+                times = np.concatenate((stats['times'], more['times'])) if 'times' in stats and 'times' in more else None
+                stats = pulseStatistics(readings, reject=self.PDReject)
+                if times is not None:
+                    stats['times'] = times
+        self.LastPoints = len(stats['readings'])
+        return stats
+
+    def MeasureVoltage(self, MeasurementConnection, Verbose=False, Adaptive=True):
+        # Measures the voltage of an already connected MeasurementConnection with the selected method:
+        # pulse delta, hardware DC delta or DC with current reversal in software.
+        # With Adaptive, the precision target of the connection is used (if it has one), and the number of readings
+        # used is stored in MeasurementConnection.LastPoints. The reading counts chosen by AutoConfigureConnection are used as well.
+        if Adaptive:
+            Target=dict(TargetError=MeasurementConnection.TargetError, TargetRelativeError=MeasurementConnection.TargetRelativeError)
+            Settings=MeasurementConnection.AutoSettings
+        else:
+            Target={}
+            Settings={}
+        Saved={Name:getattr(self,Name) for Name in Settings}
+        try:
+            for Name,Value in Settings.items():
+                setattr(self,Name,Value)
+            average_v,std_v=self.MeasureVoltageWithMethod(MeasurementConnection, Target, Verbose=Verbose)
+        finally:
+            for Name,Value in Saved.items():
+                setattr(self,Name,Value)
+        if Adaptive:
+            MeasurementConnection.LastPoints=self.LastPoints
+        return average_v,std_v
+
+    def MeasureVoltageWithMethod(self, MeasurementConnection, Target={}, Verbose=False):
+        # Measures the voltage of MeasurementConnection with pulse delta, hardware DC delta or DC, with the precision Target
+        if self.PulseDelta:
+            average_v,std_v=self.MeasureVoltagePulseDelta(CurrentSource=MeasurementConnection.CurrentSource, 
+                                                          CurrentAmplitude=MeasurementConnection.CurrentAmplitude, VoltRange=MeasurementConnection.VoltRange, **Target)
+        elif self.HardwareDelta:
+            average_v,std_v=self.MeasureVoltageDelta(CurrentSource=MeasurementConnection.CurrentSource, 
+                                                     CurrentAmplitude=MeasurementConnection.CurrentAmplitude, VoltRange=MeasurementConnection.VoltRange, **Target)
+        else:
+            average_v,std_v=self.MeasureVoltageDC(Voltmeter=MeasurementConnection.Voltmeter,CurrentSource=MeasurementConnection.CurrentSource, 
+                                                  CurrentAmplitude=MeasurementConnection.CurrentAmplitude, Verbose=Verbose,
+                                                  VoltRange=MeasurementConnection.DCVoltRange, **Target)
+        return average_v,std_v
+
+    def NoiseBurst(self, MeasurementConnection, Verbose=False):
+        # Raw readings of an already connected MeasurementConnection for AutoConfigureConnection: AutoBurstPoints (pulse) delta
+        # readings, or buffered 2182 readings with the positive current on. If the 2182 overflows, the burst is taken again
+        # on the next range. Returns the readings and the time between them (s), or None for dummy instruments.
+        if self.PulseDelta or self.HardwareDelta:
+            CS=self.BreakoutBoxConnections.getInstrumentfromDeviceName(MeasurementConnection.CurrentSource)
+            if isinstance(CS.InstrumentObject,Empty):
+                return None
+        else:
+            VM=self.BreakoutBoxConnections.getInstrumentfromDeviceName(MeasurementConnection.Voltmeter)
+            CS=self.BreakoutBoxConnections.getInstrumentfromDeviceName(MeasurementConnection.CurrentSource)
+            if isinstance(VM.InstrumentObject,Empty):
+                return None
+        while True:
+            if self.PulseDelta:
+                Range=float(MeasurementConnection.VoltRange)
+                with self.Clock.phase('Acquire'):
+                    stats=CS.InstrumentObject.PulseDeltaMeasurement(amp=MeasurementConnection.CurrentAmplitude, count=self.AutoBurstPoints,
+                                                                    interval=self.PDInterval, width=self.PDWidth, sourcedelay=self.PDSourceDelay,
+                                                                    range=Range, full_output=True)[2]
+                readings,dt=stats['readings'],self.PDInterval/60
+            elif self.HardwareDelta:
+                Range=float(MeasurementConnection.VoltRange)
+                with self.Clock.phase('Acquire'):
+                    stats=CS.InstrumentObject.DeltaMeasurement(amp=MeasurementConnection.CurrentAmplitude, count=self.AutoBurstPoints,
+                                                               delay=self.DeltaDelay, nplc=self.DeltaNPLC, range=Range, full_output=True)[2]
+                readings,dt=stats['readings'],self.DeltaDelay+self.DeltaNPLC/60
+            else:
+                Range=MeasurementConnection.DCVoltRange
+                if Range is not None:
+                    VM.InstrumentObject.setRange(Range)
+                if not self.CCFlag:
+                    self.ApplyCurrent(CS,CurrentAmplitude=MeasurementConnection.CurrentAmplitude, Verbose=Verbose)
+                with self.Clock.phase('Acquire'):
+                    readings=VM.InstrumentObject.bufferedReadings(count=self.SkipPoints+self.AutoBurstPoints, interval=self.TimePerPoint)
+                self.CurrentOff(CS, Verbose=Verbose)
+                readings,dt=np.asarray(readings, dtype=float)[self.SkipPoints:],self.TimePerPoint
+            # The 2182 returns +-9.9e37 when the reading is out of range
+            if np.max(np.abs(readings)) < 1e30 or (Range is not None and Range >= RANGES_2182[-1]):
+                return readings,dt
+            Range=min([r for r in RANGES_2182 if Range is None or r > Range])
+            if Verbose:
+                print('{} overflows, trying the {} V range'.format(MeasurementConnection.MeasurementName, Range))
+            if self.PulseDelta or self.HardwareDelta:
+                MeasurementConnection.VoltRange=Range
+            else:
+                MeasurementConnection.DCVoltRange=Range
+
+    def AutoConfigureConnection(self, MeasurementConnection, Verbose=False):
+        # Chooses the reading count and 2182 range of an already connected MeasurementConnection from a noise burst
+        # (see setAutoConfigureOptions and UtilsNoise.py), and stores them in MeasurementConnection.AutoSettings.
+        MeasurementConnection.AutoSettings={}
+        Burst=self.NoiseBurst(MeasurementConnection, Verbose=Verbose)
+        if Burst is None:
+            print('Dummy instruments: {} is not auto configured'.format(MeasurementConnection.MeasurementName))
+            return
+        readings,dt=Burst
+        if self.AutoTargetError is None and self.AutoTargetRelativeError is None:
+            raise ValueError('Set TargetError or TargetRelativeError with setAutoConfigureOptions.')
+        Target=0
+        if self.AutoTargetError is not None:
+            Target=max(Target,self.AutoTargetError)
+        if self.AutoTargetRelativeError is not None:
+            Target=max(Target,self.AutoTargetRelativeError*abs(readings.mean()))
+        Range=chooseRange(readings)
+        if self.PulseDelta or self.HardwareDelta:
+            Name='PDCount' if self.PulseDelta else 'DeltaCount'
+            Count,Expected,Reached=averagingCount(readings, Target, maxcount=self.AutoMaxPoints)
+            MeasurementConnection.AutoSettings[Name]=max(Count,2)
+            MeasurementConnection.VoltRange=Range
+        else:
+            Name='NumberofVPoints'
+            # With both polarities the error of their average is 1/sqrt(2) of the error of each polarity
+            PolarityTarget=Target*np.sqrt(2) if self.BiPolar else Target
+            Count,Expected,Reached=averagingCount(readings, PolarityTarget, maxcount=self.AutoMaxPoints)
+            if self.BiPolar:
+                Expected=Expected/np.sqrt(2)
+            MeasurementConnection.AutoSettings[Name]=self.SkipPoints+2*self.DropOutliers+max(Count,2)
+            MeasurementConnection.DCVoltRange=Range
+        Report=noiseSummary(readings, dt)
+        Report.update({'Setting':Name, 'Count':MeasurementConnection.AutoSettings[Name], 'Range':Range, 'Target':Target,
+                       'Expected':Expected, 'Reached':Reached})
+        MeasurementConnection.AutoReport=Report
+        if not Reached:
+            print('{}: the target error of {:.2e} V can not be reached, expect {:.2e} V with {}={}'.format(
+                  MeasurementConnection.MeasurementName, Target, Expected, Name, Report['Count']))
+        if Verbose:
+            print('{}: {}={}, {} V range'.format(MeasurementConnection.MeasurementName, Name, Report['Count'], Range))
+
+    def AutoConfigureConnections(self, Verbose=False):
+        # Auto configures every MeasurementConnection (see setAutoConfigureOptions)
+        for MeasurementConnection in self.MeasurementConnections:
+            self.ConnectSwitchPairs(MeasurementConnection, Verbose=Verbose)
+            self.AutoConfigureConnection(MeasurementConnection, Verbose=Verbose)
+            self.ResetSwitchPairs(MeasurementConnection, Verbose=Verbose)
+
+    def ConnectSwitchPairs(self,Connection, Verbose=False):
+        # Connects the SwitchPairs of a MeasurementConnection or PulseConnection, if it has any
+        if hasattr(Connection,'SwitchPairs') and self.MinimalSwitching:
+            self.RouteSwitch(Connection.SwitchPairs, Verbose=Verbose)
+        elif hasattr(Connection,'SwitchPairs'):
+            self.SourcesOffForSwitching(Verbose=Verbose)
+            with self.Clock.phase('Switching'):
+                for SwitchPair in Connection.SwitchPairs:
+                    # Check if the Switch is a dummy first
+                    if not isinstance(self.BreakoutBoxConnections.Switch,Empty):
+                        self.BreakoutBoxConnections.Switch.sendCommand('on {}'.format(SwitchPair))
+                    if Verbose:
+                        print('Connected {} corresponding to {} on the SwitchBox.'.format(Connection.SwitchPairtoSwitchConnectiondict[SwitchPair],SwitchPair))
+                    self.Clock.sleep(self.WaitAfterSwitch, 'WaitAfterSwitch')
+
+    def ResetSwitchPairs(self,Connection, Verbose=False):
+        # Resets the switch after a MeasurementConnection or PulseConnection, if it has SwitchPairs
+        # With MinimalSwitching the connection stays until the next route replaces it
+        if hasattr(Connection,'SwitchPairs') and not self.MinimalSwitching:
+            self.SourcesOffForSwitching(Verbose=Verbose)
+            if not isinstance(self.BreakoutBoxConnections.Switch,Empty):
+                with self.Clock.phase('Switching'):
+                    self.BreakoutBoxConnections.Switch.sendCommand('reset')
+            if Verbose:
+                print('Reset the switch')
+
+    def RouteSwitch(self,SwitchPairs, Verbose=False):
+        # Connects exactly SwitchPairs, switching only the relays that differ from the current route, in one burst
+        # followed by one WaitAfterSwitch. The 2400 outputs are turned off first if anything changes.
+        SS=self.BreakoutBoxConnections.SwitchState
+        if len(SS.changes(SwitchPairs)) == 0:
+            return
+        self.SourcesOffForSwitching(Verbose=Verbose)
+        with self.Clock.phase('Switching'):
+            Commands=SS.route(SwitchPairs)
+            if Verbose:
+                print('Switch: {}'.format(', '.join(Commands)))
+            self.Clock.sleep(self.WaitAfterSwitch, 'WaitAfterSwitch')
+
+    def ResetSwitch(self):
+        # Disconnects everything on the switch, if there is one
+        if hasattr(self.BreakoutBoxConnections,'Switch'):
+            if not isinstance(self.BreakoutBoxConnections.Switch,Empty):
+                self.BreakoutBoxConnections.Switch.sendCommand('reset')
+            else:
+                print('Dummy Switch reset')
+            self.BreakoutBoxConnections.SwitchState.Connected=set()
+
+    def EndRun(self, Verbose=False):
+        # End of a run, also when it stops on an error or an interrupt (every Run method calls it in a finally block):
+        # turns off the current sources (see SourcesOff), with MinimalSwitching disconnects the last route,
+        # stops the PPMS telemetry sampler (StartDataRecording starts it again) and saves and closes the live plots
+        self.SourcesOff(Verbose=Verbose)
+        if self.Telemetry is not None:
+            self.Telemetry.stop()
+            self.Telemetry.setFile(None)
+        if self.MinimalSwitching:
+            with self.Clock.phase('Switching'):
+                self.ResetSwitch()
+        if self.LivePlot is not None:
+            self.SavePlots()
+            self.LivePlot.close()
+            self.LivePlot=None
+
+    def MeasurementOrder(self):
+        # Names of the MeasurementConnections in the order they are measured. With ReorderConnections (and MinimalSwitching),
+        # each next connection is the one whose route needs the fewest relay changes from the route before it.
+        self.ListMeasurementNames()
+        if not (self.MinimalSwitching and self.ReorderConnections):
+            return self.MeasurementNames
+        Connected=self.BreakoutBoxConnections.SwitchState.Connected
+        Remaining=list(self.MeasurementNames)
+        Order=[]
+        while len(Remaining) > 0:
+            def toggles(Name):
+                Pairs=getattr(self.MeasurementNamedict[Name],'SwitchPairs',None)
+                if Pairs is None:
+                    return 0
+                if Connected is None:
+                    return len(Pairs)+1
+                return len(Connected.symmetric_difference(Pairs))
+            Next=min(Remaining, key=toggles)
+            Remaining.remove(Next)
+            Order.append(Next)
+            if hasattr(self.MeasurementNamedict[Next],'SwitchPairs'):
+                Connected=set(self.MeasurementNamedict[Next].SwitchPairs)
+        return Order
+
+    def QuickResistance(self,MeasurementConnection, Verbose=False):
+        # Fast resistance reading of an already connected MeasurementConnection, used for thermal settling.
+        # Uses a pulse delta or hardware delta run with SettlePDCount readings, or a DC run with SettleVPoints points per polarity.
+        Saved=(self.PDCount,self.DeltaCount,self.NumberofVPoints,self.SkipPoints,self.DropOutliers)
+        try:
+            self.PDCount=self.SettlePDCount
+            self.DeltaCount=self.SettlePDCount
+            self.NumberofVPoints=self.SettleVPoints
+            self.SkipPoints=min(self.SkipPoints,self.SettleVPoints//3)
+            self.DropOutliers=1
+            average_v,std_v=self.MeasureVoltage(MeasurementConnection, Verbose=Verbose, Adaptive=False)
+        finally:
+            self.PDCount,self.DeltaCount,self.NumberofVPoints,self.SkipPoints,self.DropOutliers=Saved
+        return average_v/MeasurementConnection.CurrentAmplitude
+
+    def ThermalSettle(self, Verbose=False):
+        # Takes quick resistance readings on the SettleMeasurement connection every SettleInterval seconds until the drift
+        # |dR/dt|/R, fitted over the last SettleReadings readings, is below SettleDrift (per minute), or SettleTimeout passes.
+        # The readings are kept in self.SettleLog as (seconds since start, resistance), and the time taken in self.SettleTime.
+        self.ListMeasurementNames()
+        MeasurementConnection=self.MeasurementNamedict[self.SettleMeasurement]
+        self.ConnectSwitchPairs(MeasurementConnection, Verbose=Verbose)
+        Start=self.Clock.time()
+        self.SettleLog=[]
+        Drift=float('inf')
+        with self.Clock.phase('Settle'):
+            while True:
+                self.SettleLog.append((self.Clock.time()-Start, self.QuickResistance(MeasurementConnection, Verbose=Verbose)))
+                if len(self.SettleLog) >= self.SettleReadings:
+                    Times, Resistances=np.array(self.SettleLog[-self.SettleReadings:]).T
+                    Slope=np.polyfit(Times, Resistances, 1)[0]
+                    Drift=abs(Slope)*60/abs(Resistances.mean())
+                    if Verbose:
+                        print('Resistance drift {:.2e}/min (threshold {:.2e}/min)'.format(Drift, self.SettleDrift))
+                    if Drift < self.SettleDrift:
+                        break
+                if self.Clock.time()-Start >= self.SettleTimeout:
+                    print('Thermal settling timed out after {:.0f} s with a drift of {:.2e}/min'.format(self.Clock.time()-Start, Drift))
+                    break
+                self.Clock.sleep(self.SettleInterval, 'ThermalSettle')
+        self.SettleTime=self.Clock.time()-Start
+        if Verbose:
+            print('Settled in {:.0f} s'.format(self.SettleTime))
+        self.ResetSwitchPairs(MeasurementConnection, Verbose=Verbose)
+        return self.SettleTime
+
+    def InitialSettle(self, Verbose=False):
+        # Waits before the scan starts: InitialWaitTime, or until the resistance stops drifting if a SettleMeasurement is set
+        if self.SettleMeasurement is not None:
+            return self.ThermalSettle(Verbose=Verbose)
+        with self.Clock.phase('Settle'):
+            self.Clock.sleep(self.InitialWaitTime, 'InitialWaitTime')
+        return self.InitialWaitTime
+
     def ConnectanddoVoltageMeasurement(self,ConnectionMeasurementName, Verbose=False):
         # Measures the resistance of a given connection and stores it. If switch ports are provided,does switch connection first.
         # First get the MeasurementConnection object from the name
@@ -614,27 +1278,11 @@ class MeasurementSettings:
         if Verbose:
             print('Performing Measurement {}...'.format(ConnectionMeasurementName))
         # If SwitchPairs is defined for the MeasurementConnection, then get first connect those 
-        if hasattr(MeasurementConnection,'SwitchPairs'):
-            for SwitchPair in MeasurementConnection.SwitchPairs:
-                # Check if the Switch is a dummy first
-                if not isinstance(self.BreakoutBoxConnections.Switch,Empty):
-                    self.BreakoutBoxConnections.Switch.sendCommand('on {}'.format(SwitchPair))
-                if Verbose:
-                    print('Connected {} corresponding to {} on the SwitchBox.'.format(MeasurementConnection.SwitchPairtoSwitchConnectiondict[SwitchPair],SwitchPair))
-                time.sleep(self.WaitAfterSwitch)
+        self.ConnectSwitchPairs(MeasurementConnection, Verbose=Verbose)
         # Measure the resistance
-        if self.PulseDelta:
-            average_v,std_v=self.MeasureVoltagePulseDelta(CurrentSource=MeasurementConnection.CurrentSource, 
-                                                CurrentAmplitude=MeasurementConnection.CurrentAmplitude, VoltRange=MeasurementConnection.VoltRange)
-        else:
-            average_v,std_v=self.MeasureVoltageDC(Voltmeter=MeasurementConnection.Voltmeter,CurrentSource=MeasurementConnection.CurrentSource, 
-                                                CurrentAmplitude=MeasurementConnection.CurrentAmplitude, Verbose=Verbose)
+        average_v,std_v=self.MeasureVoltage(MeasurementConnection, Verbose=Verbose)
         # Resest the switch again if SwitchPairs is provided
-        if hasattr(MeasurementConnection,'SwitchPairs'):
-            if not isinstance(self.BreakoutBoxConnections.Switch,Empty):
-                self.BreakoutBoxConnections.Switch.sendCommand('reset')
-            if Verbose:
-                print('Reset the switch')
+        self.ResetSwitchPairs(MeasurementConnection, Verbose=Verbose)
         
         # returns back the DC measurement current amplitude, average voltage, and standard deviation
         return MeasurementConnection.CurrentAmplitude,average_v, std_v
@@ -650,30 +1298,22 @@ class MeasurementSettings:
         if Verbose:
             print('Performing Pulse {}...'.format(PulseName))
         # If SwitchPairs is defined for the PulseConnection, then get first connect those 
-        if hasattr(PulseConnection,'SwitchPairs'):
-            for SwitchPair in PulseConnection.SwitchPairs:
-                # Check if the Switch is a dummy first
-                if not isinstance(self.BreakoutBoxConnections.Switch,Empty):
-                    self.BreakoutBoxConnections.Switch.sendCommand('on {}'.format(SwitchPair))
-                if Verbose:
-                    print('Connected {} corresponding to {} on the SwitchBox.'.format(PulseConnection.SwitchPairtoSwitchConnectiondict[SwitchPair],SwitchPair))
-                time.sleep(self.WaitAfterSwitch)
+        self.ConnectSwitchPairs(PulseConnection, Verbose=Verbose)
         # Send the pulse
         if SwitchPolarity:
             PulseAmplitude=-PulseConnection.PulseAmplitude
         else:
             PulseAmplitude=PulseConnection.PulseAmplitude
-        if not isinstance(PS.InstrumentObject,Empty):
-            PS.InstrumentObject.pulseOut(amp=PulseAmplitude, duration=PulseConnection.PulseWidth, wait_after_arm=self.WaitTimeAfterPulseArm)
-        if Verbose:
-            print('Sending {:.2f} mA pulse'.format(PulseAmplitude*1e3))
-        time.sleep(self.WaitAfterPulse)
-        # Resest the switch again if SwitchPairs is provided
-        if hasattr(PulseConnection,'SwitchPairs'):
-            if not isinstance(self.BreakoutBoxConnections.Switch,Empty):
-                self.BreakoutBoxConnections.Switch.sendCommand('reset')
+        # The 2400 outputs must be off during the pulse (ConnectSwitchPairs only turns them off when the switch changes)
+        self.SourcesOffForSwitching(Verbose=Verbose)
+        with self.Clock.phase('Pulse'):
+            if not isinstance(PS.InstrumentObject,Empty):
+                PS.InstrumentObject.pulseOut(amp=PulseAmplitude, duration=PulseConnection.PulseWidth, wait_after_arm=self.WaitTimeAfterPulseArm)
             if Verbose:
-                print('Reset the switch')
+                print('Sending {:.2f} mA pulse'.format(PulseAmplitude*1e3))
+            self.Clock.sleep(self.WaitAfterPulse, 'WaitAfterPulse')
+        # Resest the switch again if SwitchPairs is provided
+        self.ResetSwitchPairs(PulseConnection, Verbose=Verbose)
 
     def PulseAmplitudeSeriesTest(self,PulseAmplitudes,PulseNames,InitializeField,Angle,Verbose=False):
         # Performs a series of increasing amplitude pulses with the connection given by PulseName. 
@@ -681,78 +1321,56 @@ class MeasurementSettings:
         self.MagneticField=InitializeField
         self.Angle=Angle
         self.MeasurementType='RvsPulseAmp'
-        #Reset Switch conenctions, if any
-        if hasattr(self.BreakoutBoxConnections,'Switch'):
-            if not isinstance(self.BreakoutBoxConnections.Switch,Empty):
-                self.BreakoutBoxConnections.Switch.sendCommand('reset')
-            else:
-                print('Dummy Switch reset')
-        if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-            # set the temperature. Only one temperature is allowed.
-            self.BreakoutBoxConnections.PPMS.setTemperature(self.Temperature)
-        # Go to the saturation field
-        if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-            self.BreakoutBoxConnections.PPMS.setField(self.MagneticField)
-        if Verbose:
-            print('rotating to angle {:.1f} degrees...'.format(self.Angle))
-        if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-            self.BreakoutBoxConnections.PPMS.setPosition(self.Angle)
-
-        if self.WaitForSetpoints:
-            #Wait for them to be reached
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty): 
-                self.BreakoutBoxConnections.PPMS.waitForTemperature()
-                self.BreakoutBoxConnections.PPMS.waitForField()
-                self.BreakoutBoxConnections.PPMS.waitForPosition()
-            else:
-                print('Dummy wait 2s...')
-                time.sleep(2)
+        try:
+            #Reset Switch conenctions, if any
+            self.ResetSwitch()
             if Verbose:
-                print('Waiting for setpoints...')
+                print('rotating to angle {:.1f} degrees...'.format(self.Angle))
+            # Go to the temperature (only one is allowed), the saturation field and the angle together
+            self.goToSetpoints(Temperature=self.Temperature, MagneticField=self.MagneticField, Angle=self.Angle, Verbose=Verbose)
         
-        if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-            self.BreakoutBoxConnections.PPMS.setField(0)
+            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
+                self.BreakoutBoxConnections.PPMS.setField(0)
             
-        if self.WaitForSetpoints:
-            #Wait for them to be reached
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty): 
-                self.BreakoutBoxConnections.PPMS.waitForField()
-            else:
-                print('Dummy wait 2s...')
-                time.sleep(2)
-            if Verbose:
-                print('Waiting for setpoints...')
+            if self.WaitForSetpoints:
+                #Wait for them to be reached
+                if not isinstance(self.BreakoutBoxConnections.PPMS,Empty): 
+                    self.BreakoutBoxConnections.PPMS.waitForField()
+                else:
+                    print('Dummy wait 2s...')
+                    self.Clock.sleep(2, 'DummyWait')
+                if Verbose:
+                    print('Waiting for setpoints...')
 
-        time.sleep(self.InitialWaitTime)
+            self.InitialSettle(Verbose=Verbose)
 
-        # Start recording the datafile
-        self.StartDataRecording()
+            # Start recording the datafile
+            self.StartDataRecording()
         
-        # First get the PulseConnection object from the name
-        self.ListPulseNames()
+            # First get the PulseConnection object from the name
+            self.ListPulseNames()
         
-        for PulseAmplitude in PulseAmplitudes:
-            for PulseName in PulseNames:
-                PulseConnection=self.PulseNamedict[PulseName]
-                # And get the Pulser object from the pulser name
-                PS=self.BreakoutBoxConnections.getInstrumentfromDeviceName(PulseConnection.Pulser)
-                # If SwitchPairs is defined for the PulseConnection, then get first connect those 
-                if hasattr(PulseConnection,'SwitchPairs'):
-                    for SwitchPair in PulseConnection.SwitchPairs:
-                        # Check if the Switch is a dummy first
-                        if not isinstance(self.BreakoutBoxConnections.Switch,Empty):
-                            self.BreakoutBoxConnections.Switch.sendCommand('on {}'.format(SwitchPair))
+            for PulseAmplitude in PulseAmplitudes:
+                for PulseName in PulseNames:
+                    PulseConnection=self.PulseNamedict[PulseName]
+                    # And get the Pulser object from the pulser name
+                    PS=self.BreakoutBoxConnections.getInstrumentfromDeviceName(PulseConnection.Pulser)
+                    # If SwitchPairs is defined for the PulseConnection, then get first connect those 
+                    self.ConnectSwitchPairs(PulseConnection, Verbose=Verbose)
+                    self.SourcesOffForSwitching(Verbose=Verbose)
+                    with self.Clock.phase('Pulse'):
+                        if not isinstance(PS.InstrumentObject,Empty):
+                            PS.InstrumentObject.pulseOut(amp=PulseAmplitude, duration=PulseConnection.PulseWidth, wait_after_arm=self.WaitTimeAfterPulseArm)
                         if Verbose:
-                            print('Connected {} corresponding to {} on the SwitchBox.'.format(PulseConnection.SwitchPairtoSwitchConnectiondict[SwitchPair],SwitchPair))
-                        time.sleep(self.WaitAfterSwitch)
-                if not isinstance(PS.InstrumentObject,Empty):
-                    PS.InstrumentObject.pulseOut(amp=PulseAmplitude, duration=PulseConnection.PulseWidth, wait_after_arm=self.WaitTimeAfterPulseArm)
-                if Verbose:
-                    print('Sending {:.2f} mA pulse'.format(PulseConnection.PulseAmplitude*1e3))
-                time.sleep(self.WaitAfterPulse)
-                self.BreakoutBoxConnections.Switch.sendCommand('reset')
-                time.sleep(self.WaitAfterPulse)
-            self.doMeasurementsandRecordData(Verbose=Verbose,PlotData=True,PulseChannel='{}>{:.5f}'.format('_'.join(PulseNames),PulseAmplitude))
+                            print('Sending {:.2f} mA pulse'.format(PulseConnection.PulseAmplitude*1e3))
+                        self.Clock.sleep(self.WaitAfterPulse, 'WaitAfterPulse')
+                    with self.Clock.phase('Switching'):
+                        if not self.MinimalSwitching:
+                            self.ResetSwitch()
+                        self.Clock.sleep(self.WaitAfterPulse, 'WaitAfterPulse')
+                self.doMeasurementsandRecordData(Verbose=Verbose,PulseChannel='{}>{:.5f}'.format('_'.join(PulseNames),PulseAmplitude))
+        finally:
+            self.EndRun(Verbose=Verbose)
 
     def SendAllPulses(self, Verbose=False, SwitchPolarity=False):
         # Does the previously set measurements and records the data to the datafile
@@ -800,8 +1418,10 @@ class MeasurementSettings:
         return self.MeasurementType
     
 
-    def setMeasurementParams(self,Angle=-999,MagneticField=100,Temperature=300,WaitForSetpoints=True,InitialWaitTime=0,WaitAfterSwitch=0.3):
+    def setMeasurementParams(self,Angle=-999,MagneticField=100,Temperature=300,WaitForSetpoints=True,InitialWaitTime=0,WaitAfterSwitch=0.3,PlotData=True):
         # Sets up general measurement parameters, and gets the measurement type from them
+        # PlotData=False skips the plot update after every data point (e.g. for fast simulated dry runs)
+        self.PlotData=PlotData
         self.Angle=Angle
         self.MagneticField=MagneticField
         self.Temperature=Temperature
@@ -812,18 +1432,38 @@ class MeasurementSettings:
 
     def getPPMSCurrentParams(self):
         # Gets the PPMS current attributes and stores them and returns them
-        if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-            self.PPMSCurrentAngle=self.BreakoutBoxConnections.PPMS.getPosition()
-            self.PPMSCurrentTemperature=self.BreakoutBoxConnections.PPMS.getTemperature()
-            self.PPMSCurrentMagneticField=self.BreakoutBoxConnections.PPMS.getField()
+        if self.Telemetry is not None:
+            # latest sample of the background sampler, no round trips
+            self.PPMSCurrentAngle,self.PPMSCurrentTemperature,self.PPMSCurrentMagneticField=[self.Telemetry.latest()[i] for i in (5,1,3)]
+        elif not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
+            with self.Clock.phase('PPMSRead'):
+                self.PPMSCurrentAngle=self.BreakoutBoxConnections.PPMS.getPosition()
+                self.PPMSCurrentTemperature=self.BreakoutBoxConnections.PPMS.getTemperature()
+                self.PPMSCurrentMagneticField=self.BreakoutBoxConnections.PPMS.getField()
         else:
             self.PPMSCurrentAngle=-999
             self.PPMSCurrentTemperature=-999
             self.PPMSCurrentMagneticField=-999
         return self.PPMSCurrentAngle, self.PPMSCurrentTemperature, self.PPMSCurrentMagneticField
+
+    def goToSetpoints(self, Temperature=None, MagneticField=None, Angle=None, Verbose=False):
+        # Starts the temperature, field and rotator changes together and, if WaitForSetpoints is set, waits once until
+        # all of them are reached. Setpoints given as None are left alone; an Angle of -999 means no rotator.
+        if Angle == -999:
+            Angle=None
+        if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
+            Flags=self.BreakoutBoxConnections.PPMS.setSetpoints(temperature=Temperature, field=MagneticField, position=Angle)
+        if self.WaitForSetpoints:
+            if Verbose:
+                print('Waiting for setpoints...')
+            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
+                self.BreakoutBoxConnections.PPMS.waitForSetpoints(*Flags)
+            else:
+                print('Dummy wait 2s...')
+                self.Clock.sleep(2, 'DummyWait')
     
-    def StartDataRecording(self):
-        # Starts recording data by writing the header and column names.
+    def StartDataRecording(self, ExtraColumnNames=[]):
+        # Starts recording data by writing the header and column names. ExtraColumnNames are added after the data columns.
         # returns the filename but also stores it in self.Filename.
         name = self.SaveFolder+self.SampleID+"/{}_{}".format(time.strftime("%m%d_%H%M", time.localtime()),self.MeasurementID)
         self.FileName = name+".csv"
@@ -831,40 +1471,83 @@ class MeasurementSettings:
             os.mkdir(self.SaveFolder+self.SampleID)
         except OSError:
             pass
+        if self.AutoConfigure:
+            # The chosen settings are part of the header
+            self.AutoConfigureConnections()
     
         with open(self.FileName, 'a') as f:
             #Write down the settings header for the connections and the measurement
             f.write(self.BreakoutBoxConnections.getSettingsString())
             f.write(self.getSettingsString())
             self.ListMeasurementNames()
+            # The number of readings is only recorded when it can change from row to row
+            self.RecordPoints=any(MC.TargetError is not None or MC.TargetRelativeError is not None for MC in self.MeasurementConnections)
             self.DataColumnNames=[]
             for MeasurementName in self.MeasurementNames:
                 self.DataColumnNames.append(MeasurementName+'_DC_Current(A)')
                 self.DataColumnNames.append(MeasurementName+'_Average_V')
                 self.DataColumnNames.append(MeasurementName+'_Std_V')
-            f.write("Angle(deg),Temp(K),Field(Oe),PulseChannel,{}\n".format(','.join(self.DataColumnNames)))
+                if self.RecordPoints:
+                    self.DataColumnNames.append(MeasurementName+'_Points')
+            f.write("Angle(deg),Temp(K),Field(Oe),PulseChannel,{}\n".format(','.join(self.DataColumnNames+list(ExtraColumnNames))))
+        self.DataLineCount=0
+        # The live plot of this file is made with its first plotted row
+        if self.LivePlot is not None:
+            self.LivePlot.close()
+        self.LivePlot=None
+        self.ColumnNames=['Angle(deg)','Temp(K)','Field(Oe)','PulseChannel']+self.DataColumnNames+list(ExtraColumnNames)
+        if self.Telemetry is not None:
+            # PPMS samples of this measurement go to a telemetry file next to the data file
+            self.Telemetry.setFile(name+"_telemetry.csv")
+            if not self.Telemetry.running():
+                self.Telemetry.start()
 
         return self.FileName
     
     def RecordDataLine(self,DataLine,PlotData=True):
-        # Records a given string to the datafile. Optionally plots the datafile
-        with open(self.FileName, 'a') as f:
-            f.write(DataLine)
+        # Records a given string to the datafile. Optionally adds it to the live plot of the datafile (see LivePlotSMR,
+        # or LivePlotProcess with PlotWorker)
+        with self.Clock.phase('FileWrite'):
+            with open(self.FileName, 'a') as f:
+                f.write(DataLine)
+            self.DataLineCount+=1
         if PlotData:
-            display.clear_output(wait=True)
-            PlotSMR(FileName=self.FileName)
-            plt.show()
+            with self.Clock.phase('Plotting'):
+                if self.LivePlot is None and self.PlotWorker:
+                    self.LivePlot=LivePlotProcess(self.FileName, self.MeasurementNames, self.MeasurementType, self.ColumnNames,
+                                                  MaxRefreshRate=self.MaxRefreshRate, Backend=self.PlotBackend)
+                elif self.LivePlot is None:
+                    self.LivePlot=LivePlotSMR(self.FileName, self.MeasurementNames, self.MeasurementType, self.ColumnNames)
+                self.LivePlot.append(DataLine)
+                self.LivePlot.show()
+
+    def SavePlots(self, dpi=600):
+        # Saves the live plots of the current data file as PNGs next to it (done by itself at the end of a run)
+        if self.LivePlot is not None:
+            with self.Clock.phase('Plotting'):
+                self.LivePlot.save(dpi=dpi)
     
-    def doMeasurementsandRecordData(self, PlotData=True, Verbose=False, PulseChannel=''):
+    def doMeasurementsandRecordData(self, PlotData=None, Verbose=False, PulseChannel=''):
         # Does the previously set measurements and records the data to the datafile
+        # PlotData defaults to the setting given in setMeasurementParams
+        if PlotData is None:
+            PlotData=getattr(self,'PlotData',True)
         self.getPPMSCurrentParams()
+        WindowStart=self.Clock.time()
         vlist=[]
-        self.ListMeasurementNames()
+        Results={}
+        for MeasurementName in self.MeasurementOrder():
+            Results[MeasurementName]=self.ConnectanddoVoltageMeasurement(MeasurementName, Verbose=Verbose)
         for MeasurementName in self.MeasurementNames:
-            dc_current_amplitude,average_v,std_v=self.ConnectanddoVoltageMeasurement(MeasurementName, Verbose=Verbose)
+            dc_current_amplitude,average_v,std_v=Results[MeasurementName]
             vlist.append(dc_current_amplitude)
             vlist.append(average_v)
             vlist.append(std_v)
+            if self.RecordPoints:
+                vlist.append(self.MeasurementNamedict[MeasurementName].LastPoints)
+        if self.Telemetry is not None and self.TelemetryAverage:
+            # PPMS values averaged over the time the connections were measured
+            self.PPMSCurrentAngle,self.PPMSCurrentTemperature,self.PPMSCurrentMagneticField=self.Telemetry.average(WindowStart,self.Clock.time())
         self.RecordDataLine('{},{},{},{},{}\n'.format(self.PPMSCurrentAngle,self.PPMSCurrentTemperature,self.PPMSCurrentMagneticField,
                                                     PulseChannel,','.join(str(x) for x in vlist)),PlotData=PlotData)
             
@@ -911,43 +1594,34 @@ class MeasurementSettings:
             # and update the measurement type
             self.DetermineMeasurementType(Verbose=Verbose)
         
-        #Reset Switch conenctions, if any
-        if hasattr(self.BreakoutBoxConnections,'Switch'):
-            if not isinstance(self.BreakoutBoxConnections.Switch,Empty):
-                self.BreakoutBoxConnections.Switch.sendCommand('reset')
-            else:
-                print('Dummy Switch reset')
+        try:
+            #Reset Switch conenctions, if any
+            self.ResetSwitch()
             
-        if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-            # set the field. Only one field is allowed.
-            self.BreakoutBoxConnections.PPMS.setField(self.MagneticField)
-            # set the angle if it is defined. Only one angle is allowed.
-            if self.Angle != -999:
-                self.BreakoutBoxConnections.PPMS.setPosition(self.Angle)
-                if self.WaitForSetpoints:
-                    self.BreakoutBoxConnections.PPMS.waitForPosition()
-        
-        if self.WaitForSetpoints:
-            #Wait for them to be reached
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty): 
-                self.BreakoutBoxConnections.PPMS.waitForField()
-            else:
-                print('Dummy wait 2s...')
-                time.sleep(2)
-            if Verbose:
-                print('Waiting for setpoints...')
-        time.sleep(self.InitialWaitTime)
+            # set the field (only one is allowed), the angle if it is defined (only one is allowed) and the first temperature together
+            self.goToSetpoints(Temperature=self.Temperature[0], MagneticField=self.MagneticField, Angle=self.Angle, Verbose=Verbose)
+            self.InitialSettle(Verbose=Verbose)
 
-        # Start recording the datafile
-        self.StartDataRecording()
-        
-        for temp in self.Temperature:
-            if Verbose:
-                print('ramping Temperature to {:.1f} K...'.format(temp))
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-                self.BreakoutBoxConnections.PPMS.setTemperature(temp)
-                self.BreakoutBoxConnections.PPMS.waitForTemperature()
-            self.doMeasurementsandRecordData(Verbose=Verbose)
+            if self.Sweep:
+                self.RunSweep('Temperature', Verbose=Verbose)
+            else:
+                # Start recording the datafile
+                self.StartDataRecording()
+
+                for i,temp in enumerate(self.Temperature):
+                    if Verbose:
+                        print('ramping Temperature to {:.1f} K...'.format(temp))
+                    if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
+                        self.BreakoutBoxConnections.PPMS.setTemperature(temp)
+                        self.BreakoutBoxConnections.PPMS.waitForTemperature()
+                    if self.SettleMeasurement is not None and i > 0:
+                        # the first temperature already settled at the start
+                        self.ThermalSettle(Verbose=Verbose)
+                    self.doMeasurementsandRecordData(Verbose=Verbose)
+        finally:
+            self.EndRun(Verbose=Verbose)
+        if self.Sweep:
+            return self.FinishSweep('Temperature')
 
     def RunRvsHMeasurement(self, RvsHsetAngle=-999, RvsHsetMagneticFields=-999, RvsHsetTemperature=-999, Verbose=False):
         # Runs an R vs H measurement. Measurement parameters can either be set previously with the setMeasurementParams function, or 
@@ -975,45 +1649,157 @@ class MeasurementSettings:
             # and update the measurement type
             self.DetermineMeasurementType(Verbose=Verbose)
         
-        #Reset Switch conenctions, if any
-        if hasattr(self.BreakoutBoxConnections,'Switch'):
-            if not isinstance(self.BreakoutBoxConnections.Switch,Empty):
-                self.BreakoutBoxConnections.Switch.sendCommand('reset')
-            else:
-                print('Dummy Switch reset')
+        try:
+            #Reset Switch conenctions, if any
+            self.ResetSwitch()
             
-        if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-            # set the temperature. Only one temperature is allowed.
-            self.BreakoutBoxConnections.PPMS.setTemperature(self.Temperature)
-            # set the angle if it is defined. Only one angle is allowed.
-            if self.Angle != -999:
-                self.BreakoutBoxConnections.PPMS.setPosition(self.Angle)
-                if self.WaitForSetpoints:
-                    self.BreakoutBoxConnections.PPMS.waitForPosition()
+            # set the temperature (only one is allowed), the angle if it is defined (only one is allowed) and the first field together
+            self.goToSetpoints(Temperature=self.Temperature, MagneticField=self.MagneticField[0], Angle=self.Angle, Verbose=Verbose)
+            self.InitialSettle(Verbose=Verbose)
+
+            if self.Sweep:
+                self.RunSweep('Field', Verbose=Verbose)
+            else:
+                # Start recording the datafile
+                self.StartDataRecording()
+
+                for field in self.MagneticField:
+                    if Verbose:
+                        print('ramping field to {:.1f} Oe...'.format(field))
+                    if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
+                        self.BreakoutBoxConnections.PPMS.setField(field)
+                        self.BreakoutBoxConnections.PPMS.waitForField()
+                    self.doMeasurementsandRecordData(Verbose=Verbose)
+        finally:
+            self.EndRun(Verbose=Verbose)
+        if self.Sweep:
+            return self.FinishSweep('Field')
         
-        if self.WaitForSetpoints:
-            #Wait for them to be reached
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty): 
-                self.BreakoutBoxConnections.PPMS.waitForTemperature()
-                self.BreakoutBoxConnections.PPMS.waitForField()
+    def readSweptValue(self, Axis):
+        # Reads the temperature or field that is being swept (-999 with a dummy PPMS, like getPPMSCurrentParams)
+        if isinstance(self.BreakoutBoxConnections.PPMS,Empty):
+            return -999
+        if Axis == 'Temperature':
+            return self.BreakoutBoxConnections.PPMS.getTemperature()
+        return self.BreakoutBoxConnections.PPMS.getField()
+
+    def doSweepMeasurementandRecordData(self, Axis, StartTime, Direction, PlotData=None, Verbose=False):
+        # Measures every connection once while the PPMS ramps, and records the row with the swept value interpolated
+        # at the middle of the measurement, and the start/end times (s since StartTime)
+        if PlotData is None:
+            PlotData=getattr(self,'PlotData',True)
+        self.getPPMSCurrentParams()
+        # The swept value is read from the PPMS itself, not from a telemetry sample taken some time before
+        RowStart=self.Clock.time()
+        with self.Clock.phase('PPMSRead'):
+            ValueStart=self.readSweptValue(Axis)
+        vlist=[]
+        Results={}
+        for MeasurementName in self.MeasurementOrder():
+            Results[MeasurementName]=self.ConnectanddoVoltageMeasurement(MeasurementName, Verbose=Verbose)
+        for MeasurementName in self.MeasurementNames:
+            dc_current_amplitude,average_v,std_v=Results[MeasurementName]
+            vlist.append(dc_current_amplitude)
+            vlist.append(average_v)
+            vlist.append(std_v)
+            if self.RecordPoints:
+                vlist.append(self.MeasurementNamedict[MeasurementName].LastPoints)
+        RowEnd=self.Clock.time()
+        with self.Clock.phase('PPMSRead'):
+            ValueEnd=self.readSweptValue(Axis)
+        # The ramp is linear, so the value at the middle of the measurement is the mean of the start and end values
+        Value=(ValueStart+ValueEnd)/2
+        if Axis == 'Temperature':
+            self.PPMSCurrentTemperature=Value
+        else:
+            self.PPMSCurrentMagneticField=Value
+        self.RecordDataLine('{},{},{},,{},{},{},{}\n'.format(self.PPMSCurrentAngle,self.PPMSCurrentTemperature,self.PPMSCurrentMagneticField,
+                                                           ','.join(str(x) for x in vlist),RowStart-StartTime,RowEnd-StartTime,Direction),PlotData=PlotData)
+        return ValueEnd
+
+    def RunSweep(self, Axis, Verbose=False):
+        # Continuous sweep of the temperature or field (see setSweepOptions). The PPMS should already be at the first value.
+        # Called inside the try of RunRvsTMeasurement/RunRvsHMeasurement, which end the run and then call FinishSweep.
+        if Axis == 'Temperature':
+            Points=self.Temperature
+            Rate=self.SweepTemperatureRate
+            Tolerance=self.SweepTemperatureTolerance
+            Duration=lambda a,b: abs(b-a)/Rate*60
+        else:
+            Points=self.MagneticField
+            Rate=self.SweepFieldRate
+            Tolerance=self.SweepFieldTolerance
+            Duration=lambda a,b: abs(b-a)/Rate
+        Ramps=[(Points[0],Points[-1])]
+        if self.SweepBothDirections:
+            Ramps.append((Points[-1],Points[0]))
+
+        self.StartDataRecording(ExtraColumnNames=['StartTime(s)','EndTime(s)','Sweep'])
+        StartTime=self.Clock.time()
+        for RampStart,RampEnd in Ramps:
+            if Axis == 'Temperature':
+                Direction='warming' if RampEnd > RampStart else 'cooling'
             else:
-                print('Dummy wait 2s...')
-                time.sleep(2)
+                Direction='up' if RampEnd > RampStart else 'down'
             if Verbose:
-                print('Waiting for setpoints...')
-        time.sleep(self.InitialWaitTime)
+                print('sweeping {} from {} to {} ({})...'.format(Axis, RampStart, RampEnd, Direction))
+            if isinstance(self.BreakoutBoxConnections.PPMS,Empty):
+                print('Dummy PPMS: measuring once instead of sweeping')
+                self.doSweepMeasurementandRecordData(Axis, StartTime, Direction, Verbose=Verbose)
+                continue
+            if Axis == 'Temperature':
+                self.BreakoutBoxConnections.PPMS.setTemperature(RampEnd, rate=Rate)
+            else:
+                self.BreakoutBoxConnections.PPMS.setField(RampEnd, rate=Rate)
+            # Give up waiting for the end point well after the ramp should have finished
+            Deadline=self.Clock.time()+1.5*Duration(RampStart,RampEnd)+600
+            while True:
+                Value=self.doSweepMeasurementandRecordData(Axis, StartTime, Direction, Verbose=Verbose)
+                if abs(Value-RampEnd) <= Tolerance:
+                    break
+                if self.Clock.time() > Deadline:
+                    print('{} sweep did not reach {} (now {}). Continuing.'.format(Axis, RampEnd, Value))
+                    break
+
+    def FinishSweep(self, Axis):
+        # After the run of a sweep has ended: bins the data onto the temperature/field list if BinToGrid is set.
+        # Returns the name of the data file.
+        if self.SweepBinToGrid:
+            if isinstance(self.BreakoutBoxConnections.PPMS,Empty):
+                # the rows have no swept value to bin on
+                print('Dummy PPMS: not binning the sweep data')
+            else:
+                self.BinSweepData(self.FileName, Axis, self.Temperature if Axis == 'Temperature' else self.MagneticField)
+        return self.FileName
+
+    def BinSweepData(self, FileName, Axis, Grid):
+        # Averages the rows of a sweep file onto the points of Grid (each bin reaches halfway to its neighbours), separately
+        # for each sweep direction, and writes them with the same header to <FileName>_binned.csv. Returns the new file name.
+        hlength, measnames, MeasType = ReadSMRHeader(FileName)
+        df = ReadSMRData(FileName, hlength)
+        Column='Temp(K)' if Axis == 'Temperature' else 'Field(Oe)'
+        Grid=np.sort(np.array(Grid, dtype=float))
+        Edges=np.concatenate([[-np.inf], (Grid[1:]+Grid[:-1])/2, [np.inf]])
+        df['Bin']=pd.cut(df[Column], Edges, labels=False)
+        Numeric=[c for c in df.columns if c not in ['PulseChannel','Sweep','Bin']]
+        Binned=df.groupby(['Sweep','Bin'], sort=False)[Numeric].mean()
+        Binned['BinCount']=df.groupby(['Sweep','Bin'], sort=False).size()
+        Binned=Binned.reset_index()
+        Binned[Column]=Grid[Binned['Bin'].astype(int)]
+        Binned['PulseChannel']=np.nan
+        Binned=Binned[list(df.columns.drop('Bin'))+['BinCount']]
+        BinnedFileName=FileName[:-4]+'_binned.csv'
+        Header=[]
+        with open(FileName) as f:
+            for line in f:
+                if 'Angle(deg)' in line:
+                    break
+                Header.append(line)
+        with open(BinnedFileName, 'w') as f:
+            f.write(''.join(Header))
+            Binned.to_csv(f, index=False)
+        return BinnedFileName
 
-        # Start recording the datafile
-        self.StartDataRecording()
-        
-        for field in self.MagneticField:
-            if Verbose:
-                print('ramping field to {:.1f} Oe...'.format(field))
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-                self.BreakoutBoxConnections.PPMS.setField(field)
-                self.BreakoutBoxConnections.PPMS.waitForField()
-            self.doMeasurementsandRecordData(Verbose=Verbose)
-        
     def RunRvsAngleMeasurement(self, Angles=-999, RvsAnglesetMagneticField=-999, RvsAnglesetTemperature=-999, Verbose=False):
         # Runs an R vs Angle measurement. Measurement parameters can either be set previously with the setMeasurementParams function, or 
         # when calling this function. If they are given in this function, they will overwrite previously given parameters.
@@ -1038,64 +1824,50 @@ class MeasurementSettings:
             # and update the measurement type
             self.DetermineMeasurementType(Verbose=Verbose)
         
-        #Reset Switch conenctions, if any
-        if hasattr(self.BreakoutBoxConnections,'Switch'):
-            if not isinstance(self.BreakoutBoxConnections.Switch,Empty):
-                self.BreakoutBoxConnections.Switch.sendCommand('reset')
-            else:
-                print('Dummy Switch reset')
+        try:
+            #Reset Switch conenctions, if any
+            self.ResetSwitch()
             
-        if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-            # set the temperature. Only one temperature is allowed.
-            self.BreakoutBoxConnections.PPMS.setTemperature(self.Temperature)
-        # Go to the saturation field (or only field) also
-        if self.MeasurementType == 'RvsAngle_Remnant':
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-                self.BreakoutBoxConnections.PPMS.setField(self.MagneticField[0])
-        elif self.MeasurementType == 'RvsAngle':
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-                self.BreakoutBoxConnections.PPMS.setField(self.MagneticField)
-        else:
-            raise ValueError('Measurement type is not RvsAngle or RvsAngle_Remnant!')
-        if self.WaitForSetpoints:
-            #Wait for them to be reached
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty): 
-                self.BreakoutBoxConnections.PPMS.waitForTemperature()
-                self.BreakoutBoxConnections.PPMS.waitForField()
+            # Go to the saturation field (or only field)
+            if self.MeasurementType == 'RvsAngle_Remnant':
+                Field=self.MagneticField[0]
+            elif self.MeasurementType == 'RvsAngle':
+                Field=self.MagneticField
             else:
-                print('Dummy wait 2s...')
-                time.sleep(2)
-            if Verbose:
-                print('Waiting for setpoints...')
-        time.sleep(self.InitialWaitTime)
+                raise ValueError('Measurement type is not RvsAngle or RvsAngle_Remnant!')
+            # together with the temperature (only one is allowed) and the first angle
+            self.goToSetpoints(Temperature=self.Temperature, MagneticField=Field, Angle=self.Angle[0], Verbose=Verbose)
+            self.InitialSettle(Verbose=Verbose)
 
-        # Start recording the datafile
-        self.StartDataRecording()
+            # Start recording the datafile
+            self.StartDataRecording()
         
-        for angle in self.Angle:
-            if Verbose:
-                print('rotating to angle {:.1f} degrees...'.format(angle))
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-                self.BreakoutBoxConnections.PPMS.setPosition(angle)
-                self.BreakoutBoxConnections.PPMS.waitForPosition()
-            
-            if type(self.MagneticField) != list:
-                MagneticFieldList=[self.MagneticField]
-            else:
-                MagneticFieldList=self.MagneticField
-
-            for MagneticField in MagneticFieldList:
-                # Set the field before each measurement. If the scan is a remnant scan, then wait for it to be reached.
+            for angle in self.Angle:
+                if Verbose:
+                    print('rotating to angle {:.1f} degrees...'.format(angle))
                 if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-                    self.BreakoutBoxConnections.PPMS.setField(MagneticField)
-                    if self.MeasurementType=='RvsAngle_Remnant':
-                        self.BreakoutBoxConnections.PPMS.waitForField()
+                    self.BreakoutBoxConnections.PPMS.setPosition(angle)
+                    self.BreakoutBoxConnections.PPMS.waitForPosition()
+            
+                if type(self.MagneticField) != list:
+                    MagneticFieldList=[self.MagneticField]
                 else:
-                    if self.MeasurementType=='RvsAngle_Remnant':
-                        print('Set Dummy Field to {} Oe and waiting for it'.format(MagneticField))
-                        time.sleep(2)
+                    MagneticFieldList=self.MagneticField
 
-                self.doMeasurementsandRecordData(Verbose=Verbose)
+                for MagneticField in MagneticFieldList:
+                    # Set the field before each measurement. If the scan is a remnant scan, then wait for it to be reached.
+                    if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
+                        self.BreakoutBoxConnections.PPMS.setField(MagneticField)
+                        if self.MeasurementType=='RvsAngle_Remnant':
+                            self.BreakoutBoxConnections.PPMS.waitForField()
+                    else:
+                        if self.MeasurementType=='RvsAngle_Remnant':
+                            print('Set Dummy Field to {} Oe and waiting for it'.format(MagneticField))
+                            self.Clock.sleep(2, 'DummyWait')
+
+                    self.doMeasurementsandRecordData(Verbose=Verbose)
+        finally:
+            self.EndRun(Verbose=Verbose)
 
 
     def RunRvsAngleMeasurementPulse(self, Angles=-999, RvsAnglesetMagneticField=-999, RvsAnglesetTemperature=-999, Verbose=False):
@@ -1124,66 +1896,52 @@ class MeasurementSettings:
     
             self.SaveFolder='./data/PPMS_switch/'
         
-        #Reset Switch conenctions, if any
-        if hasattr(self.BreakoutBoxConnections,'Switch'):
-            if not isinstance(self.BreakoutBoxConnections.Switch,Empty):
-                self.BreakoutBoxConnections.Switch.sendCommand('reset')
-            else:
-                print('Dummy Switch reset')
+        try:
+            #Reset Switch conenctions, if any
+            self.ResetSwitch()
             
-        if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-            # set the temperature. Only one temperature is allowed.
-            self.BreakoutBoxConnections.PPMS.setTemperature(self.Temperature)
-        # Go to the saturation field (or only field) also
-        if 'RvsAngle_Remnant' in self.MeasurementType:
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-                self.BreakoutBoxConnections.PPMS.setField(self.MagneticField[0])
-        elif self.MeasurementType == 'RvsAngle':
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-                self.BreakoutBoxConnections.PPMS.setField(self.MagneticField)
-        else:
-            raise ValueError('Measurement type is not RvsAngle or RvsAngle_Remnant!')
-        if self.WaitForSetpoints:
-            #Wait for them to be reached
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty): 
-                self.BreakoutBoxConnections.PPMS.waitForTemperature()
-                self.BreakoutBoxConnections.PPMS.waitForField()
+            # Go to the saturation field (or only field)
+            if 'RvsAngle_Remnant' in self.MeasurementType:
+                Field=self.MagneticField[0]
+            elif self.MeasurementType == 'RvsAngle':
+                Field=self.MagneticField
             else:
-                print('Dummy wait 2s...')
-                time.sleep(2)
-            if Verbose:
-                print('Waiting for setpoints...')
-        time.sleep(self.InitialWaitTime)
+                raise ValueError('Measurement type is not RvsAngle or RvsAngle_Remnant!')
+            # together with the temperature (only one is allowed) and the first angle
+            self.goToSetpoints(Temperature=self.Temperature, MagneticField=Field, Angle=self.Angle[0], Verbose=Verbose)
+            self.InitialSettle(Verbose=Verbose)
 
-        # Start recording the datafile
-        self.StartDataRecording()
+            # Start recording the datafile
+            self.StartDataRecording()
         
-        for angle in self.Angle:
-            if Verbose:
-                print('rotating to angle {:.1f} degrees...'.format(angle))
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-                self.BreakoutBoxConnections.PPMS.setPosition(angle)
-                self.BreakoutBoxConnections.PPMS.waitForPosition()
-            
-            if type(self.MagneticField) != list:
-                MagneticFieldList=[self.MagneticField]
-            else:
-                MagneticFieldList=self.MagneticField
-
-            for MagneticField in MagneticFieldList:
-                # Set the field before each measurement. If the scan is a remnant scan, then wait for it to be reached.
+            for angle in self.Angle:
+                if Verbose:
+                    print('rotating to angle {:.1f} degrees...'.format(angle))
                 if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-                    self.BreakoutBoxConnections.PPMS.setField(MagneticField)
-                    if 'RvsAngle_Remnant' in self.MeasurementType:
-                        self.BreakoutBoxConnections.PPMS.waitForField()
+                    self.BreakoutBoxConnections.PPMS.setPosition(angle)
+                    self.BreakoutBoxConnections.PPMS.waitForPosition()
+            
+                if type(self.MagneticField) != list:
+                    MagneticFieldList=[self.MagneticField]
                 else:
-                    if self.MeasurementType=='RvsAngle_Remnant':
-                        print('Set Dummy Field to {} Oe and waiting for it'.format(MagneticField))
-                        time.sleep(2)
-
-                self.doMeasurementsandRecordData(Verbose=Verbose)
-            self.SendAllPulses(Verbose=Verbose)
-            self.doMeasurementsandRecordData(Verbose=Verbose,PulseChannel=' '.join(self.PulseNames))
+                    MagneticFieldList=self.MagneticField
+
+                for MagneticField in MagneticFieldList:
+                    # Set the field before each measurement. If the scan is a remnant scan, then wait for it to be reached.
+                    if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
+                        self.BreakoutBoxConnections.PPMS.setField(MagneticField)
+                        if 'RvsAngle_Remnant' in self.MeasurementType:
+                            self.BreakoutBoxConnections.PPMS.waitForField()
+                    else:
+                        if self.MeasurementType=='RvsAngle_Remnant':
+                            print('Set Dummy Field to {} Oe and waiting for it'.format(MagneticField))
+                            self.Clock.sleep(2, 'DummyWait')
+
+                    self.doMeasurementsandRecordData(Verbose=Verbose)
+                self.SendAllPulses(Verbose=Verbose)
+                self.doMeasurementsandRecordData(Verbose=Verbose,PulseChannel=' '.join(self.PulseNames))
+        finally:
+            self.EndRun(Verbose=Verbose)
         
         
     def RunRvsAngleMeasurementPulseField(self, Angles=-999, RvsAnglesetMagneticField=-999, RvsAnglesetTemperature=-999, Verbose=False):
@@ -1213,50 +1971,35 @@ class MeasurementSettings:
     
             self.SaveFolder='./data/PPMS_switch/'
         
-        #Reset Switch conenctions, if any
-        if hasattr(self.BreakoutBoxConnections,'Switch'):
-            if not isinstance(self.BreakoutBoxConnections.Switch,Empty):
-                self.BreakoutBoxConnections.Switch.sendCommand('reset')
-            else:
-                print('Dummy Switch reset')
+        try:
+            #Reset Switch conenctions, if any
+            self.ResetSwitch()
             
-        if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-            # set the temperature. Only one temperature is allowed.
-            self.BreakoutBoxConnections.PPMS.setTemperature(self.Temperature)
-        # Go to the field
-        if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-            self.BreakoutBoxConnections.PPMS.setField(self.MagneticField)
-        if self.WaitForSetpoints:
-            #Wait for them to be reached
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty): 
-                self.BreakoutBoxConnections.PPMS.waitForTemperature()
-                self.BreakoutBoxConnections.PPMS.waitForField()
-            else:
-                print('Dummy wait 2s...')
-                time.sleep(2)
-            if Verbose:
-                print('Waiting for setpoints...')
-        time.sleep(self.InitialWaitTime)
+            # Go to the temperature (only one is allowed), the field and the first angle together
+            self.goToSetpoints(Temperature=self.Temperature, MagneticField=self.MagneticField, Angle=self.Angle[0], Verbose=Verbose)
+            self.InitialSettle(Verbose=Verbose)
 
-        # Start recording the datafile
-        self.StartDataRecording()
+            # Start recording the datafile
+            self.StartDataRecording()
         
-        for angle in self.Angle:
-            if Verbose:
-                print('rotating to angle {:.1f} degrees...'.format(angle))
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-                self.BreakoutBoxConnections.PPMS.setPosition(angle)
-                self.BreakoutBoxConnections.PPMS.waitForPosition()
+            for angle in self.Angle:
+                if Verbose:
+                    print('rotating to angle {:.1f} degrees...'.format(angle))
+                if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
+                    self.BreakoutBoxConnections.PPMS.setPosition(angle)
+                    self.BreakoutBoxConnections.PPMS.waitForPosition()
             
-            # Make sure it is at the field (but dont wait for it)
-            if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
-                self.BreakoutBoxConnections.PPMS.setField(self.MagneticField)
+                # Make sure it is at the field (but dont wait for it)
+                if not isinstance(self.BreakoutBoxConnections.PPMS,Empty):
+                    self.BreakoutBoxConnections.PPMS.setField(self.MagneticField)
 
-            self.doMeasurementsandRecordData(Verbose=Verbose)
-            self.SendAllPulses(Verbose=Verbose, SwitchPolarity=False)
-            self.doMeasurementsandRecordData(Verbose=Verbose,PulseChannel=' '.join(self.PulseNames))
-            self.SendAllPulses(Verbose=Verbose, SwitchPolarity=True)
-            self.doMeasurementsandRecordData(Verbose=Verbose,PulseChannel='switched_polarity'+' '.join(self.PulseNames))
+                self.doMeasurementsandRecordData(Verbose=Verbose)
+                self.SendAllPulses(Verbose=Verbose, SwitchPolarity=False)
+                self.doMeasurementsandRecordData(Verbose=Verbose,PulseChannel=' '.join(self.PulseNames))
+                self.SendAllPulses(Verbose=Verbose, SwitchPolarity=True)
+                self.doMeasurementsandRecordData(Verbose=Verbose,PulseChannel='switched_polarity'+' '.join(self.PulseNames))
+        finally:
+            self.EndRun(Verbose=Verbose)
         
     def __repr__(self):
     # For printing the contents of this class
@@ -1278,6 +2021,17 @@ class MeasurementSettings:
                 OutPString += '\n\t Current Source Name: {}'.format(i.CurrentSource)
                 OutPString += '\n\t Current Amplitude: {0:.2f}mA'.format(i.CurrentAmplitude*1000)
                 OutPString += '\n\t Voltage Range (for Pulse Delta): {0:.1f}V'.format(float(i.VoltRange))
+            if i.TargetError is not None:
+                OutPString += '\n\t Target standard error: {:.2e}V'.format(i.TargetError)
+            if i.TargetRelativeError is not None:
+                OutPString += '\n\t Target relative standard error: {:.2e}'.format(i.TargetRelativeError)
+            if i.DCVoltRange is not None:
+                OutPString += '\n\t Voltage Range (for DC): {}V'.format(i.DCVoltRange)
+            if i.AutoReport is not None:
+                r=i.AutoReport
+                OutPString += '\n\t Auto configured: {}={}, 2182 range {}V, target error {:.2e}V, expected error {:.2e}V'.format(
+                              r['Setting'],r['Count'],r['Range'],r['Target'],r['Expected'])
+                OutPString += '\n\t Noise: white {:.2e}V/sqrt(Hz), 1/f corner {:.3g}Hz'.format(r['white_noise'],r['corner_frequency'])
             if hasattr(i,'SwitchConnections'):
                 OutPString += '\n\t {:30s}{:14s}:'.format('Switch Connection Pairs','Matrix Switch Addresses')
                 for j in range(len(i.SwitchConnections)):
@@ -1288,6 +2042,7 @@ class MeasurementSettings:
         OutPString += '\n\nCurrent Source Settings:'
         OutPString += '\n\ncurrent source range: {0:.1f}(mA)'.format(self.SourceCurrentRange*1e3)
         OutPString += '\ncurrent source compliance voltage: {0:.1f}(V)'.format(self.SourceComplianceVoltage)
+        OutPString += '\nkeep current source on for the whole run?: {}'.format(self.KeepSourceOn)
         
         OutPString += '\n\nVoltage Source Settings:'
         OutPString += '\n\nvoltage source range: {0:.1f}(V)'.format(self.SourceVoltageRange)
@@ -1300,11 +2055,28 @@ class MeasurementSettings:
         OutPString += '\ntime per Voltage measurement point: {0:.2f}(s)'.format(self.TimePerPoint)
         OutPString += '\nnumber of Voltage measurement points to skip at ends: {}'.format(self.SkipPoints)
         OutPString += '\nnumber of Voltage measurement outlier points to drop at each end: {}'.format(self.DropOutliers)
+        OutPString += '\nbuffered 2182 readings?: {}'.format(self.Buffered)
+        OutPString += '\n2182 triggered by the current source over the trigger link?: {}'.format(self.Triggered)
+        if self.Triggered:
+            OutPString += '\ntrigger link line: {}'.format(self.TriggerLine)
+            OutPString += '\n2182 integration time per reading: {}(PLC)'.format(self.TriggerNPLC)
+            OutPString += '\n2182 trigger delay: {}(s)'.format(self.TriggerDelay)
+        OutPString += '\nadaptive averaging readings (min, max, block): {}, {}, {}'.format(self.AdaptiveMinPoints,self.AdaptiveMaxPoints,self.AdaptiveBlockPoints)
+        OutPString += '\nauto configure the connections at the start of each run?: {}'.format(self.AutoConfigure)
+        if self.AutoConfigure:
+            OutPString += '\nauto configure burst readings, target error, target relative error, max readings: {}, {}, {}, {}'.format(
+                          self.AutoBurstPoints,self.AutoTargetError,self.AutoTargetRelativeError,self.AutoMaxPoints)
         OutPString += '\nPulse Delta? (overwrites DC settings): {}'.format(self.PulseDelta)
         OutPString += '\nPulse Delta count: {}'.format(self.PDCount)
         OutPString += '\nPulse Delta interval (number of 60Hz cycles): {}'.format(self.PDInterval)
         OutPString += '\nPulse Delta width: {}'.format(self.PDWidth)
         OutPString += '\nPulse Delta source delay: {}'.format(self.PDSourceDelay)
+        OutPString += '\nPulse Delta outlier rejection (robust standard deviations): {}'.format(self.PDReject)
+        OutPString += '\nHardware (6221) delta mode for DC?: {}'.format(self.HardwareDelta)
+        if self.HardwareDelta:
+            OutPString += '\nDelta count: {}'.format(self.DeltaCount)
+            OutPString += '\nDelta source delay: {}(s)'.format(self.DeltaDelay)
+            OutPString += '\nDelta 2182 integration time: {}(PLC)'.format(self.DeltaNPLC)
 
         OutPString += '\n\nPulse List:'
         for i in self.PulseConnections:
@@ -1323,11 +2095,44 @@ class MeasurementSettings:
                     
         OutPString += '\n\nTiming Settings:'
         OutPString += '\n\nwait for initial setpoints?: {}'.format(self.WaitForSetpoints)
-        OutPString += '\nwait time at measurement start: {}'.format(self.InitialWaitTime)
+        if self.SettleMeasurement is None:
+            OutPString += '\nwait time at measurement start: {}'.format(self.InitialWaitTime)
+        else:
+            OutPString += '\nwait until resistance settles on: {}'.format(self.SettleMeasurement)
+            OutPString += '\nmaximum resistance drift: {:.1e}(1/min) over {} readings every {}(s)'.format(self.SettleDrift,self.SettleReadings,self.SettleInterval)
+            OutPString += '\nsettle timeout: {}(s)'.format(self.SettleTimeout)
+            OutPString += '\nsettle reading pulse delta count / DC points: {} / {}'.format(self.SettlePDCount,self.SettleVPoints)
         OutPString += '\nwait time after switching connections: {}'.format(self.WaitAfterSwitch)
-        OutPString += '\nwait time after pusle arm: {}'.format(self.WaitTimeAfterPulseArm)
+        OutPString += '\nonly switch the relays that change between connections?: {}'.format(self.MinimalSwitching)
+        OutPString += '\nreorder the connections for the fewest relay changes?: {}'.format(self.ReorderConnections)
+        if self.WaitTimeAfterPulseArm is None:
+            OutPString += '\nwait time after pusle arm: until armed (*OPC?)'
+        else:
+            OutPString += '\nwait time after pusle arm: {}'.format(self.WaitTimeAfterPulseArm)
         OutPString += '\nwait time after pusle: {}'.format(self.WaitAfterPulse)
+        OutPString += '\npoll PPMS status instead of WaitFor?: {}'.format(self.UseStabilizer)
+        OutPString += '\nbackground PPMS telemetry?: {}'.format(self.UseTelemetry)
+        if self.UseTelemetry:
+            OutPString += '\ntelemetry interval: {}(s)'.format(self.TelemetryInterval)
+            OutPString += '\nPPMS values averaged over each measurement?: {}'.format(self.TelemetryAverage)
+        OutPString += '\nlive plot in a separate process?: {}'.format(self.PlotWorker)
+        if self.PlotWorker:
+            OutPString += '\nmaximum live plot refresh rate: {}(1/s)'.format(self.MaxRefreshRate)
+        if self.UseStabilizer:
+            OutPString += '\nPPMS status poll interval: {}(s)'.format(self.PollInterval)
+            OutPString += '\ntemperature tolerance: {}(K)'.format(self.TemperatureTolerance)
+            OutPString += '\nfield tolerance: {}(Oe)'.format(self.FieldTolerance)
+            OutPString += '\ntime within tolerance before stable: {}(s)'.format(self.HoldTime)
+            OutPString += '\ntemperature/field wait timeout: {}/{}(s)'.format(self.TemperatureTimeout,self.FieldTimeout)
         
+        if self.Sweep:
+            OutPString += '\n\nSweep Settings:'
+            OutPString += '\n\ncontinuous sweep (RvsT/RvsH): True'
+            OutPString += '\ntemperature sweep rate: {}(K/min)'.format(self.SweepTemperatureRate)
+            OutPString += '\nfield sweep rate: {}(Oe/s)'.format(self.SweepFieldRate)
+            OutPString += '\nsweep both directions?: {}'.format(self.SweepBothDirections)
+            OutPString += '\nbin onto the setpoint list?: {}'.format(self.SweepBinToGrid)
+
         OutPString += '\n\nOverall Measurement Settings:'
         OutPString += '\n\nmagnetic field setpoint: {}(Oe)'.format(self.MagneticField)
         OutPString += '\ntemperature setpoint: {}(K)'.format(self.Temperature)
@@ -1343,84 +2148,6 @@ class MeasurementSettings:
         sets=print_to_string(self)
         return('\n*********************\nMeasurement Settings:\n*********************\n'+sets)
         
-'''
-**************************************************************************************************
-DATA ANALYSIS FUNCTIONS
-**************************************************************************************************
-'''
-
-
-def PlotSMR(FileName):
-    #Plot data
-    hlength = 0
-    ncorr=0
-    measnames=[]
-    with open(FileName) as myFile:
-        for num, line in enumerate(myFile, 1):
-            if line == '\n':
-                ncorr+=-1
-            if 'Angle(deg)' in line:
-                hlength = num-1+ncorr
-            if 'Measurement Name:' in line:
-                measnames.append(line.split(':')[1].split('\n')[0])
-            if 'RvsAngle' in line:
-                MeasType='RvsAngle'
-            elif 'RvsH' in line:
-                MeasType='RvsH'
-            elif 'RvsT' in line:
-                MeasType='RvsT'
-            elif 'RvsPulseAmp' in line:
-                MeasType='RvsPulseAmp'
-    
-    df = pd.read_csv(FileName, header=hlength)
-    #print(df)
-    
-    for measname in measnames:
-        # first round the field, temp, and position so that they can be grouped
-        df['RoundedTemp']=df['Temp(K)'].round(0).astype(int)
-        df['RoundedAngle']=df['Angle(deg)'].round(0).astype(int)
-        df['RoundedField']=df['Field(Oe)'].apply(lambda x: custom_round(x, base=5)).astype(int)
-        pulsed=~pd.isnull(df['PulseChannel'])
-        if pulsed.sum()>0:
-            negative_pulsed=df['PulseChannel'][pulsed].str.contains('switched_polarity')
-        else:
-            negative_pulsed=pulsed
-        FieldName=[]
-        for i in range(len(df['RoundedField'])):
-            rounded_field=str(df['RoundedField'].iloc[i])
-            if pulsed[i] and not negative_pulsed[i]:
-                pulsed_name='Pulsed_'
-            elif pulsed[i] and negative_pulsed[i]:
-                pulsed_name='neg_Pulsed_'
-            else:
-                pulsed_name=''
-            FieldName.append(pulsed_name+rounded_field)
-        df['FieldName'] = FieldName
-        # df['FieldName'] = np.where(positive_pulsed, 'Pulsed_'+df['RoundedField'], df['RoundedField'])
-        fig,ax=plt.subplots()
-
-        plt.suptitle(FileName.split('/')[-1][:-4]+'_'+measname)
-        if MeasType == 'RvsAngle':
-            for key, d in df.groupby('FieldName'):
-                ax.plot(d['Angle(deg)'],d[measname+'_Average_V']/d[measname+'_DC_Current(A)'], linestyle='-',marker='o', markersize='2',linewidth=1, label=measname+'_{}'.format(key))
-            ax.set_xlabel('Angle(deg)')
-        elif MeasType == 'RvsH':
-            ax.plot(df['Field(Oe)'],df[measname+'_Average_V']/df[measname+'_DC_Current(A)'], linestyle='-',marker='o', markersize='2',linewidth=1, label=measname)
-            ax.set_xlabel('Field(Oe)')
-        elif MeasType == 'RvsT':
-            ax.plot(df['Temp(K)'],df[measname+'_Average_V']/df[measname+'_DC_Current(A)'], linestyle='-',marker='o', markersize='2',linewidth=1, label=measname)
-            ax.set_xlabel('Temp(K)')
-        elif MeasType == 'RvsPulseAmp':
-            df[['PulseName', 'PulseAmp']] = df['PulseChannel'].str.split('>', 1, expand=True)
-            df["PulseAmp"]=df["PulseAmp"].astype(float)*1e3
-            ax.plot(df['PulseAmp'],df[measname+'_Average_V']/df[measname+'_DC_Current(A)'], linestyle='-',marker='o', markersize='2',linewidth=1, label=measname)
-            ax.set_xlabel('PulseAmp(mA)')
-
-        ax.set_ylabel('$\Omega$')
-        ax.legend()
-        fig.savefig(FileName[:-4]+'_'+measname+'.png', dpi=600)
-        
-      
 '''Example Usage:
 C=BreakoutBoxConnections()
 C.addMatrixSwitch()
@@ -0,0 +1,124 @@
+# Noise analysis of a burst of voltmeter readings: noise spectrum, Allan deviation, and the number of readings
+# that has to be averaged to reach a given precision. Used by MeasurementSettings.AutoConfigure (UtilsMeasurementSetup.py).
+'''
+-----------------
+ALLAN DEVIATION |
+-----------------
+
+The Allan deviation at m readings is the scatter of the mean of m consecutive readings. For white noise it falls as
+1/sqrt(m), like the standard error of the mean. Once drift or 1/f noise takes over it flattens out or rises again,
+and averaging longer no longer helps. So the number of readings needed for a precision is read off the Allan
+deviation instead of the standard deviation of the burst.
+
+----------------
+NOISE SPECTRUM |
+----------------
+
+One sided power spectral density (V^2/Hz) of the readings, averaged over half overlapping Hann windowed segments.
+The white noise level is the median of the upper half of the spectrum, and the 1/f corner the frequency below
+which the spectrum rises above twice that level.
+'''
+import numpy as np
+
+# Channel 1 ranges of the 2182A (V)
+RANGES_2182 = [0.01, 0.1, 1, 10, 100]
+
+
+def allanDeviation(readings):
+    # Overlapping Allan deviation for averages of m = 1, 2, 4, ... readings (up to a third of the burst).
+    # Returns the arrays m and adev.
+    readings=np.asarray(readings, dtype=float)
+    Sums=np.concatenate(([0.], np.cumsum(readings)))
+    Ms=[]
+    Adev=[]
+    m=1
+    while 3*m <= len(readings):
+        Means=(Sums[m:]-Sums[:-m])/m
+        Differences=Means[m:]-Means[:-m]
+        Ms.append(m)
+        Adev.append(np.sqrt(0.5*np.mean(Differences**2)))
+        m*=2
+    return np.array(Ms), np.array(Adev)
+
+
+def noiseSpectrum(readings, dt, segments=4):
+    # One sided power spectral density of readings taken every dt seconds, averaged over 2*segments-1 half overlapping
+    # Hann windowed segments. Returns the frequencies (Hz) and the density (V^2/Hz).
+    readings=np.asarray(readings, dtype=float)
+    Length=max(len(readings)//segments, 8)
+    Window=np.hanning(Length)
+    Scale=dt/np.sum(Window**2)
+    Density=np.zeros(Length//2+1)
+    Count=0
+    for Start in range(0, len(readings)-Length+1, Length//2):
+        Segment=readings[Start:Start+Length]
+        Density+=np.abs(np.fft.rfft((Segment-Segment.mean())*Window))**2*Scale
+        Count+=1
+    Density/=max(Count, 1)
+    # Everything but the DC and Nyquist bins counts twice in a one sided spectrum
+    Density[1:-1]*=2
+    if Length % 2:
+        Density[-1]*=2
+    return np.fft.rfftfreq(Length, dt), Density
+
+
+def noiseSummary(readings, dt):
+    # White noise density (V/sqrt(Hz)) and 1/f corner frequency (Hz, 0 if the spectrum is white) of the readings
+    Frequencies, Density=noiseSpectrum(readings, dt)
+    Frequencies, Density=Frequencies[1:], Density[1:]
+    if len(Density) == 0:
+        return {'white_noise':float('nan'), 'corner_frequency':float('nan')}
+    White=np.median(Density[len(Density)//2:])
+    Above=np.nonzero(Density > 2*White)[0]
+    Above=Above[Above < len(Density)//2]
+    Corner=Frequencies[Above[-1]] if len(Above) > 0 else 0.
+    return {'white_noise':np.sqrt(White), 'corner_frequency':Corner}
+
+
+def averagingCount(readings, target, maxcount=None):
+    # Number of readings whose mean reaches the target standard error (V), from the Allan deviation of the burst.
+    # Beyond the burst the white noise part is extrapolated (adev ~ 1/sqrt(m)). If the Allan deviation stops falling
+    # before the target, the target can not be reached and the count with the lowest Allan deviation is returned.
+    # Returns the count, the expected standard error at that count, and whether the target is reached.
+    Ms, Adev=allanDeviation(readings)
+    if len(Ms) == 0:
+        raise ValueError('At least 3 readings are needed for the Allan deviation.')
+    Best=np.argmin(Adev)
+    Below=np.nonzero(Adev[:Best+1] <= target)[0]
+    if len(Below) > 0:
+        i=Below[0]
+        if i == 0:
+            return 1, Adev[0], True
+        # Interpolate between the octaves assuming white noise from the previous one
+        Count=int(np.ceil(Ms[i-1]*(Adev[i-1]/target)**2))
+        return min(Count, Ms[i]), target, True
+    if Best < len(Ms)-1:
+        # Drift floor inside the burst
+        return int(Ms[Best]), Adev[Best], False
+    Count=int(np.ceil(Ms[-1]*(Adev[-1]/target)**2))
+    if maxcount is not None and Count > maxcount:
+        return maxcount, Adev[-1]*np.sqrt(Ms[-1]/maxcount), False
+    return Count, target, True
+
+
+def chooseRange(readings, ranges=RANGES_2182, margin=1.2):
+    # Smallest 2182 range that holds the largest reading with some margin
+    Peak=margin*np.max(np.abs(readings))
+    for Range in ranges:
+        if Peak <= Range:
+            return Range
+    return ranges[-1]
+
+
+"""Example Commands"""
+
+"""
+#Burst of 256 readings, one every 0.1 s
+v=vm.bufferedReadings(count=256, interval=0.1)
+m, adev = allanDeviation(v)
+f, psd = noiseSpectrum(v, 0.1)
+noiseSummary(v, 0.1)
+#Readings to average for a standard error of 10 nV, at most 1000
+count, error, reached = averagingCount(v, 10e-9, maxcount=1000)
+chooseRange(v)
+"""
@@ -1,30 +1,49 @@
-import platform, clr, subprocess
+import platform, subprocess
+import threading
+import collections
+from UtilsClock import SystemClock
 
 """Connect to the ppms in order to control the field and temperature"""
-try: clr.AddReference('QDInstrument')
-except Exception as e:
-    print("Exception found:", e)
-    if clr.FindAssembly('QDInstrument') is None: print('Could not find QDInstrument.dll')
-    else:
-        print('Found QDInstrument.dll at {}'.format(clr.FindAssembly('QDInstrument')))
-        print('Try right-clicking the .dll, selecting "Properties", and then clicking "Unblock"')
-        # import the C# classes for interfacing with the PPMS
-        #The dll file must be unblocked in the dll file's properties
-        
-        
-"""The control of PPMS field/temperature is given by the manufacturer Quantum Design. 
-    They provide Labview packages to interface with the PPMS, and such packages are also 
-    included in QDInstrument.dll in the folder with python codes. Each python code loads the dll
-    and REGISTERS it as QuantumDesign library and import it
-"""
-from QuantumDesign.QDInstrument import *
-
-QDI_PPMS_TYPE = QDInstrumentBase.QDInstrumentType.DynaCool
-#QDI_FIELD_APPROACH = QDInstrumentBase.FieldApproach.NoOvershoot
-QDI_FIELD_APPROACH = QDInstrumentBase.FieldApproach.Linear
-QDI_FIELD_MODE = QDInstrumentBase.FieldMode.Persistent
-QDI_FIELD_MODE_driven = QDInstrumentBase.FieldMode.Driven
-MOVE_TO_POSITION_MODE = QDInstrumentBase.PositionMode.MoveToPosition
+try:
+    import clr
+except ImportError:
+    # pythonnet is only available on the measurement computer. Without it, only the emulated
+    # PPMS in UtilsSimulation.py can be used.
+    clr = None
+    print('pythonnet (clr) not found. Only the simulated PPMS is available.')
+
+if clr is not None:
+    try: clr.AddReference('QDInstrument')
+    except Exception as e:
+        print("Exception found:", e)
+        if clr.FindAssembly('QDInstrument') is None: print('Could not find QDInstrument.dll')
+        else:
+            print('Found QDInstrument.dll at {}'.format(clr.FindAssembly('QDInstrument')))
+            print('Try right-clicking the .dll, selecting "Properties", and then clicking "Unblock"')
+            # import the C# classes for interfacing with the PPMS
+            #The dll file must be unblocked in the dll file's properties
+            
+            
+    """The control of PPMS field/temperature is given by the manufacturer Quantum Design. 
+        They provide Labview packages to interface with the PPMS, and such packages are also 
+        included in QDInstrument.dll in the folder with python codes. Each python code loads the dll
+        and REGISTERS it as QuantumDesign library and import it
+    """
+    from QuantumDesign.QDInstrument import *
+
+    QDI_PPMS_TYPE = QDInstrumentBase.QDInstrumentType.DynaCool
+    #QDI_FIELD_APPROACH = QDInstrumentBase.FieldApproach.NoOvershoot
+    QDI_FIELD_APPROACH = QDInstrumentBase.FieldApproach.Linear
+    QDI_FIELD_MODE = QDInstrumentBase.FieldMode.Persistent
+    QDI_FIELD_MODE_driven = QDInstrumentBase.FieldMode.Driven
+    MOVE_TO_POSITION_MODE = QDInstrumentBase.PositionMode.MoveToPosition
+else:
+    # Plain stand-ins for the .NET enums, understood by the simulated QDInstrument
+    QDI_PPMS_TYPE = 'DynaCool'
+    QDI_FIELD_APPROACH = 'Linear'
+    QDI_FIELD_MODE = 'Persistent'
+    QDI_FIELD_MODE_driven = 'Driven'
+    MOVE_TO_POSITION_MODE = 'MoveToPosition'
 
 DEFAULT_PORT = 11000
 QDI_FIELD_STATUS = ['MagnetUnknown', 'StablePersistent', 'StableDriven',
@@ -44,10 +63,44 @@ QDI_TEMP_STATUS = ['TemperatureUnknown',
                     
     
 PPMS_ComputerIPAddress = "192.168.0.7"
+class LockedQDInstrument:
+    """Passes every call to the QDInstrument through one lock, so that calls from different threads (the measurement
+    and PPMSTelemetry) never reach the QD server at the same time. WaitFor, which blocks for the whole stabilization,
+    does not take the lock, so the telemetry keeps sampling while the measurement waits in it."""
+    unlocked = ('WaitFor',)
+
+    def __init__(self, qdi_instrument):
+        self.qdi_instrument = qdi_instrument
+        self.lock = threading.RLock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.qdi_instrument, name)
+        if not callable(attribute) or name in self.unlocked:
+            return attribute
+        def call(*args):
+            with self.lock:
+                return attribute(*args)
+        return call
+
+
 class Dynacool:
     """Thin wrapper around the QuantumDesign.QDInstrument.QDInstrumentBase class"""
-    def __init__(self, ip_address):
-        self.qdi_instrument = QDInstrumentFactory.GetQDInstrument(QDI_PPMS_TYPE, True, ip_address, DEFAULT_PORT)
+    def __init__(self, ip_address, clock=SystemClock, qdi_instrument=None):
+        if qdi_instrument is None:
+            qdi_instrument = QDInstrumentFactory.GetQDInstrument(QDI_PPMS_TYPE, True, ip_address, DEFAULT_PORT)
+        self.qdi_instrument = LockedQDInstrument(qdi_instrument)
+        self.clock = clock
+        self.temperatureSetpoint = None
+        self.fieldSetpoint = None
+        self.waitLog = []
+        self.setStabilizer(False)
+
+    def timedWaitFor(self, label, temperature, field, position, chamber, delay, timeout):
+        """Call WaitFor and add the time it blocked to the clock's wait budget under label."""
+        start = self.clock.time()
+        result = self.qdi_instrument.WaitFor(temperature, field, position, chamber, delay, timeout)
+        self.clock.record(self.clock.time()-start, label)
+        return result
         
     """Handle temperature of the PPMS. Get/Set/WaitForStabilizing"""
     def getTemperature(self):
@@ -56,11 +109,14 @@ class Dynacool:
         
     def setTemperature(self, temp, rate=20):
         """Set temperature. Keyword arguments: temp(Kelvin), rate(K/min)"""
+        self.temperatureSetpoint = temp
         return self.qdi_instrument.SetTemperature(temp, rate, 0)
         
     def waitForTemperature(self, delay=2, timeout=6000):
         """Pause execution until the PPMS reaches the temperature setpoint."""
-        return self.qdi_instrument.WaitFor(True, False, False, False, delay, timeout)
+        if self.stabilizer is not None:
+            return self.pollForStable(True, False, 'WaitForTemperature')
+        return self.timedWaitFor('WaitForTemperature', True, False, False, False, delay, timeout)
         
     """Handle field of the PPMS. Get/Set/WaitForStabilizing"""
     def getField(self):
@@ -69,12 +125,15 @@ class Dynacool:
     
     def setField(self, field, rate=100, persistent=False):
         """Set the field. Keyword arguments: field(gauss), rate(gauss/second)"""
+        self.fieldSetpoint = field
         if persistent: return self.qdi_instrument.SetField(field, rate, QDI_FIELD_APPROACH, QDI_FIELD_MODE)
         else: return self.qdi_instrument.SetField(field, rate, QDI_FIELD_APPROACH, QDI_FIELD_MODE_driven)
         
     def waitForField(self, delay=2, timeout=3600):
         """Pause execution until the PPMS reaches the field setpoint."""
-        return self.qdi_instrument.WaitFor(False, True, False, False, delay, timeout)
+        if self.stabilizer is not None:
+            return self.pollForStable(False, True, 'WaitForField')
+        return self.timedWaitFor('WaitForField', False, True, False, False, delay, timeout)
 
     """Handle motor rotation of the PPMS. Get/Set/WaitForStabilizing"""
     def setPosition(self, position, speed=1): #position: float, deg; speed: float, deg/sec
@@ -84,9 +143,194 @@ class Dynacool:
         return self.qdi_instrument.GetPosition("Horizontal Rotator",0, 0)[1]
 
     def waitForPosition(self, delay=2, timeout=1200):
-        return self.qdi_instrument.WaitFor(False, False, True, False, delay, timeout)
+        return self.timedWaitFor('WaitForPosition', False, False, True, False, delay, timeout)
+
+    """Handle temperature, field and rotation together"""
+    def setSetpoints(self, temperature=None, field=None, position=None, rate=20, fieldRate=100, speed=1, persistent=False):
+        """Start the temperature, field and rotator changes together. Systems given as None are left alone.
+        Returns the (temperature, field, position) flags of the systems that were set, for waitForSetpoints."""
+        if temperature is not None: self.setTemperature(temperature, rate)
+        if field is not None: self.setField(field, fieldRate, persistent)
+        if position is not None: self.setPosition(position, speed)
+        return temperature is not None, field is not None, position is not None
+
+    def waitForSetpoints(self, temperature=True, field=True, position=True, delay=2, timeout=6000):
+        """Pause execution until all the selected systems are stable, with a single WaitFor on all of them."""
+        if not (temperature or field or position): return 0
+        if self.stabilizer is not None and (temperature or field):
+            result = self.pollForStable(temperature, field, 'WaitForSetpoints')
+            if position: result = max(result, self.waitForPosition(delay, timeout))
+            return result
+        return self.timedWaitFor('WaitForSetpoints', temperature, field, position, False, delay, timeout)
+
+    def goToSetpoints(self, temperature=None, field=None, position=None, delay=2, timeout=6000, **kwargs):
+        """Set the given setpoints together and wait once until all are reached.
+        The wait is the slowest of the approaches instead of their sum."""
+        flags = self.setSetpoints(temperature, field, position, **kwargs)
+        return self.waitForSetpoints(*flags, delay=delay, timeout=timeout)
+
+    """Poll the temperature and field status instead of WaitFor"""
+    def getTemperatureStatus(self):
+        """Return the temperature (Kelvin) and its status name from QDI_TEMP_STATUS."""
+        result = self.qdi_instrument.GetTemperature(0, 0)
+        return result[1], QDI_TEMP_STATUS[int(result[2])]
+
+    def getFieldStatus(self):
+        """Return the field (gauss) and its status name from QDI_FIELD_STATUS."""
+        result = self.qdi_instrument.GetField(0, 0)
+        return result[1], QDI_FIELD_STATUS[int(result[2])]
+
+    def getPositionStatus(self):
+        """Return the rotator position (deg) and its status code."""
+        result = self.qdi_instrument.GetPosition("Horizontal Rotator", 0, 0)
+        return result[1], int(result[2])
+
+    def setStabilizer(self, enabled=True, pollInterval=1, temperatureTolerance=0.05, fieldTolerance=2, holdTime=0,
+                      temperatureTimeout=6000, fieldTimeout=3600,
+                      temperatureStatus=('Stable',), fieldStatus=('StablePersistent', 'StableDriven')):
+        """Make waitForTemperature, waitForField and waitForSetpoints poll the status (see pollForStable) instead of
+        calling WaitFor. Tolerances are in Kelvin and gauss, times in seconds."""
+        if not enabled:
+            self.stabilizer = None
+            return
+        self.stabilizer = {'pollInterval': pollInterval, 'holdTime': holdTime,
+                           'Temperature': (self.getTemperatureStatus, temperatureTolerance, temperatureStatus, temperatureTimeout),
+                           'Field': (self.getFieldStatus, fieldTolerance, fieldStatus, fieldTimeout)}
+
+    def pollForStable(self, temperature=True, field=True, label='PollForStable'):
+        """Poll the selected systems every pollInterval until each has a stable status and a value within tolerance of
+        its setpoint for holdTime, or its own timeout passes. Returns 0, or 1 if any system timed out.
+        Every finished wait is added to self.waitLog."""
+        settings = self.stabilizer
+        setpoints = {'Temperature': self.temperatureSetpoint, 'Field': self.fieldSetpoint}
+        pending = [axis for axis, selected in [('Temperature', temperature), ('Field', field)] if selected]
+        start = self.clock.time()
+        stableSince = {}
+        polls = 0
+        result = 0
+        while len(pending) > 0:
+            polls += 1
+            now = self.clock.time()
+            for axis in list(pending):
+                read, tolerance, statuses, timeout = settings[axis]
+                value, status = read()
+                inWindow = setpoints[axis] is None or abs(value-setpoints[axis]) <= tolerance
+                if status in statuses and inWindow:
+                    stableSince.setdefault(axis, now)
+                    done = now-stableSince[axis] >= settings['holdTime']
+                else:
+                    stableSince.pop(axis, None)
+                    done = False
+                timedOut = not done and now-start >= timeout
+                if done or timedOut:
+                    pending.remove(axis)
+                    result = max(result, int(timedOut))
+                    self.waitLog.append({'Label': label, 'Axis': axis, 'Setpoint': setpoints[axis], 'Value': value,
+                                         'Status': status, 'Seconds': now-start, 'Polls': polls, 'TimedOut': timedOut})
+            if len(pending) > 0:
+                self.clock.sleep(settings['pollInterval'], None)
+        self.clock.record(self.clock.time()-start, label)
+        return result
+
+    def waitLogString(self):
+        """Table of the waits done with pollForStable."""
+        out = '{:18s}{:>12s}{:>14s}{:>14s}{:>18s}{:>10s}{:>8s}'.format('Wait', 'Axis', 'Setpoint', 'Value', 'Status', 'Time(s)', 'Polls')
+        for entry in self.waitLog:
+            out += '\n{:18s}{:>12s}{:>14s}{:>14.4f}{:>18s}{:>10.1f}{:>8d}'.format(entry['Label'], entry['Axis'], str(entry['Setpoint']),
+                entry['Value'], entry['Status']+(' TIMEOUT' if entry['TimedOut'] else ''), entry['Seconds'], entry['Polls'])
+        return out
 
     
+class PPMSTelemetry:
+    """Samples temperature, field and rotator position with their status in the background, at a fixed interval,
+    into a ring buffer. Readers get the latest sample or an average over a time window without talking to the PPMS.
+    Samples are also appended to a telemetry file if one is set with setFile.
+    The calls are serialized with the measurement's own by the lock of the Dynacool (see LockedQDInstrument), which is
+    not held during WaitFor, so sampling goes on through stabilization waits. A failed sample is reported and the sampler goes on;
+    latest() reads the PPMS itself when the newest sample is older than maxAge intervals."""
+    maxAge = 3
+    columns = 'Time(s),Temp(K),TempStatus,Field(Oe),FieldStatus,Angle(deg),PositionStatus'
+
+    def __init__(self, ppms, interval=1, size=36000):
+        self.ppms = ppms
+        self.clock = ppms.clock
+        self.interval = interval
+        self.buffer = collections.deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.timer = None
+        self.fileName = None
+        self.errors = 0
+
+    def read(self):
+        """Read the PPMS once and store the sample (time, T, T status, H, H status, angle, position status)."""
+        temperature, temperatureStatus = self.ppms.getTemperatureStatus()
+        field, fieldStatus = self.ppms.getFieldStatus()
+        position, positionStatus = self.ppms.getPositionStatus()
+        entry = (self.clock.time(), temperature, temperatureStatus, field, fieldStatus, position, positionStatus)
+        with self.lock:
+            self.buffer.append(entry)
+            fileName = self.fileName
+        if fileName is not None:
+            with open(fileName, 'a') as f:
+                f.write('{:.3f},{},{},{},{},{},{}\n'.format(*entry))
+        return entry
+
+    def sample(self):
+        """Timer callback: read() with a failure reported instead of stopping the sampler. Returns None if it failed."""
+        try:
+            return self.read()
+        except Exception as error:
+            self.errors += 1
+            print('PPMS telemetry sample failed ({} so far): {!r}'.format(self.errors, error))
+            return None
+
+    def start(self, interval=None):
+        """Start sampling every interval seconds (on the PPMS clock, so it also runs in virtual time)."""
+        if interval is not None:
+            self.interval = interval
+        self.stop()
+        self.read()
+        self.timer = self.clock.every(self.interval, self.sample)
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def running(self):
+        return self.timer is not None
+
+    def setFile(self, fileName):
+        """Append every following sample to fileName (None to stop writing)."""
+        if fileName is not None:
+            with open(fileName, 'a') as f:
+                f.write(self.columns+'\n')
+        with self.lock:
+            self.fileName = fileName
+
+    def latest(self):
+        """Return the newest sample, reading the PPMS once if there is none yet or it is stale."""
+        with self.lock:
+            entry = self.buffer[-1] if len(self.buffer) > 0 else None
+        if entry is not None and self.clock.time()-entry[0] <= self.maxAge*self.interval:
+            return entry
+        return self.read()
+
+    def window(self, start, end):
+        """Return the samples taken between the clock times start and end."""
+        with self.lock:
+            return [entry for entry in self.buffer if start <= entry[0] <= end]
+
+    def average(self, start, end):
+        """Return (angle, temperature, field) averaged over the samples between start and end, or the latest values if
+        there are none in the window."""
+        entries = self.window(start, end)
+        if len(entries) == 0:
+            entries = [self.latest()]
+        n = len(entries)
+        return (sum(e[5] for e in entries)/n, sum(e[1] for e in entries)/n, sum(e[3] for e in entries)/n)
+
+
 def connect2PPMS(ipAddress=PPMS_ComputerIPAddress):
     #The computer LAN address is 192.168.0.7. The computer server must be up in order to respond to command.
     param = '-n' if platform.system().lower() == 'windows' else '-c'
@@ -108,5 +352,11 @@ class DummyPPMS:
     def getField(self): return None
     def setField(self, field, rate=100, persistent=False): return None
     def waitForField(self, delay=5, timeout=3600): return None
+    def setPosition(self, position, speed=1): return None
+    def getPosition(self): return None
+    def waitForPosition(self, delay=5, timeout=1200): return None
+    def setSetpoints(self, temperature=None, field=None, position=None, rate=20, fieldRate=100, speed=1, persistent=False): return None
+    def waitForSetpoints(self, temperature=True, field=True, position=True, delay=5, timeout=6000): return None
+    def goToSetpoints(self, temperature=None, field=None, position=None, delay=5, timeout=6000, **kwargs): return None
     
     
\ No newline at end of file
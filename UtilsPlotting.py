@@ -0,0 +1,296 @@
+# Plotting of the data files written by MeasurementSettings (UtilsMeasurementSetup.py): finished files with PlotSMR,
+# and live plots of the file being recorded, in the notebook (LivePlotSMR) or in a separate process (LivePlotProcess)
+'''
+-----------------------
+PLOTTING IN A PROCESS |
+-----------------------
+
+With LivePlotProcess the rows go through a queue to a worker process that owns the figures, so the measurement
+never waits for matplotlib. The worker appends every row it gets, but redraws at most MaxRefreshRate times per
+second: rows that come in faster are drawn together in the next frame and the frames in between are dropped.
+The worker shows the figures in windows of its own (a notebook can not show figures of another process) and saves
+the PNGs when asked. At the end of the run the windows stay open until they are closed.
+'''
+import csv
+import time
+import queue
+import multiprocessing
+import pandas as pd
+import matplotlib.pyplot as plt
+from IPython import display, get_ipython
+
+# Backends that can not show a window; a worker with one of these only saves the PNGs
+NONINTERACTIVE_BACKENDS = ['agg', 'cairo', 'pdf', 'pgf', 'ps', 'svg', 'template']
+
+
+def custom_round(x, base=5):
+    return int(base * round(float(x)/base))
+
+
+def ReadSMRHeader(FileName):
+    # Reads the settings header of a data file written by StartDataRecording.
+    # Returns the header length (for pd.read_csv), the measurement names and the measurement type.
+    hlength = 0
+    ncorr=0
+    measnames=[]
+    with open(FileName) as myFile:
+        for num, line in enumerate(myFile, 1):
+            if line == '\n':
+                ncorr+=-1
+            if 'Angle(deg)' in line:
+                hlength = num-1+ncorr
+            if 'Measurement Name:' in line:
+                measnames.append(line.split(':')[1].split('\n')[0])
+            if 'RvsAngle' in line:
+                MeasType='RvsAngle'
+            elif 'RvsH' in line:
+                MeasType='RvsH'
+            elif 'RvsT' in line:
+                MeasType='RvsT'
+            elif 'RvsPulseAmp' in line:
+                MeasType='RvsPulseAmp'
+    return hlength, measnames, MeasType
+
+
+def ReadSMRData(FileName, hlength):
+    return pd.read_csv(FileName, header=hlength)
+
+
+def SMRFieldName(RoundedField, PulseChannel):
+    # Name of the field group of a row: the rounded field, with 'Pulsed_' or 'neg_Pulsed_' in front for pulsed rows
+    if PulseChannel == '':
+        return str(RoundedField)
+    if 'switched_polarity' in PulseChannel:
+        return 'neg_Pulsed_'+str(RoundedField)
+    return 'Pulsed_'+str(RoundedField)
+
+
+def SMRPlotType(MeasurementType):
+    # Plot type (x axis) of a measurement type, the same way ReadSMRHeader finds it in the header
+    for PlotType in ['RvsAngle', 'RvsH', 'RvsT', 'RvsPulseAmp']:
+        if PlotType in MeasurementType:
+            return PlotType
+    return None
+
+
+def GroupSMRData(df):
+    # round the field, temp, and position so that they can be grouped, and name the field groups (pulsed or not)
+    df['RoundedTemp']=df['Temp(K)'].round(0).astype(int)
+    df['RoundedAngle']=df['Angle(deg)'].round(0).astype(int)
+    df['RoundedField']=df['Field(Oe)'].apply(lambda x: custom_round(x, base=5)).astype(int)
+    PulseChannel=df['PulseChannel'].where(~pd.isnull(df['PulseChannel']), '')
+    df['FieldName'] = [SMRFieldName(rounded_field, channel) for rounded_field, channel in zip(df['RoundedField'], PulseChannel)]
+    # df['FieldName'] = np.where(positive_pulsed, 'Pulsed_'+df['RoundedField'], df['RoundedField'])
+    return df
+
+
+def RenderSMR(FileName, df, measname, MeasType):
+    # Plots one measurement of a grouped data frame and saves the figure next to the data file
+    fig,ax=plt.subplots()
+
+    plt.suptitle(FileName.split('/')[-1][:-4]+'_'+measname)
+    if MeasType == 'RvsAngle':
+        for key, d in df.groupby('FieldName'):
+            ax.plot(d['Angle(deg)'],d[measname+'_Average_V']/d[measname+'_DC_Current(A)'], linestyle='-',marker='o', markersize='2',linewidth=1, label=measname+'_{}'.format(key))
+        ax.set_xlabel('Angle(deg)')
+    elif MeasType == 'RvsH':
+        ax.plot(df['Field(Oe)'],df[measname+'_Average_V']/df[measname+'_DC_Current(A)'], linestyle='-',marker='o', markersize='2',linewidth=1, label=measname)
+        ax.set_xlabel('Field(Oe)')
+    elif MeasType == 'RvsT':
+        ax.plot(df['Temp(K)'],df[measname+'_Average_V']/df[measname+'_DC_Current(A)'], linestyle='-',marker='o', markersize='2',linewidth=1, label=measname)
+        ax.set_xlabel('Temp(K)')
+    elif MeasType == 'RvsPulseAmp':
+        df[['PulseName', 'PulseAmp']] = df['PulseChannel'].str.split('>', n=1, expand=True)
+        df["PulseAmp"]=df["PulseAmp"].astype(float)*1e3
+        ax.plot(df['PulseAmp'],df[measname+'_Average_V']/df[measname+'_DC_Current(A)'], linestyle='-',marker='o', markersize='2',linewidth=1, label=measname)
+        ax.set_xlabel('PulseAmp(mA)')
+
+    ax.set_ylabel(r'$\Omega$')
+    ax.legend()
+    fig.savefig(FileName[:-4]+'_'+measname+'.png', dpi=600)
+    return fig
+
+
+def PlotSMR(FileName):
+    #Plot data
+    hlength, measnames, MeasType = ReadSMRHeader(FileName)
+    df = ReadSMRData(FileName, hlength)
+    #print(df)
+    if len(measnames) > 0:
+        df = GroupSMRData(df)
+    for measname in measnames:
+        RenderSMR(FileName, df, measname, MeasType)
+
+
+class LivePlotSMR:
+    # Plot of a data file that is being recorded. The figures and lines are made once and each new row is only
+    # appended to them, so the cost of a data point does not grow with the length of the run. The figures look
+    # like the ones of PlotSMR/RenderSMR; the PNGs (at high dpi) are only written by save().
+    def __init__(self, FileName, MeasurementNames, MeasurementType, ColumnNames):
+        self.FileName=FileName
+        self.MeasurementNames=list(MeasurementNames)
+        self.PlotType=SMRPlotType(MeasurementType)
+        self.ColumnNames=list(ColumnNames)
+        self.Figures={}
+        self.Axes={}
+        # One line per measurement and field group (only RvsAngle has more than one group), with its x and y data
+        self.Lines={}
+        self.Data={}
+        for measname in self.MeasurementNames:
+            fig,ax=plt.subplots()
+            plt.suptitle(FileName.split('/')[-1][:-4]+'_'+measname)
+            ax.set_xlabel({'RvsAngle':'Angle(deg)','RvsH':'Field(Oe)','RvsT':'Temp(K)','RvsPulseAmp':'PulseAmp(mA)'}.get(self.PlotType, ''))
+            ax.set_ylabel(r'$\Omega$')
+            self.Figures[measname]=fig
+            self.Axes[measname]=ax
+
+    def rowPoint(self, row):
+        # Group and x value of a row, as in RenderSMR
+        if self.PlotType == 'RvsAngle':
+            return SMRFieldName(custom_round(row['Field(Oe)'], base=5), row['PulseChannel']), float(row['Angle(deg)'])
+        elif self.PlotType == 'RvsH':
+            return '', float(row['Field(Oe)'])
+        elif self.PlotType == 'RvsT':
+            return '', float(row['Temp(K)'])
+        elif self.PlotType == 'RvsPulseAmp':
+            return '', float(row['PulseChannel'].split('>', 1)[1])*1e3
+        return None, None
+
+    def append(self, DataLine):
+        # Adds one data line (as written to the file) to the plots
+        row=dict(zip(self.ColumnNames, next(csv.reader([DataLine.strip()]))))
+        group, x=self.rowPoint(row)
+        if group is None:
+            return
+        for measname in self.MeasurementNames:
+            y=float(row[measname+'_Average_V'])/float(row[measname+'_DC_Current(A)'])
+            key=(measname, group)
+            if key not in self.Lines:
+                label=measname+'_{}'.format(group) if self.PlotType == 'RvsAngle' else measname
+                self.Lines[key],=self.Axes[measname].plot([], [], linestyle='-',marker='o', markersize='2',linewidth=1, label=label)
+                self.Data[key]=([], [])
+                self.Axes[measname].legend()
+            self.Data[key][0].append(x)
+            self.Data[key][1].append(y)
+            self.Lines[key].set_data(*self.Data[key])
+            self.Axes[measname].relim()
+            self.Axes[measname].autoscale_view()
+
+    def show(self):
+        # Redraws the figures: replaces the notebook output, or updates the figure windows outside of a notebook
+        if get_ipython() is not None:
+            display.clear_output(wait=True)
+            display.display(*self.Figures.values())
+        else:
+            for fig in self.Figures.values():
+                fig.canvas.draw_idle()
+                fig.canvas.flush_events()
+
+    def save(self, dpi=600):
+        # Writes the figures next to the data file, with the same names as RenderSMR
+        for measname, fig in self.Figures.items():
+            fig.savefig(self.FileName[:-4]+'_'+measname+'.png', dpi=dpi)
+
+    def close(self):
+        # Frees the figures (the saved PNGs and notebook output stay)
+        for fig in self.Figures.values():
+            plt.close(fig)
+
+      
+
+
+class LivePlotProcess:
+    # Same use as LivePlotSMR (append/show/save/close), but the plot lives in a worker process (see livePlotWorker).
+    # None of the methods wait for the worker.
+    def __init__(self, FileName, MeasurementNames, MeasurementType, ColumnNames, MaxRefreshRate=2, Backend=None):
+        self.FileName=FileName
+        Context=multiprocessing.get_context('spawn')
+        self.Queue=Context.Queue()
+        self.Process=Context.Process(target=livePlotWorker, args=(self.Queue, FileName, list(MeasurementNames), MeasurementType,
+                                                                  list(ColumnNames), MaxRefreshRate, Backend), daemon=True)
+        self.Process.start()
+        self.Rows=0
+
+    def append(self, DataLine):
+        self.Queue.put(('row', DataLine))
+        self.Rows+=1
+
+    def show(self):
+        # The worker redraws on its own
+        pass
+
+    def save(self, dpi=600):
+        self.Queue.put(('save', dpi))
+
+    def close(self):
+        # Last frame; the worker exits once its windows are closed (at once without windows)
+        self.Queue.put(('close', None))
+
+    def alive(self):
+        return self.Process.is_alive()
+
+
+def livePlotWorker(Queue, FileName, MeasurementNames, MeasurementType, ColumnNames, MaxRefreshRate=2, Backend=None):
+    # Worker process of LivePlotProcess: adds the rows from the queue to a LivePlotSMR and redraws it at most
+    # MaxRefreshRate times per second
+    if Backend is not None:
+        plt.switch_backend(Backend)
+    Interactive=plt.get_backend().lower() not in NONINTERACTIVE_BACKENDS
+    Plot=LivePlotSMR(FileName, MeasurementNames, MeasurementType, ColumnNames)
+    if Interactive:
+        plt.show(block=False)
+    Period=1/MaxRefreshRate
+    NextFrame=0
+    Pending=0
+    Frames=0
+    Dropped=0
+    Closing=False
+    while not Closing:
+        # Wait for rows, keeping the windows responsive (until they are closed)
+        Windows=[fig for fig in Plot.Figures.values() if Interactive and plt.fignum_exists(fig.number)]
+        Messages=[]
+        if len(Windows) > 0:
+            Windows[0].canvas.start_event_loop(min(Period, 0.05))
+        else:
+            try:
+                Messages.append(Queue.get(timeout=Period))
+            except queue.Empty:
+                pass
+        try:
+            while True:
+                Messages.append(Queue.get_nowait())
+        except queue.Empty:
+            pass
+        for Kind, Value in Messages:
+            if Kind == 'row':
+                Plot.append(Value)
+                Pending+=1
+            elif Kind == 'save':
+                Plot.save(dpi=Value)
+            elif Kind == 'close':
+                Closing=True
+        # One frame for all rows since the last one, at most every Period seconds
+        Now=time.monotonic()
+        if len(Windows) > 0 and Pending > 0 and (Now >= NextFrame or Closing):
+            Plot.show()
+            Frames+=1
+            Dropped+=Pending-1
+            Pending=0
+            NextFrame=Now+Period
+    if Interactive:
+        print('Live plot of {}: {} frames, {} dropped'.format(FileName, Frames, Dropped))
+        plt.show()
+    Plot.close()
+
+
+"""Example Commands"""
+
+"""
+#Plot a finished data file
+PlotSMR('./data/PPMS_RvsH/LMB713/0503_0900_2K_4e-5A_0deg_RvsH.csv')
+#Live plot in a worker process, redrawn at most once a second
+plot=LivePlotProcess(FileName, ['Rxx','Rxy'], 'RvsT_NoRotator', ColumnNames, MaxRefreshRate=1)
+plot.append('0,300,0,,0.001,0.5,1e-6,0.001,1e-5,1e-8\n')
+plot.save(dpi=600)
+plot.close()
+"""
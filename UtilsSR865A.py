@@ -1,33 +1,117 @@
 # Basic utilities for using the SR865A Lock-in Amplifier
 import pyvisa
-import time
+import math
 import numpy as np
+from UtilsClock import SystemClock
 
 sensitivity = {1:0, 0.1:3, 0.01:6, 0.001:9, 0.5:1, 0.00005:13,
                0.0001:12, 0.00001:15, 0.000001:18, 0.0002:11, 0.05:4, 0.00002:14}
+# Time constant (s) for each OFLT index: 1us, 3us, 10us, ... 30ks
+time_constants = [10**(i//2-6)*(3 if i%2 else 1) for i in range(22)]
+# Time for the output to settle to 99%, in time constants, for each OFSL index (6, 12, 18, 24 dB/oct)
+settle_time_constants = {0: 5, 1: 7, 2: 9, 3: 10}
+# Capture buffer: CAPTURECFG 3 records X, Y, R and theta as 4-byte floats. CAPTURELEN is in kB, must be even and
+# at most 4096 kB. CAPTUREGET? returns at most 64 kB per query.
+CAPTURE_XYRT = 3
+CAPTURE_BYTES_PER_SAMPLE = 16
+CAPTURE_MAX_KBYTES = 4096
+CAPTURE_GET_MAX_KBYTES = 64
                
 class Lockin:
-    def __init__(self, GPIBnum=10):
-        rm = pyvisa.ResourceManager()
-        self.lock_in = rm.open_resource('GPIB0::{}::INSTR'.format(GPIBnum))
+    def __init__(self, GPIBnum=10, clock=SystemClock, resource=None):
+        if resource is None:
+            rm = pyvisa.ResourceManager()
+            resource = rm.open_resource('GPIB0::{}::INSTR'.format(GPIBnum))
+        self.lock_in = resource
+        self.clock = clock
+        # Last written harmonic/sensitivity and the filter settings, so unchanged settings are not written again
+        self.harm = None
+        self.sens = None
+        self.time_constant = None
+        self.filter_slope = None
 
     def changeHarmonic(self, harm=1, sens=1):
-        self.lock_in.write("HARM {}".format(harm))
-        self.lock_in.write("SCAL {}".format(sensitivity[sens]))
-        print('set harmonic to {} with sensitivity {}\n'.format(harm,sensitivity[sens]))
+        # Only writes the settings that changed. Returns True if anything was written.
+        changed = False
+        if harm != self.harm:
+            self.lock_in.write("HARM {}".format(harm))
+            self.harm = harm
+            changed = True
+        if sens != self.sens:
+            self.lock_in.write("SCAL {}".format(sensitivity[sens]))
+            self.sens = sens
+            changed = True
+        if changed:
+            print('set harmonic to {} with sensitivity {}\n'.format(harm,sensitivity[sens]))
+        return changed
+
+    def readFilter(self):
+        # Reads the time constant and filter slope from the instrument (call again after changing them on the front panel)
+        self.time_constant = time_constants[int(self.lock_in.query("OFLT?").strip())]
+        self.filter_slope = int(self.lock_in.query("OFSL?").strip())
+        return self.time_constant, self.filter_slope
+
+    def settleTime(self):
+        # Time for the output to settle after a change, from the time constant and filter slope
+        if self.time_constant is None:
+            self.readFilter()
+        return self.time_constant*settle_time_constants[self.filter_slope]
 
     def readLockin(self):
-        x = float(self.lock_in.query("OUTP? 0").strip())
-        y = float(self.lock_in.query("OUTP? 1").strip())
-        r = float(self.lock_in.query("OUTP? 2").strip())
-        theta = float(self.lock_in.query("OUTP? 3").strip())
+        # X, Y and theta are taken at the same instant with one SNAP? query (at most 3 values); R is computed from X and Y
+        x, y, theta = [float(v) for v in self.lock_in.query("SNAP? 0,1,3").strip().split(',')]
+        r = float(np.hypot(x, y))
         return x, y, r, theta
 
+    def settle(self, harm, sens, wait_before_measure=None):
+        # Sets the harmonic/sensitivity and waits as described in measureLockin
+        changed = self.changeHarmonic(harm, sens)
+        if changed and wait_before_measure is not None:
+            self.clock.sleep(wait_before_measure, 'LockinSettle')
+        else:
+            self.clock.sleep(self.settleTime(), 'LockinSettle')
+
+    def captureLockin(self, samples=1024, rate=1000, wait_before_measure=None,
+                        harm=1, sens=0.00001, timeout=60):
+        # Records X, Y, R and theta in the internal capture buffer at (at least) rate samples/s and reads the whole
+        # buffer in 64 kB binary transfers. The number of samples is rounded up to fill whole 2 kB blocks (128 samples)
+        # and limited to the 4096 kB buffer (262144 samples).
+        # Returns the same means and standard deviations as measureLockin, plus a dict of the raw arrays
+        # ('x', 'y', 'r', 'theta' and 't', the time of each sample in s).
+        self.settle(harm, sens, wait_before_measure)
+        kbytes = min(CAPTURE_MAX_KBYTES, 2*math.ceil(samples*CAPTURE_BYTES_PER_SAMPLE/2048))
+        max_rate = float(self.lock_in.query("CAPTURERATEMAX?").strip())
+        # The capture rate is max_rate/2**n
+        n = int(min(20, max(0, math.floor(math.log2(max_rate/rate)))))
+        actual_rate = max_rate/2**n
+        self.lock_in.write("CAPTURELEN {}".format(kbytes))
+        self.lock_in.write("CAPTURECFG {}".format(CAPTURE_XYRT))
+        self.lock_in.write("CAPTURERATE {}".format(n))
+        # one shot, start immediately
+        self.lock_in.write("CAPTURESTART 0,0")
+        start = self.clock.time()
+        self.clock.sleep(kbytes*1024/CAPTURE_BYTES_PER_SAMPLE/actual_rate, 'LockinCapture')
+        while int(self.lock_in.query("CAPTUREBYTES?").strip()) < kbytes*1024:
+            if self.clock.time()-start > timeout:
+                self.lock_in.write("CAPTURESTOP")
+                raise TimeoutError('SR865A capture did not finish within {} s'.format(timeout))
+            self.clock.sleep(0.05, 'LockinCapture')
+        blocks = []
+        for offset in range(0, kbytes, CAPTURE_GET_MAX_KBYTES):
+            length = min(CAPTURE_GET_MAX_KBYTES, kbytes-offset)
+            blocks.append(self.lock_in.query_binary_values("CAPTUREGET? {},{}".format(offset, length), datatype='f',
+                                                           is_big_endian=False, container=np.array))
+        data = np.concatenate(blocks).reshape(-1, 4).astype(float)
+        raw = {'x': data[:,0], 'y': data[:,1], 'r': data[:,2], 'theta': data[:,3], 't': np.arange(len(data))/actual_rate}
+        return data[:,0].mean(), data[:,1].mean(), data[:,2].mean(), data[:,3].mean(), \
+               data[:,0].std(), data[:,1].std(), data[:,2].std(), data[:,3].std(), raw
+
     def measureLockin(self, count=10, time_step=0.1,
-                        wait_before_measure=10,
+                        wait_before_measure=None,
                         harm=1, sens=0.00001):
-        self.changeHarmonic(harm, sens)
-        time.sleep(wait_before_measure)
+        # Waits for the output to settle before measuring: wait_before_measure seconds if the harmonic or sensitivity
+        # changed and it is given, otherwise the settling time of the low pass filter (see settleTime).
+        self.settle(harm, sens, wait_before_measure)
         xs, ys, rs, thetas = [], [], [], []
         for i in range(count):
             x, y, r, theta = self.readLockin()
@@ -35,7 +119,7 @@ class Lockin:
             ys += [y]
             rs += [r]
             thetas += [theta]
-            time.sleep(time_step)
+            self.clock.sleep(time_step, 'LockinTimeStep')
         x_mean, x_std = np.mean(xs), np.std(xs)
         y_mean, y_std = np.mean(ys), np.std(ys)
         r_mean, r_std = np.mean(rs), np.std(rs)
@@ -54,4 +138,6 @@ rm.list_resources()
 #connect to and read lock-in
 lock=Lockin(GPIBnum=10)
 lock.readLockin()
+#record 1024 samples at ~1 kHz in the capture buffer and read them in one transfer
+x, y, r, theta, x_std, y_std, r_std, theta_std, raw = lock.captureLockin(samples=1024, rate=1000)
 """
\ No newline at end of file
@@ -0,0 +1,786 @@
+# Emulated instruments for running the measurement code without the lab hardware
+import math
+import numpy as np
+from UtilsPPMS import Dynacool
+from UtilsKeithley6221 import K6221
+from UtilsKeithley2182 import K2182
+from UtilsSR865A import Lockin
+from UtilsClock import VirtualClock
+from telnet import parseStatus
+
+'''
+----------------------
+SIMULATED INSTRUMENTS |
+----------------------
+
+All emulators share one SimRig, which holds the state of the PPMS, the current sources, the matrix switch
+and the sample. Every command sent to an emulated instrument costs a configurable latency, so the
+measurement protocols can be run (and timed) end-to-end on any computer.
+
+By default the rig runs on a VirtualClock, so every wait and latency is skipped and only added to the
+clock's budget (see UtilsClock.py). Give SimRig(Clock=Clock()) to run the emulators in real time.
+
+Use it by giving a rig to the BreakoutBoxConnections:
+    Rig=SimRig()
+    C=BreakoutBoxConnections(Simulation=Rig)
+Everything added afterwards (PPMS, switch and instruments) is emulated.
+'''
+
+# Default time cost (s) of one command for each device. Overwrite with SimRig(Latency={...}) or SimRig.setLatency.
+DEFAULT_LATENCY = {'PPMS':0.05,    # .NET call over the network to the MultiVu server
+                   '2182':0.02,    # GPIB query
+                   '2400':0.015,   # GPIB write through pymeasure
+                   '6221':0.01,    # GPIB write
+                   'SR865A':0.01,  # GPIB query
+                   'Switch':0.005} # telnet command and its reply, up to the prompt
+
+# Status codes returned by the emulated PPMS, indices into QDI_TEMP_STATUS / QDI_FIELD_STATUS in UtilsPPMS.py
+SIM_TEMP_STABLE, SIM_TEMP_NEAR, SIM_TEMP_CHASING = 1, 5, 6
+SIM_FIELD_STABLE_PERSISTENT, SIM_FIELD_STABLE_DRIVEN, SIM_FIELD_ITERATING, SIM_FIELD_CHARGING = 1, 2, 5, 6
+SIM_POSITION_STABLE, SIM_POSITION_MOVING = 1, 5
+
+
+class SimSample:
+    # Resistance model for one measurement route. Angle is in degrees, field in Oe and temperature in K.
+    # R = R0*(1+Alpha*(T-300))*(1+MR*cos^2(Angle-Phase)) + Hall*H
+    def __init__(self, R0=100, Alpha=1e-3, MR=1e-3, Phase=0, Hall=0):
+        self.R0=R0
+        self.Alpha=Alpha
+        self.MR=MR
+        self.Phase=Phase
+        self.Hall=Hall
+
+    def resistance(self, Temperature, Field, Angle):
+        # works on numbers and on numpy arrays
+        angular=np.cos(np.radians(Angle-self.Phase))**2
+        return self.R0*(1+self.Alpha*(Temperature-300))*(1+self.MR*angular)+self.Hall*Field
+
+
+class SimAxis:
+    # One PPMS axis (temperature, field or rotator) that ramps linearly to its setpoint and then settles.
+    # Rates are in units per second.
+    def __init__(self, Rig, Value, MaxRate, SettleTime, Noise):
+        self.Rig=Rig
+        self.Start=Value
+        self.Target=Value
+        self.MaxRate=MaxRate
+        self.Rate=MaxRate
+        self.SettleTime=SettleTime
+        self.Noise=Noise
+        self.StartTime=Rig.now()
+
+    def set(self, Target, Rate):
+        self.Start=self.value(Noise=False)
+        self.Target=Target
+        if Rate is None or Rate <= 0:
+            Rate=self.MaxRate
+        self.Rate=min(abs(Rate), self.MaxRate)
+        self.StartTime=self.Rig.now()
+
+    def rampEndTime(self):
+        return self.StartTime+abs(self.Target-self.Start)/self.Rate
+
+    def readyTime(self):
+        # Time at which the axis reports stable. Re-sending the current setpoint does not trigger a settle.
+        if self.Target == self.Start:
+            return self.StartTime
+        return self.rampEndTime()+self.SettleTime
+
+    def isRamping(self):
+        return self.Rig.now() < self.rampEndTime()
+
+    def isStable(self):
+        return self.Rig.now() >= self.readyTime()
+
+    def value(self, Noise=True):
+        elapsed=self.Rig.now()-self.StartTime
+        distance=self.Target-self.Start
+        if abs(distance) <= self.Rate*elapsed:
+            v=self.Target
+        else:
+            v=self.Start+math.copysign(self.Rate*elapsed, distance)
+        if Noise and self.Noise > 0:
+            v+=self.Rig.Random.normal(0, self.Noise)
+        return v
+
+
+class SimRig:
+    # Shared state of the emulated rig. Rates follow the PPMS units: TemperatureRate in K/min, FieldRate in Oe/s
+    # and RotatorSpeed in deg/s. SampleTimeConstant (s) is the thermal lag of the sample behind the PPMS
+    # thermometer. VoltageNoise is the rms noise of one voltmeter reading and ThermalOffset a constant
+    # thermal EMF that bipolar/delta measurements cancel.
+    def __init__(self, Temperature=300, Field=0, Angle=0, TemperatureRate=20, FieldRate=200, RotatorSpeed=5,
+                 TemperatureSettleTime=60, FieldSettleTime=5, RotatorSettleTime=0.5, SampleTimeConstant=60,
+                 TemperatureNoise=0.01, FieldNoise=0.5, AngleNoise=0.01, VoltageNoise=20e-9, ThermalOffset=1e-6,
+                 VoltmeterIntegrationTime=5/60, Latency={}, Seed=None, Clock=None):
+        self.Clock=Clock if Clock is not None else VirtualClock()
+        self.Latency=dict(DEFAULT_LATENCY)
+        self.Latency.update(Latency)
+        self.Random=np.random.RandomState(Seed)
+        self.CommandCount={}
+        self.Temperature=SimAxis(self, Temperature, TemperatureRate/60, TemperatureSettleTime, TemperatureNoise)
+        self.Field=SimAxis(self, Field, FieldRate, FieldSettleTime, FieldNoise)
+        self.Rotator=SimAxis(self, Angle, RotatorSpeed, RotatorSettleTime, AngleNoise)
+        self.SampleTimeConstant=SampleTimeConstant
+        self.SampleTemperatureValue=Temperature
+        self.SampleTemperatureTime=self.now()
+        self.VoltageNoise=VoltageNoise
+        self.ThermalOffset=ThermalOffset
+        self.VoltmeterIntegrationTime=VoltmeterIntegrationTime
+        self.DefaultSample=SimSample()
+        self.Samples={}
+        self.ConnectedPairs=set()
+        self.CurrentSources=[]
+        self.SineAmplitude=0
+        self.SineFrequency=0
+        self.PulseLog=[]
+        self.TriggerLink=[]
+
+    '''Timing and latency'''
+    def now(self):
+        return self.Clock.time()
+
+    def sleep(self, seconds, Label=None):
+        self.Clock.sleep(seconds, Label)
+
+    def setLatency(self, Device, Seconds, Command=None):
+        # Set the latency of every command to a device, or of a single command (e.g. Command='fetch?')
+        if Command is None:
+            self.Latency[Device]=Seconds
+        else:
+            self.Latency['{}:{}'.format(Device, Command.strip().split(' ')[0].lower())]=Seconds
+
+    def latency(self, Device, Command=''):
+        key='{}:{}'.format(Device, str(Command).strip().split(' ')[0].lower())
+        return self.Latency.get(key, self.Latency.get(Device, 0))
+
+    def delay(self, Device, Command=''):
+        # Charge the latency of one command and count it. The time is budgeted as 'IO:<Device>'.
+        self.CommandCount[Device]=self.CommandCount.get(Device, 0)+1
+        self.sleep(self.latency(Device, Command), 'IO:'+Device)
+
+    def resetCommandCount(self):
+        self.CommandCount={}
+
+    def triggerLink(self):
+        # A source put out a trigger link pulse; every 2182 waiting for an external trigger starts
+        for Meter in self.TriggerLink:
+            Meter.trigger()
+
+    '''Sample model'''
+    def setSample(self, Sample, SwitchPairs=None):
+        # Use Sample for the route made by connecting SwitchPairs (e.g. ['a,k','b,l']). Without SwitchPairs it becomes the default.
+        if SwitchPairs is None:
+            self.DefaultSample=Sample
+        else:
+            self.Samples[frozenset(SwitchPairs)]=Sample
+
+    def getSample(self):
+        return self.Samples.get(frozenset(self.ConnectedPairs), self.DefaultSample)
+
+    def sampleTemperature(self):
+        # The sample relaxes exponentially towards the PPMS temperature
+        now=self.now()
+        target=self.Temperature.value(Noise=False)
+        if self.SampleTimeConstant > 0:
+            self.SampleTemperatureValue+=(target-self.SampleTemperatureValue)*(1-math.exp(-(now-self.SampleTemperatureTime)/self.SampleTimeConstant))
+        else:
+            self.SampleTemperatureValue=target
+        self.SampleTemperatureTime=now
+        return self.SampleTemperatureValue
+
+    def resistance(self):
+        return self.getSample().resistance(self.sampleTemperature(), self.Field.value(Noise=False), self.Rotator.value(Noise=False))
+
+    def dcCurrent(self):
+        return sum(Source.outputCurrent() for Source in self.CurrentSources)
+
+    def readVoltage(self, Current=None, Offset=True):
+        # One noisy voltmeter reading for the given current (default: the DC current of the 2400s)
+        if Current is None:
+            Current=self.dcCurrent()
+        v=Current*self.resistance()+self.Random.normal(0, self.VoltageNoise)
+        if Offset:
+            v+=self.ThermalOffset
+        return v
+
+    '''Instrument factories (used by BreakoutBoxConnections)'''
+    def openPPMS(self, ip_address='SIMULATED'):
+        return SimDynacool(self, ip_address)
+
+    def openSwitch(self, ip='SIMULATED'):
+        return SimLinkBone(self, ip)
+
+    def open2182(self, GPIBnum=17):
+        Meter=SimK2182(self, GPIBnum)
+        self.TriggerLink.append(Meter.vm)
+        return Meter
+
+    def open2400(self, GPIBnum=15):
+        Source=SimKeithley2400(self, GPIBnum)
+        self.CurrentSources.append(Source)
+        return Source
+
+    def open6221(self, GPIBnum=16):
+        return SimK6221(self, GPIBnum)
+
+    def openSR865A(self, GPIBnum=10):
+        return SimLockin(self, GPIBnum)
+
+
+def splitMessage(message):
+    # Commands of a SCPI message joined with ';' (see CommandBatch in UtilsInstrumentState.py), without the root ':'
+    return [command.strip().lstrip(':') for command in message.split(';') if command.strip() != '']
+
+
+'''
+**************************************************************************************************
+PPMS
+**************************************************************************************************
+'''
+
+class SimQDInstrument:
+    # Emulates the QDInstrumentBase .NET object that Dynacool wraps. Like pythonnet with out parameters,
+    # the getters return (error, value, status).
+    def __init__(self, Rig):
+        self.Rig=Rig
+        self.FieldMode='Driven'
+
+    def GetTemperature(self, temperature, status):
+        self.Rig.delay('PPMS', 'GetTemperature')
+        T=self.Rig.Temperature
+        if T.isRamping():
+            code=SIM_TEMP_CHASING
+        elif not T.isStable():
+            code=SIM_TEMP_NEAR
+        else:
+            code=SIM_TEMP_STABLE
+        return 0, T.value(), code
+
+    def SetTemperature(self, temperature, rate, approach):
+        self.Rig.delay('PPMS', 'SetTemperature')
+        self.Rig.Temperature.set(temperature, rate/60)
+        return 0
+
+    def GetField(self, field, status):
+        self.Rig.delay('PPMS', 'GetField')
+        H=self.Rig.Field
+        if H.isRamping():
+            code=SIM_FIELD_CHARGING
+        elif not H.isStable():
+            code=SIM_FIELD_ITERATING
+        elif 'Persistent' in str(self.FieldMode):
+            code=SIM_FIELD_STABLE_PERSISTENT
+        else:
+            code=SIM_FIELD_STABLE_DRIVEN
+        return 0, H.value(), code
+
+    def SetField(self, field, rate, approach, mode):
+        self.Rig.delay('PPMS', 'SetField')
+        self.FieldMode=mode
+        self.Rig.Field.set(field, rate)
+        return 0
+
+    def GetPosition(self, axis, position, status):
+        self.Rig.delay('PPMS', 'GetPosition')
+        code=SIM_POSITION_STABLE if self.Rig.Rotator.isStable() else SIM_POSITION_MOVING
+        return 0, self.Rig.Rotator.value(), code
+
+    def SetPosition(self, axis, position, speed, mode):
+        self.Rig.delay('PPMS', 'SetPosition')
+        self.Rig.Rotator.set(position, speed)
+        return 0
+
+    def WaitFor(self, temperature, field, position, chamber, delay, timeout):
+        # Blocks until every selected axis is stable, then waits the extra delay. Returns 0, or 1 on timeout.
+        # The wait is not budgeted here: Dynacool budgets the whole call.
+        self.Rig.CommandCount['PPMS']=self.Rig.CommandCount.get('PPMS', 0)+1
+        latency=self.Rig.latency('PPMS', 'WaitFor')
+        Axes=[]
+        if temperature: Axes.append(self.Rig.Temperature)
+        if field: Axes.append(self.Rig.Field)
+        if position: Axes.append(self.Rig.Rotator)
+        ready=max([Axis.readyTime() for Axis in Axes]+[self.Rig.now()])
+        wait=ready-self.Rig.now()
+        if wait > timeout:
+            self.Rig.sleep(latency+timeout)
+            return 1
+        self.Rig.sleep(latency+wait+delay)
+        return 0
+
+
+class SimDynacool(Dynacool):
+    # Dynacool driver running on the emulated QDInstrument
+    def __init__(self, Rig, ip_address='SIMULATED'):
+        self.ip_address=ip_address
+        Dynacool.__init__(self, ip_address, clock=Rig.Clock, qdi_instrument=SimQDInstrument(Rig))
+
+
+'''
+**************************************************************************************************
+KEITHLEY 2182, 2400 AND 6221
+**************************************************************************************************
+'''
+
+class Sim2182Resource:
+    # Emulates the raw pyvisa resource of a Keithley 2182 nanovoltmeter. The meter takes a new reading every
+    # VoltmeterIntegrationTime, so fetching faster than that returns the same (stale) reading again.
+    # With TRAC:FEED:CONT NEXT the readings of an INIT go to the trace buffer, one per TRIG:TIM interval
+    # (but not faster than the integration time), and TRAC:DATA? returns them as binary values.
+    # With TRIG:SOUR EXT the INIT waits for a trigger link pulse (SimRig.triggerLink), then after TRIG:DEL takes
+    # SAMP:COUN readings back to back, one per SENS:VOLT:NPLC integration time.
+    def __init__(self, Rig, GPIBnum=17):
+        self.Rig=Rig
+        self.GPIBnum=GPIBnum
+        self.Settings={}
+        self.LastReadingIndex=None
+        self.LastReading=0.0
+        self.Buffer=np.array([])
+        self.RunStartTime=self.Rig.now()
+        self.RunInterval=0
+        self.WaitingForTrigger=False
+
+    def setting(self, name, default):
+        return float(self.Settings.get(name, default))
+
+    def fetch(self):
+        index=int(self.Rig.now()/self.Rig.VoltmeterIntegrationTime)
+        if index != self.LastReadingIndex:
+            self.LastReadingIndex=index
+            self.LastReading=self.Rig.readVoltage()
+        return self.LastReading
+
+    def availableReadings(self):
+        # Readings already stored in the trace buffer. The first one is taken one interval after INIT.
+        if self.RunInterval <= 0:
+            return self.Buffer
+        n=int((self.Rig.now()-self.RunStartTime)/self.RunInterval+1e-9)
+        return self.Buffer[:max(0, min(n, len(self.Buffer)))]
+
+    def write(self, message):
+        # One GPIB transaction, which may hold several ';' separated commands
+        self.Rig.delay('2182', message)
+        for command in splitMessage(message):
+            self.command(command)
+
+    def command(self, command):
+        parts=command.strip().split(' ', 1)
+        header=parts[0].upper()
+        if header == 'TRAC:CLE':
+            self.Buffer=np.array([])
+            self.RunInterval=0
+        elif header in ('INIT', 'INIT:IMM') and self.Settings.get('TRIG:SOUR', 'IMM').upper().startswith('EXT'):
+            self.Buffer=np.array([])
+            self.RunInterval=0
+            self.WaitingForTrigger=True
+        elif header in ('INIT', 'INIT:IMM') and self.Settings.get('TRAC:FEED:CONT', 'NEV').upper().startswith('NEXT'):
+            count=int(min(self.setting('TRIG:COUN', 1), self.setting('TRAC:POIN', 1024)))
+            self.Buffer=np.array([self.Rig.readVoltage() for i in range(count)], dtype=np.float32)
+            self.RunStartTime=self.Rig.now()
+            self.RunInterval=max(self.setting('TRIG:TIM', 0), self.Rig.VoltmeterIntegrationTime)
+        else:
+            self.Settings[header]=parts[1].strip() if len(parts) > 1 else ''
+
+    def query(self, command):
+        self.Rig.delay('2182', command)
+        c=command.strip().lower().lstrip(':')
+        if c in ('fetch?', 'read?', 'sens:data?', 'sens:data:fres?'):
+            return '{:.9E}\n'.format(self.fetch())
+        elif c == 'trac:poin:act?':
+            return '{}\n'.format(len(self.availableReadings()))
+        elif c == 'syst:err?':
+            return '0,"No error"\n'
+        elif c == '*idn?':
+            return 'KEITHLEY INSTRUMENTS INC.,MODEL 2182A,SIMULATED,0\n'
+        elif c == '*opc?':
+            return '1\n'
+        return '0\n'
+
+    def trigger(self):
+        # Trigger link pulse: start the readings of an armed external trigger acquisition
+        if not self.WaitingForTrigger:
+            return
+        self.WaitingForTrigger=False
+        count=int(min(self.setting('SAMP:COUN', 1), self.setting('TRAC:POIN', 1024)))
+        self.Buffer=np.array([self.Rig.readVoltage() for i in range(count)], dtype=np.float32)
+        self.RunStartTime=self.Rig.now()+self.setting('TRIG:DEL', 0)
+        self.RunInterval=self.setting('SENS:VOLT:NPLC', self.Rig.VoltmeterIntegrationTime*60)/60
+
+    def query_binary_values(self, command, datatype='f', is_big_endian=False, container=list):
+        # Only the trace buffer is available in binary format
+        self.Rig.delay('2182', command)
+        return container(np.array(self.availableReadings(), dtype=np.float32))
+
+    def close(self):
+        pass
+
+
+class SimK2182(K2182):
+    # K2182 driver running on the emulated resource
+    def __init__(self, Rig, GPIBnum=17):
+        K2182.__init__(self, GPIBnum, clock=Rig.Clock, resource=Sim2182Resource(Rig, GPIBnum))
+
+
+class SimKeithley2400:
+    # Emulates the pymeasure Keithley2400 controls used in MeasurementSettings. Every control costs one command.
+    def __init__(self, Rig, GPIBnum=15):
+        self.Rig=Rig
+        self.GPIBnum=GPIBnum
+        self.SourceMode='current'
+        self.SourceEnabled=False
+        self.OutputTrigger='NONE'
+        self.TriggerCurrent=None
+        self.Settings={'source_current':0.0, 'source_voltage':0.0, 'source_current_range':0.0,
+                       'source_voltage_range':0.0, 'compliance_voltage':0.0, 'compliance_current':0.0}
+
+    def _set(self, name, value):
+        self.Rig.delay('2400', name)
+        self.Settings[name]=value
+
+    source_current=property(lambda self: self.Settings['source_current'], lambda self, v: self._set('source_current', v))
+    source_voltage=property(lambda self: self.Settings['source_voltage'], lambda self, v: self._set('source_voltage', v))
+    source_current_range=property(lambda self: self.Settings['source_current_range'], lambda self, v: self._set('source_current_range', v))
+    source_voltage_range=property(lambda self: self.Settings['source_voltage_range'], lambda self, v: self._set('source_voltage_range', v))
+    compliance_voltage=property(lambda self: self.Settings['compliance_voltage'], lambda self, v: self._set('compliance_voltage', v))
+    compliance_current=property(lambda self: self.Settings['compliance_current'], lambda self, v: self._set('compliance_current', v))
+
+    @property
+    def id(self):
+        self.Rig.delay('2400', '*IDN?')
+        return 'KEITHLEY INSTRUMENTS INC.,MODEL 2400,SIMULATED,0'
+
+    def apply_current(self, current_range=None, compliance_voltage=0.1):
+        # pymeasure sends the source function, range and compliance as separate commands
+        for i in range(3):
+            self.Rig.delay('2400', 'apply_current')
+        self.SourceMode='current'
+
+    def apply_voltage(self, voltage_range=None, compliance_current=0.1):
+        for i in range(3):
+            self.Rig.delay('2400', 'apply_voltage')
+        self.SourceMode='voltage'
+
+    def enable_source(self):
+        self.Rig.delay('2400', 'OUTP ON')
+        self.SourceEnabled=True
+
+    def disable_source(self):
+        self.Rig.delay('2400', 'OUTP OFF')
+        self.SourceEnabled=False
+
+    def shutdown(self):
+        # pymeasure ramps the source to zero before turning the output off
+        self.source_current=0.0
+        self.disable_source()
+
+    def outputCurrent(self):
+        if self.SourceEnabled and self.SourceMode == 'current':
+            return self.Settings['source_current']
+        return 0.0
+
+    def write(self, message):
+        # Only the triggered source is emulated: an :INIT with the output on switches the current to the
+        # SOUR:CURR:TRIG level, and with :TRIG:OUTP SOUR pulses the trigger link at the same time
+        self.Rig.delay('2400', message)
+        for command in splitMessage(message):
+            parts=command.split(' ', 1)
+            header=parts[0].upper()
+            if header == 'TRIG:OUTP':
+                self.OutputTrigger=parts[1].strip().upper()
+            elif header == 'SOUR:CURR:TRIG':
+                self.TriggerCurrent=float(parts[1])
+            elif header in ('INIT', 'INIT:IMM') and self.SourceEnabled:
+                if self.TriggerCurrent is not None:
+                    self.Settings['source_current']=self.TriggerCurrent
+                if self.OutputTrigger.startswith('SOUR'):
+                    self.Rig.triggerLink()
+
+    def ask(self, command):
+        self.Rig.delay('2400', command)
+        if command.strip().lower() == '*opc?':
+            return '1\n'
+        return '0\n'
+
+
+class Sim6221Resource:
+    # Emulates the raw pyvisa resource of a Keithley 6221 with a 2182A attached for pulse delta.
+    # Pulse delta readings become available one per PDEL interval (in 60 Hz power line cycles) after INIT:IMM.
+    # Arming a waveform takes WaveArmTime; *OPC? only answers once it is done.
+    WaveArmTime=0.1
+
+    def __init__(self, Rig, GPIBnum=16):
+        self.Rig=Rig
+        self.GPIBnum=GPIBnum
+        self.timeout=2000
+        self.reset()
+
+    def reset(self):
+        self.Settings={}
+        self.Armed=False
+        self.Buffer=np.array([])
+        self.RunStartTime=self.Rig.now()
+        self.RunInterval=0
+        self.Calc2Value=0.0
+        self.BusyUntil=self.Rig.now()
+
+    def setting(self, name, default):
+        return float(self.Settings.get(name, default))
+
+    def availableReadings(self):
+        # Readings already taken in the current pulse delta run
+        if self.RunInterval <= 0:
+            return self.Buffer
+        n=int((self.Rig.now()-self.RunStartTime)/self.RunInterval+1e-9)
+        return self.Buffer[:max(0, min(n, len(self.Buffer)))]
+
+    def write(self, message):
+        # One GPIB transaction, which may hold several ';' separated commands
+        self.Rig.delay('6221', message)
+        for command in splitMessage(message):
+            self.command(command)
+
+    def command(self, command):
+        parts=command.strip().split(' ', 1)
+        header=parts[0].upper()
+        argument=parts[1].strip() if len(parts) > 1 else ''
+        if header == '*RST':
+            self.reset()
+        elif header in ('SOUR:PDEL:ARM', 'SOUR:DELT:ARM'):
+            self.Armed=header.split(':')[1]
+        elif header == 'SOUR:WAVE:ARM':
+            self.BusyUntil=self.Rig.now()+self.WaveArmTime
+        elif header == 'INIT:IMM' and self.Armed:
+            amp=self.setting('SOUR:{}:HIGH'.format(self.Armed), 1e-5)
+            count=int(self.setting('SOUR:{}:COUN'.format(self.Armed), 10))
+            self.Buffer=np.array([self.Rig.readVoltage(Current=amp, Offset=False) for i in range(count)])
+            self.RunStartTime=self.Rig.now()
+            if self.Armed == 'PDEL':
+                self.RunInterval=self.setting('SOUR:PDEL:INT', 5)/60
+            else:
+                # one delta reading per alternation: source delay plus the 2182 integration time
+                self.RunInterval=self.setting('SOUR:DELT:DEL', 2e-3)+self.setting('2182:VOLT:NPLC', 5)/60
+        elif header == 'SYST:COMM:SER:SEND':
+            # Command passed on to the 2182 over RS-232, e.g. 'VOLT:NPLC 1'
+            inner=argument.strip("'").split(' ', 1)
+            self.Settings['2182:'+inner[0].upper()]=inner[1] if len(inner) > 1 else ''
+        elif header in ('SOUR:SWE:ABOR', 'SOUR:WAVE:ABOR'):
+            self.Armed=False
+            self.Rig.SineAmplitude=0
+        elif header == 'SOUR:WAVE:INIT':
+            if 'SIN' in self.Settings.get('SOUR:WAVE:FUNC', ''):
+                self.Rig.SineAmplitude=self.setting('SOUR:WAVE:AMPL', 0)
+                self.Rig.SineFrequency=self.setting('SOUR:WAVE:FREQ', 0)
+            else:
+                self.Rig.PulseLog.append((self.Rig.now(), self.setting('SOUR:WAVE:AMPL', 0), self.Settings.get('SOUR:WAVE:DUR:TIME', '')))
+        elif header == 'CALC2:IMM':
+            readings=self.availableReadings()
+            if len(readings) == 0:
+                self.Calc2Value=float('nan')
+            elif self.Settings.get('CALC2:FORM', 'MEAN').upper().startswith('SDEV'):
+                self.Calc2Value=np.std(readings, ddof=1) if len(readings) > 1 else 0.0
+            else:
+                self.Calc2Value=np.mean(readings)
+        else:
+            self.Settings[header]=argument
+
+    def query(self, command):
+        self.Rig.delay('6221', command)
+        c=command.strip().upper()
+        if c == 'SOUR:DELT:NVPR?':
+            return '1\n'
+        elif c == 'CALC2:DATA?':
+            return '{:.9E}\n'.format(self.Calc2Value)
+        elif c == 'TRAC:POIN:ACT?':
+            return '{}\n'.format(len(self.availableReadings()))
+        elif c == 'SYST:ERR?':
+            return '0,"No error"\n'
+        elif c == 'TRAC:DATA?':
+            return ','.join('{:.9E}'.format(v) for v in self.availableReadings())+'\n'
+        elif c == '*IDN?':
+            return 'KEITHLEY INSTRUMENTS INC.,MODEL 6221,SIMULATED,0\n'
+        elif c == '*OPC?':
+            if self.BusyUntil-self.Rig.now() > self.timeout/1000:
+                raise TimeoutError('VI_ERROR_TMO (-1073807339): Timeout expired before operation completed.')
+            self.Rig.sleep(self.BusyUntil-self.Rig.now(), 'WaitOPC')
+            return '1\n'
+        return '0\n'
+
+    def query_binary_values(self, command, datatype='f', is_big_endian=False, container=list):
+        # Only the trace buffer is available in binary format, with the elements set by FORM:ELEM
+        self.Rig.delay('6221', command)
+        readings=self.availableReadings()
+        if 'TST' in self.Settings.get('FORM:ELEM', 'READ').upper():
+            times=np.arange(len(readings))*self.RunInterval
+            data=np.column_stack([readings, times]).ravel()
+        else:
+            data=readings
+        return container(np.array(data, dtype=np.float32))
+
+    def close(self):
+        pass
+
+
+class SimK6221(K6221):
+    # K6221 driver running on the emulated resource
+    def __init__(self, Rig, GPIBnum=16):
+        K6221.__init__(self, GPIBnum, clock=Rig.Clock, resource=Sim6221Resource(Rig, GPIBnum))
+
+
+'''
+**************************************************************************************************
+SR865A LOCK-IN
+**************************************************************************************************
+'''
+
+class SimSR865AResource:
+    # Emulates the raw pyvisa resource of the SR865A. The reference is the 6221 sine output, so the
+    # first harmonic X is the rms current times the resistance of the connected route.
+    def __init__(self, Rig, GPIBnum=10):
+        self.Rig=Rig
+        self.GPIBnum=GPIBnum
+        self.Settings={'HARM':'1', 'SCAL':'0', 'OFLT':'10', 'OFSL':'1'}
+        self.CaptureMaxRate=1.25e6
+        self.CaptureStart=None
+
+    def write(self, command):
+        self.Rig.delay('SR865A', command)
+        parts=command.strip().split(' ', 1)
+        self.Settings[parts[0].upper()]=parts[1].strip() if len(parts) > 1 else ''
+        if parts[0].upper() == 'CAPTURESTART':
+            self.CaptureStart=self.Rig.now()
+
+    def captureBytes(self):
+        # Bytes written to the capture buffer since CAPTURESTART (XYRT, 16 bytes per sample)
+        if self.CaptureStart is None:
+            return 0
+        Rate=self.CaptureMaxRate/2**int(self.Settings.get('CAPTURERATE', '0'))
+        Total=int(self.Settings.get('CAPTURELEN', '2'))*1024
+        return min(Total, int((self.Rig.now()-self.CaptureStart)*Rate)*16)
+
+    def query_binary_values(self, command, datatype='f', is_big_endian=False, container=list):
+        # CAPTUREGET? offset,length (kB): X, Y, R, theta of the captured samples in that part of the buffer
+        self.Rig.delay('SR865A', command)
+        Offset,Length=[int(x) for x in command.strip().split(' ', 1)[1].split(',')]
+        if Length > 64:
+            raise ValueError('CAPTUREGET? can read at most 64 kB')
+        Samples=max(0, min(Offset+Length, self.captureBytes()//1024)-Offset)*1024//16
+        Data=np.array([self.readOutputs() for i in range(Samples)], dtype=np.float32).ravel()
+        return container(Data)
+
+    def readOutputs(self):
+        if self.Settings.get('HARM', '1') == '1':
+            x=self.Rig.SineAmplitude/math.sqrt(2)*self.Rig.resistance()
+        else:
+            x=0.0
+        x+=self.Rig.Random.normal(0, self.Rig.VoltageNoise)
+        y=self.Rig.Random.normal(0, self.Rig.VoltageNoise)
+        return x, y, math.hypot(x, y), math.degrees(math.atan2(y, x))
+
+    def query(self, command):
+        self.Rig.delay('SR865A', command)
+        parts=command.strip().upper().split(' ', 1)
+        if parts[0] == 'OUTP?':
+            return '{:.9E}\n'.format(self.readOutputs()[int(parts[1])])
+        elif parts[0] == 'CAPTURERATEMAX?':
+            return '{:.6E}\n'.format(self.CaptureMaxRate)
+        elif parts[0] == 'CAPTUREBYTES?':
+            return '{}\n'.format(self.captureBytes())
+        elif parts[0] == 'SNAP?':
+            outputs=self.readOutputs()
+            return ','.join('{:.9E}'.format(outputs[int(i)]) for i in parts[1].split(','))+'\n'
+        elif parts[0] == '*IDN?':
+            return 'Stanford_Research_Systems,SR865A,SIMULATED,0\n'
+        elif parts[0] == '*OPC?':
+            return '1\n'
+        elif parts[0].endswith('?'):
+            return '{}\n'.format(self.Settings.get(parts[0][:-1], '0'))
+        return '0\n'
+
+    def close(self):
+        pass
+
+
+class SimLockin(Lockin):
+    # Lockin driver running on the emulated resource
+    def __init__(self, Rig, GPIBnum=10):
+        Lockin.__init__(self, GPIBnum, clock=Rig.Clock, resource=SimSR865AResource(Rig, GPIBnum))
+
+
+'''
+**************************************************************************************************
+LINKBONE MATRIX SWITCH
+**************************************************************************************************
+'''
+
+class SimLinkBone:
+    # Emulates telnet.telnet for the LinkBone matrix switch. Keeps track of the connected crosspoints
+    # so the rig knows which sample route is being measured.
+    def __init__(self, Rig, ip='SIMULATED'):
+        self.Rig=Rig
+        self.ip=ip
+        self.run=1
+
+    def pingSwitch(self):
+        self.Rig.delay('Switch', 'ping')
+
+    def statusString(self):
+        if len(self.Rig.ConnectedPairs) == 0:
+            return 'NC'
+        return '\n'.join('on {}'.format(Pair) for Pair in sorted(self.Rig.ConnectedPairs))
+
+    def status(self):
+        self.Rig.delay('Switch', 'status')
+        return parseStatus(self.statusString())
+
+    def getStatus(self):
+        self.Rig.delay('Switch', 'status')
+        print(self.statusString())
+
+    def getHelp(self):
+        self.Rig.delay('Switch', 'help')
+        print('Simulated LinkBone switch. Commands: on x,y | off x,y | reset | status | info | help | ping')
+
+    def getInfo(self):
+        self.Rig.delay('Switch', 'info')
+        print('Simulated LinkBone switch at {}'.format(self.ip))
+
+    def sendCommand(self, command):
+        self.Rig.delay('Switch', command)
+        self.command(command)
+
+    def sendCommands(self, commands):
+        # Several commands in one network message, one per line
+        self.Rig.delay('Switch', commands[0] if len(commands) > 0 else '')
+        for command in commands:
+            self.command(command)
+
+    def command(self, command):
+        parts=str(command).strip().split()
+        if len(parts) == 0:
+            return
+        if parts[0] == 'reset':
+            self.Rig.ConnectedPairs.clear()
+        elif parts[0] == 'on' and len(parts) > 1:
+            self.Rig.ConnectedPairs.add(parts[1])
+        elif parts[0] == 'off' and len(parts) > 1:
+            self.Rig.ConnectedPairs.discard(parts[1])
+        else:
+            print('Simulated switch: unknown command {}'.format(command))
+
+    def close(self):
+        self.run=0
+
+
+"""Example Commands"""
+
+"""
+#Run an angular scan on the emulated rig
+Rig=SimRig(Latency={'PPMS':0.01})
+Rig.setSample(SimSample(R0=500, MR=2e-3), SwitchPairs=['a,k'])
+C=BreakoutBoxConnections(Simulation=Rig)
+C.addMatrixSwitch()
+C.addPPMS()
+...
+print(Rig.CommandCount)
+print(Rig.Clock.budgetString())
+"""
@@ -7,80 +7,261 @@
 //        www.linkbone.com                            //
 //****************************************************//
 '''
- 
-import time
+'''
+----------------
+REPLY HANDLING |
+----------------
+
+The LinkBone is driven over a plain TCP socket (telnetlib is gone from current Python). Telnet option requests from
+the device are refused and stripped from the replies. After each command the reply is read until the device prompt
+comes back, or, if the device turns out not to repeat the prompt after a reply (checked with a ping on connecting),
+until the line has been quiet for Quiet seconds. So a command takes as long as the device needs instead of a fixed
+sleep. A command without any reply gives up after ReplyWait seconds. The time each exchange took is kept in
+LastLatency/TotalLatency/MaxLatency.
+
+All exchanges (including the keepalive ping, which runs on its own thread) go through one lock, so a ping can never
+end up in the middle of a measurement command and its reply.
+'''
+
+import re
+import socket
 import threading
-import telnetlib
- 
+import time
+
+# Telnet protocol bytes (RFC 854)
+IAC, DONT, DO, WONT, WILL, SB, SE = 255, 254, 253, 252, 251, 250, 240
+
+
+def parseStatus(text):
+    # Machine readable version of the status reply: the crosspoints that are on (e.g. {'a,p','b,n'}), any
+    # 'key: value' lines, and the raw text. 'NC' means nothing is connected.
+    Status={'connected':set(), 'fields':{}, 'text':text}
+    for line in text.splitlines():
+        line=line.strip()
+        if line == '' or line.upper() == 'NC':
+            continue
+        Pairs=re.findall(r'\b([A-Za-z0-9]+)\s*,\s*([A-Za-z0-9]+)\b', line)
+        if len(Pairs) > 0:
+            if not re.search(r'\boff\b', line, re.IGNORECASE):
+                Status['connected'].update('{},{}'.format(a, b) for a, b in Pairs)
+        elif ':' in line:
+            key, value=line.split(':', 1)
+            Status['fields'][key.strip()]=value.strip()
+    return Status
+
+
 class telnet:
-    def __init__(self, ip):
+    port = 23
+    prompt = b'Please enter your command:'
+    #Longest wait (s) for the first byte of the reply to a command (status, help and info wait up to timeout),
+    #and the quiet time (s) that ends a reply without a prompt
+    ReplyWait = 0.1
+    timeout = 2
+    Quiet = 0.02
+    #Seconds between keepalive pings (only sent when the connection was idle that long)
+    keepalive = 30
+
+    def __init__(self, ip, port=None, Verbose=True):
         self.ip = ip
+        if port is not None:
+            self.port = port
+        self.Verbose = Verbose
+        self.sock = None
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.pending = b''
+        #Whether the device repeats the prompt after every reply (see probePrompt)
+        self.PromptEcho = False
+        self.LastUsed = time.perf_counter()
+        self.LastLatency = 0
+        self.TotalLatency = 0
+        self.MaxLatency = 0
+        self.Exchanges = 0
         try:
-            tn = telnetlib.Telnet(ip)
+            self.sock = socket.create_connection((ip, self.port), timeout=self.timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.lock:
+                self.readReply(wait=self.timeout)
+                self.probePrompt()
             print("Telnet connection to LinkBone has been established!")
-            self.tn = tn
-            self.thread = threading.Timer(30, self.pingSwitch)
-            self.run = 1
+            self.thread = threading.Thread(target=self.keepAlive, daemon=True)
             self.thread.start()
-            tn.read_until(b'Hello. Please enter your command:')
-        except:
+        except OSError:
+            self.sock = None
             print("Cannot connect via telnet to LinkBone!")
- 
-    # keep telnet connection alive to XLR switch or BNC switch
-    def pingSwitch(self):
+
+    @property
+    def run(self):
+        return not self.stop.is_set()
+
+    # strip telnet negotiation from the received bytes and refuse every option the device asks for
+    def telnetFilter(self, data):
+        data = self.pending + data
+        self.pending = b''
+        out = bytearray()
+        i = 0
+        while i < len(data):
+            if data[i] != IAC:
+                out.append(data[i])
+                i += 1
+                continue
+            if i+1 >= len(data):
+                self.pending = data[i:]
+                break
+            command = data[i+1]
+            if command == IAC:
+                out.append(IAC)
+                i += 2
+            elif command in (DO, DONT, WILL, WONT):
+                if i+2 >= len(data):
+                    self.pending = data[i:]
+                    break
+                if command == DO:
+                    self.sock.sendall(bytes([IAC, WONT, data[i+2]]))
+                elif command == WILL:
+                    self.sock.sendall(bytes([IAC, DONT, data[i+2]]))
+                i += 3
+            elif command == SB:
+                end = data.find(bytes([IAC, SE]), i)
+                if end < 0:
+                    self.pending = data[i:]
+                    break
+                i = end+2
+            else:
+                i += 2
+        return bytes(out)
+
+    # find out if the device repeats the prompt after a reply: wait (up to timeout) for it after the pong
+    def probePrompt(self):
+        self.sock.sendall(b'ping\n')
+        self.PromptEcho = True
+        self.PromptEcho = self.prompt.decode() in self.readReply(wait=self.timeout)
+
+    # throw away whatever is left of earlier replies (e.g. the end of a reply cut off by the quiet time)
+    def drain(self):
+        self.sock.settimeout(0)
         try:
-            while self.run:
-                self.tn.write(b'ping\n')
-                self.tn.read_until(b'Pong.')
-                time.sleep(30)
-        except:
+            while True:
+                chunk = self.sock.recv(4096)
+                if chunk == b'':
+                    raise ConnectionError('LinkBone at {} closed the connection.'.format(self.ip))
+                self.telnetFilter(chunk)
+        except (BlockingIOError, socket.timeout):
             pass
- 
-    # print information about status of the XLR switch or BNC switch
-    def getStatus(self):
-        self.tn.write(b'status\r')
-        time.sleep(1)
-        while 1:
-            status = self.tn.read_very_eager()
-            if status:
-                print(status.decode())
+
+    # read one reply: up to the prompts-th prompt, or, if the device does not echo the prompt, until no byte came
+    # for Quiet seconds. Call with the lock held.
+    def readReply(self, prompts=1, wait=None):
+        if wait is None:
+            wait = self.ReplyWait
+        data = b''
+        start = time.perf_counter()
+        while data.count(self.prompt) < prompts:
+            if data == b'':
+                remaining = wait-(time.perf_counter()-start)
+                if remaining <= 0:
+                    break
+                self.sock.settimeout(remaining)
+            elif self.PromptEcho:
+                self.sock.settimeout(self.timeout)
             else:
+                self.sock.settimeout(self.Quiet)
+            try:
+                chunk = self.sock.recv(4096)
+            except socket.timeout:
                 break
- 
+            if chunk == b'':
+                raise ConnectionError('LinkBone at {} closed the connection.'.format(self.ip))
+            data += self.telnetFilter(chunk)
+        return data.decode(errors='replace')
+
+    # send lines and return the reply, timing the exchange
+    def exchange(self, lines, wait=None):
+        if self.sock is None:
+            raise ConnectionError('Not connected to the LinkBone at {}.'.format(self.ip))
+        with self.lock:
+            self.drain()
+            start = time.perf_counter()
+            self.sock.sendall(''.join(str(line)+'\n' for line in lines).encode())
+            reply = self.readReply(prompts=len(lines), wait=wait)
+            self.LastUsed = time.perf_counter()
+            self.LastLatency = self.LastUsed-start
+            self.TotalLatency += self.LastLatency
+            self.MaxLatency = max(self.MaxLatency, self.LastLatency)
+            self.Exchanges += 1
+        return self.stripPrompt(reply)
+
+    def stripPrompt(self, reply):
+        return reply.replace(self.prompt.decode(), '').strip()
+
+    # keep telnet connection alive to XLR switch or BNC switch
+    def keepAlive(self):
+        while not self.stop.wait(self.keepalive):
+            if time.perf_counter()-self.LastUsed >= self.keepalive:
+                try:
+                    self.pingSwitch()
+                except OSError:
+                    pass
+
+    def pingSwitch(self):
+        return self.exchange(['ping'])
+
+    # text reply of a command
+    def query(self, command, wait=None):
+        return self.exchange([command], wait=wait)
+
+    # parsed status of the XLR switch or BNC switch (see parseStatus)
+    def status(self):
+        return parseStatus(self.query('status', wait=self.timeout))
+
+    # print information about status of the XLR switch or BNC switch
+    def getStatus(self):
+        print(self.query('status', wait=self.timeout))
+
     # print list of available commands
     def getHelp(self):
-        self.tn.write(b'help\r')
-        time.sleep(1)
-        while 1:
-            status = self.tn.read_very_eager()
-            if status:
-                print(status.decode())
-            else:
-                break
- 
+        print(self.query('help', wait=self.timeout))
+
     # print information about XLR switch or BNC switch device
     def getInfo(self):
-        self.tn.write(b'info\r')
-        time.sleep(1)
-        while 1:
-            status = self.tn.read_very_eager()
-            if status:
-                print(status.decode())
-            else:
-                break
- 
+        print(self.query('info', wait=self.timeout))
+
     # send text command to LinkBone XLR switch or BNC Switch
     def sendCommand(self, command):
-        self.tn.write(b''+str(command).encode()+'\n'.encode())
-        time.sleep(.1)
-        while 1:
-            data = self.tn.read_very_eager()
-            if data:
-                print(data.decode())
-            else:
-                break
- 
+        reply = self.query(command)
+        if self.Verbose and reply:
+            print(reply)
+        return reply
+
+    # send several text commands in one write (one per line) and read all replies
+    def sendCommands(self, commands):
+        if len(commands) == 0:
+            return ''
+        reply = self.exchange(commands)
+        if self.Verbose and reply:
+            print(reply)
+        return reply
+
+    def latencyString(self):
+        return 'LinkBone: {} exchanges, last {:.1f} ms, mean {:.1f} ms, max {:.1f} ms'.format(
+            self.Exchanges, 1e3*self.LastLatency, 1e3*self.TotalLatency/max(self.Exchanges, 1), 1e3*self.MaxLatency)
+
     # close telnet connection
     def close(self):
-        self.run=0
-        self.tn.close()
\ No newline at end of file
+        self.stop.set()
+        if self.sock is not None:
+            with self.lock:
+                self.sock.close()
+            self.sock = None
+
+
+"""Example Commands"""
+
+"""
+#Connect to the switch and route a Hall bar
+switch=telnet('192.168.0.8')
+switch.sendCommands(['reset', 'on e,k', 'on c,l', 'on a,p', 'on b,n'])
+switch.status()['connected']
+print(switch.latencyString())
+switch.close()
+"""